@@ -0,0 +1,105 @@
+"""In-memory prefix index of actor names.
+
+Actor names change only on imports and occasional edits, so autocomplete
+can search sorted arrays of normalized names in the current process
+instead of querying the database on each keystroke.
+
+The index is built lazily and rebuilt, when the version stamp stored in
+the cache changes. The stamp is bumped on each Actor save or delete, and
+by bulk imports, which do not send signals.
+
+"""
+
+import bisect
+import collections
+import threading
+import uuid
+
+from django.core.cache import cache
+
+from manopozicija import models
+from manopozicija import services
+
+
+VERSION_KEY = 'manopozicija:actors:version'
+
+Entry = collections.namedtuple('Entry', ['pk', 'label', 'photo'])
+Entry.__doc__ = """Actor data needed to render an autocomplete result.
+
+Attributes
+----------
+
+pk : int
+    Actor id.
+
+label : str
+    Same as str(actor).
+
+photo : str
+    Photo file name, empty string if actor does not have a photo.
+
+"""
+
+
+class ActorIndex(object):
+    """Sorted arrays of normalized first and last names.
+
+    Entries are kept in the same order as autocomplete results: actors
+    with photos first, then by last and first name.
+
+    """
+
+    def __init__(self, version, actors):
+        actors = sorted(actors, key=lambda x: (x[3] == '', x[2], x[1]))
+        self.version = version
+        self.entries = [Entry(pk, ' '.join([first_name, last_name]), photo) for pk, first_name, last_name, photo in actors]
+        keys = sorted(
+            (services.clean_name(name), rank)
+            for rank, (pk, first_name, last_name, photo) in enumerate(actors)
+            for name in (first_name, last_name) if name
+        )
+        self.keys = [key for key, rank in keys]
+        self.ranks = [rank for key, rank in keys]
+
+    def search(self, q):
+        """Return entries, where first or last name starts with q."""
+        q = services.clean_name(q)
+        if not q:
+            return self.entries
+        start = bisect.bisect_left(self.keys, q)
+        end = bisect.bisect_left(self.keys, q + '\uffff', start)
+        return [self.entries[rank] for rank in sorted(set(self.ranks[start:end]))]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def bump_version():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def get_version():
+    return cache.get_or_set(VERSION_KEY, lambda: uuid.uuid4().hex, timeout=None)
+
+
+def build_index(version=None):
+    return ActorIndex(
+        version or get_version(),
+        models.Actor.objects.values_list('pk', 'first_name', 'last_name', 'photo').iterator(),
+    )
+
+
+def get_index():
+    """Return actor index, rebuilt if actors have changed."""
+    global _index
+    version = get_version()
+    if _index is None or _index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = build_index(version)
+    return _index
+
+
+def search(q):
+    return get_index().search(q)
@@ -1,6 +1,4 @@
 import uuid
-import os.path
-import pandas as pd
 import posixpath
 import panavatar
 import datetime
@@ -13,6 +11,7 @@ from django.core.files.base import ContentFile
 
 from sorl.thumbnail.admin import AdminImageMixin
 
+from manopozicija import indicators
 from manopozicija import models
 
 
@@ -29,6 +28,12 @@ class IndicatorAdmin(admin.ModelAdmin):
         'last_update',
         'error_count',
         'traceback',
+        'etag',
+        'last_modified',
+        'content_hash',
+        'fetch_time',
+        'download_time',
+        'bytes_downloaded',
         'indicator_file',
         'indicator_preview',
     )
@@ -40,8 +45,7 @@ class IndicatorAdmin(admin.ModelAdmin):
 
     def indicator_preview(self, instance):
         if instance.slug:
-            indicators_dir = os.path.join(settings.MEDIA_ROOT, 'indicators')
-            frame = pd.read_csv(os.path.join(indicators_dir, '%s.csv' % instance.slug))
+            frame = indicators.get_indicator_frame(instance)
             return mark_safe('<div style="float:left;">%s</div>' % ''.join(frame.head(10).to_html().splitlines()))
 
     indicator_preview.short_description = _('Indicator preview')
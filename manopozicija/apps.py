@@ -0,0 +1,11 @@
+from django.apps import AppConfig
+
+
+class ManopozicijaConfig(AppConfig):
+    name = 'manopozicija'
+
+    def ready(self):
+        from django.db.models import CharField
+        from manopozicija import signals  # noqa
+        from manopozicija.db import Search
+        CharField.register_lookup(Search)
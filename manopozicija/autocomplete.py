@@ -1,32 +1,70 @@
+import hashlib
+
 from dal import autocomplete
-from sorl.thumbnail import get_thumbnail
 
-from django.db.models import IntegerField
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import IntegerField, Value
 from django.db.models import Q, Case, When
+from django.db.models.functions import Lower
+from django.http import HttpResponse
 
 from manopozicija import models
+from manopozicija import actorindex
+from manopozicija import thumbnails
+from manopozicija.db import Unaccent
+
+
+def search(q):
+    """Return actors, where first or last name starts with q.
+
+    Case and accents are ignored, using trigram indexes created in
+    migrations. Actors with photos are returned first.
+
+    """
+    qs = models.Actor.objects.all()
+    q = q.strip()
+    if q:
+        q = Unaccent(Lower(Value(q)))
+        qs = qs.filter(Q(first_name__search__startswith=q) | Q(last_name__search__startswith=q))
+    return (
+        qs.
+        annotate(hasphoto=Case(When(photo='', then=1), default=0, output_field=IntegerField())).
+        order_by('hasphoto', 'last_name', 'first_name')
+    )
 
 
 class Person(autocomplete.Select2QuerySetView):
 
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return super().get(request, *args, **kwargs)
+
+        # Results are the same for all users, cache them per query and page.
+        query = '%s\n%s' % (self.q.strip().lower(), request.GET.get('page', ''))
+        key = 'manopozicija:autocomplete:actor:%s' % hashlib.md5(query.encode('utf-8')).hexdigest()
+        content = cache.get(key)
+        if content is None:
+            content = super().get(request, *args, **kwargs).content
+            cache.set(key, content, settings.MANOPOZICIJA_AUTOCOMPLETE_CACHE_TIMEOUT)
+        return HttpResponse(content, content_type='application/json')
+
+    def get_results(self, context):
+        self.photos = thumbnails.get_urls([str(x.photo) for x in context['object_list'] if x.photo])
+        return super().get_results(context)
+
     def get_result_label(self, item):
-        if item.photo:
-            im = get_thumbnail(item.photo, '40x40', crop="50% 0%", background="#FFF")
-            return '<img src="%s" /> %s' % (im.url, item)
+        # Results are actorindex.Entry instances, if actor index is used.
+        label = item.label if isinstance(item, actorindex.Entry) else str(item)
+        if item.photo and self.photos.get(str(item.photo)):
+            return '<img src="%s" /> %s' % (self.photos[str(item.photo)], label)
         else:
-            return str(item)
+            return label
 
     def get_queryset(self):
         if self.request.user.is_authenticated:
-            if self.q:
-                q = Q(first_name__istartswith=self.q) | Q(last_name__istartswith=self.q)
-            else:
-                q = Q()
-            return (
-                models.Actor.objects.
-                annotate(hasphoto=Case(When(photo='', then=1), default=0, output_field=IntegerField())).
-                filter(q).
-                order_by('hasphoto', 'last_name', 'first_name')
-            )
+            if settings.MANOPOZICIJA_ACTOR_INDEX:
+                return actorindex.search(self.q)
+            return search(self.q)
         else:
             return models.Actor.objects.none()
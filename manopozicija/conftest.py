@@ -2,6 +2,8 @@ import pytest
 
 from django_webtest import DjangoTestApp, WebTestMixin
 
+from django.core.cache import cache
+
 
 @pytest.fixture
 def App(request, db):
@@ -19,3 +21,9 @@ def App(request, db):
 @pytest.fixture
 def app(App):
     return App()
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # Cached data are keyed by object ids, which are reused between test runs.
+    cache.clear()
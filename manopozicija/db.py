@@ -1,4 +1,4 @@
-from django.db.models import Func
+from django.db.models import Func, Transform
 from django.db.models import FloatField
 
 
@@ -16,3 +16,14 @@ class Power(Func):
 
 class Sqrt(Func):
     function = 'SQRT'
+
+
+class Unaccent(Func):
+    """Removes accents, immutable_unaccent is created in migrations."""
+    function = 'immutable_unaccent'
+
+
+class Search(Transform):
+    """Lowercase text without accents, same as in trigram indexes on names."""
+    lookup_name = 'search'
+    template = 'immutable_unaccent(LOWER(%(expressions)s))'
@@ -1,12 +1,11 @@
 from dal import autocomplete
 
 from django import forms
-from django.db.models import Value
 from django.contrib.auth.models import User
 from django.utils.translation import ugettext, ugettext_lazy as _
 
 from manopozicija import models
-from manopozicija.db import Similarity
+from manopozicija import services
 
 
 class CombinedForms(object):
@@ -74,27 +73,10 @@ class QuoteForm(forms.ModelForm):
 
     def clean_text(self):
         text = self.cleaned_data['text']
-        if text and self.actor and self.source_link:
-            quote = None
-            source = models.Source.objects.filter(actor=self.actor, source_link=self.source_link).first()
-            if source:
-                if self.instance and self.instance.pk:
-                    quote = (
-                        models.Quote.objects.
-                        annotate(similarity=Similarity('text', Value(text))).
-                        filter(source=source, similarity__gt=0.9).
-                        exclude(pk=self.instance.pk).
-                        first()
-                    )
-                else:
-                    quote = (
-                        models.Quote.objects.
-                        annotate(similarity=Similarity('text', Value(text))).
-                        filter(source=source, similarity__gt=0.9).
-                        first()
-                    )
-            if quote and models.Post.objects.filter(topic=self.topic, quote=quote).exists():
-                raise forms.ValidationError(ugettext("Toks komentaras jau yra įtrauktas į „%s“ temą.") % self.topic)
+        if text and self.actor and self.source_link and services.is_duplicate_quote(
+            self.topic, self.actor, self.source_link, text, exclude=self.instance.pk,
+        ):
+            raise forms.ValidationError(ugettext("Toks komentaras jau yra įtrauktas į „%s“ temą.") % self.topic)
         return text
 
 
@@ -159,3 +141,9 @@ class VoteForm(forms.Form):
             return -1
         else:
             return 0
+
+
+class KpiForm(forms.Form):
+    start = forms.DateField(required=False)
+    end = forms.DateField(required=False)
+    resolution = forms.IntegerField(min_value=3, max_value=10000, required=False)
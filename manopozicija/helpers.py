@@ -1,7 +1,12 @@
-import datetime
+import hashlib
 import itertools
 
-from django.db.models import F, Max, Case, When
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.http import quote_etag
 
 from manopozicija import models
 from manopozicija import services
@@ -16,29 +21,38 @@ def _get_position_image(position, positive, negative, neutral):
         return neutral
 
 
-def _get_post_context(post, user_votes, curator_votes):
-    votes = user_votes if post.approved else curator_votes
+def _get_post_context(post):
     return {
         'id': post.pk,
         'votes': services.get_post_votes_display(post),
+        'approved': post.approved is not None,
         'user': {
-            'upvote': 'active' if votes.get(post.pk, 0) > 0 else '',
-            'downvote': 'active' if votes.get(post.pk, 0) < 0 else '',
+            'upvote': '',
+            'downvote': '',
         },
         'save_vote': 'manopozicija.save_user_vote' if post.approved else 'manopozicija.save_curator_vote',
     }
 
 
-def get_posts(user, topic, posts):
+def _set_user_votes(post, user_votes, curator_votes):
+    votes = user_votes if post['approved'] else curator_votes
+    post['user'] = {
+        'upvote': 'active' if votes.get(post['id'], 0) > 0 else '',
+        'downvote': 'active' if votes.get(post['id'], 0) < 0 else '',
+    }
+
+
+def _get_posts(topic, posts):
     result = []
-    user_votes = services.get_user_topic_votes(user, topic) if user.is_authenticated else {}
-    curator_votes = services.get_curator_topic_votes(user, topic) if user.is_authenticated else {}
+    curator_positions = services.get_users_topic_positions([
+        post['curator'].user for post in posts if post['type'] == 'curator'
+    ], topic)
     for post in posts:
         if post['type'] == 'event':
             event = post['event']
             result.append({
                 'type': 'event',
-                'post': _get_post_context(post['post'], user_votes, curator_votes),
+                'post': _get_post_context(post['post']),
                 'event': {
                     'position_image': _get_position_image(
                         event.position,
@@ -56,10 +70,10 @@ def get_posts(user, topic, posts):
             })
         elif post['type'] == 'curator':
             curator = post['curator']
-            position = services.get_user_topic_position(curator.user, topic)
+            position = curator_positions.get(curator.user_id, 0)
             result.append({
                 'type': 'curator',
-                'post': _get_post_context(post['post'], user_votes, curator_votes),
+                'post': _get_post_context(post['post']),
                 'curator': {
                     'position_image': _get_position_image(
                         position,
@@ -69,7 +83,7 @@ def get_posts(user, topic, posts):
                     ),
                     'name': str(curator.user),
                     'title': curator.title,
-                    'photo': curator.photo,
+                    'photo': curator.photo.name,
                 },
             })
         else:  # post['type'] == 'quote'
@@ -83,7 +97,7 @@ def get_posts(user, topic, posts):
                     'actor': {
                         'name': str(actor),
                         'title': source.actor_title or actor.title,
-                        'photo': actor.photo,
+                        'photo': actor.photo.name,
                         'position_image': _get_position_image(
                             source.position,
                             'img/actor-positive.png',
@@ -94,7 +108,7 @@ def get_posts(user, topic, posts):
                 },
                 'quotes': [{
                     'text': quote.text,
-                    'post': _get_post_context(post, user_votes, curator_votes),
+                    'post': _get_post_context(post),
                     'vote': {
                         'img': {
                             'top': 'img/thumb-up.png',
@@ -107,12 +121,44 @@ def get_posts(user, topic, posts):
                         'counterargument': {
                             'classes': 'glyphicon glyphicon-%s' % ('remove' if argument.counterargument else 'tag'),
                         }
-                    } for argument in quote.postargument_set.order_by('pk')],
+                    } for argument in quote.postargument_set.all()],
                 } for post, quote in post['quotes']],
             })
     return result
 
 
+def _set_posts_user_votes(user, topic, posts):
+    user_votes = services.get_user_topic_votes(user, topic) if user.is_authenticated else {}
+    curator_votes = services.get_curator_topic_votes(user, topic) if user.is_authenticated else {}
+    for post in posts:
+        if post['type'] == 'quotes':
+            for quote in post['quotes']:
+                _set_user_votes(quote['post'], user_votes, curator_votes)
+        else:
+            _set_user_votes(post['post'], user_votes, curator_votes)
+    return posts
+
+
+def get_posts(user, topic, posts):
+    return _set_posts_user_votes(user, topic, _get_posts(topic, posts))
+
+
+def get_topic_posts(user, topic, queue=False):
+    """Get topic timeline context for the given user.
+
+    User independent part of the timeline is cached until topic version
+    changes, see `services.bump_topic_version`. Only user votes are queried
+    on each call.
+
+    """
+    key = services.get_topic_cache_key(topic, 'posts', 'queue' if queue else 'timeline')
+    posts = cache.get(key)
+    if posts is None:
+        posts = _get_posts(topic, services.get_topic_posts(topic, queue=queue))
+        cache.set(key, posts, settings.MANOPOZICIJA_TOPIC_CACHE_TIMEOUT)
+    return _set_posts_user_votes(user, topic, posts)
+
+
 def get_arguments(arguments):
     positive = []
     negative = []
@@ -135,29 +181,18 @@ def _actor_details(groups, actors, actor_id, distance):
         return None
 
 
-def get_positions(group, user, limit=20):
+def get_positions(group, user, limit=20, offset=0):
+    """Return a page of (most compatible, most incompatible) actor pairs."""
     threshold = 0.4
-    actors = {x.pk: x for x in group.members.all()}
-    groups = {
-        x.actor_id: x.group for x in (
-            models.Member.objects.
-            annotate(untilnow=Case(
-                When(until__isnull=False, then=F('until')),
-                default=datetime.datetime.now(),
-            )).
-            filter(
-                actor__ingroup=group,
-                group__title='plitinė partija',
-            ).
-            select_related('group').
-            order_by('untilnow', 'since')
-        )
-    }
-    positions = services.compare_positions(group, user)
-    compat = ((x, d) for x, d in positions if d < threshold)
-    incompat = ((x, d) for x, d in reversed(positions) if d >= threshold)
+    compat = services.get_closest_actors(group, user, threshold, limit, offset)
+    incompat = services.get_farthest_actors(group, user, threshold, limit, offset)
+    ids = [x for x, d in compat + incompat]
+    parties = services.get_group_parties(group)
+    parties = {x: parties[x] for x in ids if x in parties}
+    actors = models.Actor.objects.in_bulk(ids + list(parties.values()))
+    groups = {actor: actors[party] for actor, party in parties.items()}
     result = []
-    for i, (left, right) in zip(range(limit), itertools.zip_longest(compat, incompat, fillvalue=(None, None))):
+    for left, right in itertools.zip_longest(compat, incompat, fillvalue=(None, None)):
         result.append((
             _actor_details(groups, actors, *left),
             _actor_details(groups, actors, *right),
@@ -167,8 +202,10 @@ def get_positions(group, user, limit=20):
 
 def get_topic_curators(topic):
     result = []
-    for curator in services.get_topic_curators(topic):
-        position = services.get_user_topic_position(curator.user, topic)
+    curators = list(services.get_topic_curators(topic).select_related('user'))
+    positions = services.get_users_topic_positions([x.user for x in curators], topic)
+    for curator in curators:
+        position = positions.get(curator.user_id, 0)
         result.append({
             'obj': curator,
             'name': curator.user.get_full_name(),
@@ -213,6 +250,41 @@ def get_indicators(topic):
     ]
 
 
+def _get_timestamp(value, tz):
+    if timezone.is_naive(value):
+        value = timezone.make_aware(value, tz)
+    return value.timestamp()
+
+
+def get_topic_kpi_validators(topic, indicators, params):
+    """Return ETag and Last-Modified timestamp of topic KPI data.
+
+    Last-Modified is the latest of indicator updates and event post changes.
+    ETag also changes with indicator data and topic version, which is bumped
+    when events are edited or deleted, because these do not always change
+    Last-Modified. Params are cleaned KpiForm values, ETag is different for
+    each requested range and resolution.
+
+    """
+    # Indicator.last_update is stored in UTC, while post timestamps are in local time.
+    timestamps = [_get_timestamp(x.last_update, timezone.utc) for x in indicators if x.last_update]
+    updated = (
+        models.Post.objects.
+        filter(topic=topic, content_type=ContentType.objects.get_for_model(models.Event)).
+        aggregate(updated=Max('updated'))['updated']
+    )
+    if updated:
+        timestamps.append(_get_timestamp(updated, timezone.get_default_timezone()))
+    version = repr((
+        services.get_topic_version(topic),
+        [(x.pk, x.content_hash, x.last_update) for x in indicators],
+        updated,
+        (params['start'], params['end'], params['resolution']),
+    ))
+    etag = quote_etag(hashlib.md5(version.encode('utf-8')).hexdigest())
+    return etag, int(max(timestamps)) if timestamps else None
+
+
 class Printer(object):
 
     def __init__(self, stdout, verbosity):
@@ -1,7 +1,20 @@
+import io
+import json
+import time
+import hashlib
 import logging
 import os.path
 import datetime
+import functools
+import threading
 import traceback
+import collections
+import email.utils
+import urllib.error
+import urllib.parse
+import urllib.request
+import concurrent.futures
+import numpy as np
 import pandas as pd
 
 from django.conf import settings
@@ -19,41 +32,201 @@ def get_params(params, defaults):
     return params
 
 
-def voter_turnout(params=None):
+class NotModified(Exception):
+    """Source was not modified since the last download."""
+
+
+class Download(object):
+    """Download sources with conditional requests.
+
+    ETag and Last-Modified of the previous download are sent with the
+    request and if source was not modified, NotModified is raised. Local
+    files are supported too, file modification time is used as
+    Last-Modified.
+
+    """
+
+    def __init__(self, etag='', last_modified='', timeout=600):
+        self.etag = etag
+        self.last_modified = last_modified
+        self.timeout = timeout
+        self.bytes = 0
+        self.seconds = 0
+
+    def __call__(self, url):
+        start = time.perf_counter()
+        try:
+            if urllib.parse.urlparse(url).scheme in ('http', 'https'):
+                data = self._download(url)
+            else:
+                data = self._read(url)
+        finally:
+            self.seconds += time.perf_counter() - start
+        self.bytes += len(data)
+        return io.BytesIO(data)
+
+    def _download(self, url):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=self.timeout) as resp:
+                data = resp.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                raise NotModified(url)
+            raise
+        self.etag = resp.headers.get('ETag', '')
+        self.last_modified = resp.headers.get('Last-Modified', '')
+        return data
+
+    def _read(self, path):
+        last_modified = email.utils.formatdate(os.stat(path).st_mtime, usegmt=True)
+        if last_modified == self.last_modified:
+            raise NotModified(path)
+        self.last_modified = last_modified
+        with open(path, 'rb') as f:
+            return f.read()
+
+
+class DatasetCache(object):
+    """Download and parse each dataset once per update run.
+
+    Downloaded files are kept in `directory` and reused without any requests
+    for `ttl` seconds, older files are revalidated with a conditional
+    request. ETag and Last-Modified of the dataset file are passed to the
+    indicator download, and if the indicator was already made from the same
+    file, NotModified is raised without parsing the dataset. Parsed frames
+    are kept in memory for the lifetime of this object and are shared by all
+    indicators of a dataset, so transform functions must not modify them.
+
+    """
+
+    def __init__(self, directory, ttl=3600):
+        self.directory = directory
+        self.ttl = ttl
+        self.files = {}
+        self.frames = {}
+        self.locks = collections.defaultdict(threading.Lock)
+        self.lock = threading.Lock()
+
+    def get(self, name, download):
+        """Return parsed dataset, download statistics are added to `download`."""
+        with self.lock:
+            lock = self.locks[name]
+        # Other indicators of the same dataset wait, until it is downloaded and parsed.
+        with lock:
+            dataset = DATASETS[name]
+            if name not in self.files:
+                self.files[name] = self.open(dataset['url'], download)
+            path, validators = self.files[name]
+            unchanged = any(validators.values()) and validators == {
+                'etag': download.etag,
+                'last_modified': download.last_modified,
+            }
+            download.etag = validators['etag']
+            download.last_modified = validators['last_modified']
+            if unchanged:
+                raise NotModified(dataset['url'])
+            if name not in self.frames:
+                self.frames[name] = dataset['parse'](path)
+            return self.frames[name]
+
+    def open(self, url, download):
+        """Return path and validators of downloaded dataset file."""
+        path = os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest())
+        validators = {'etag': '', 'last_modified': ''}
+        if os.path.exists(path):
+            try:
+                with open(path + '.json') as f:
+                    validators = json.load(f)
+            except FileNotFoundError:
+                pass
+            if time.time() - os.stat(path).st_mtime < self.ttl:
+                return path, validators
+        fetcher = Download(validators['etag'], validators['last_modified'], download.timeout)
+        try:
+            data = fetcher(url)
+        except NotModified:
+            os.utime(path)
+            return path, validators
+        finally:
+            download.bytes += fetcher.bytes
+            download.seconds += fetcher.seconds
+        validators = {'etag': fetcher.etag, 'last_modified': fetcher.last_modified}
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data.getvalue())
+        os.replace(path + '.tmp', path)
+        with open(path + '.json', 'w') as f:
+            json.dump(validators, f)
+        return path, validators
+
+
+# Datasets by name, each dataset is a file downloaded from 'url' and parsed
+# to a frame with 'parse' function.
+DATASETS = {}
+
+# Indicators as (slug, params) pairs, params are Indicator field values and
+# 'fetch' function returning indicator frame.
+INDICATORS = []
+
+
+def register_dataset(name, url, parse):
+    DATASETS[name] = {'url': url, 'parse': parse}
+
+
+def fetch_dataset(name, transform, params=None):
     params = get_params(params, {
-        'source': 'http://ec.europa.eu/eurostat/estat-navtree-portlet-prod/BulkDownloadListing?file=data/tsdgo310.tsv.gz',
+        'download': Download(),
+        'datasets': DatasetCache(settings.MANOPOZICIJA_DOWNLOADS_DIR),
     })
+    return transform(params['datasets'].get(name, params['download']))
+
+
+def indicator(slug, dataset, **params):
+    """Register a function making indicator frame from a dataset frame."""
+    def decorator(transform):
+        INDICATORS.append((slug, dict(params, fetch=functools.partial(fetch_dataset, dataset, transform))))
+        return transform
+    return decorator
 
-    frame = pd.read_csv(
-        params['source'],
-        sep='\t',
-        compression='gzip',
-        index_col=0,
-        na_values=[': '],
-    )
 
+def read_eurostat_tsv(path):
+    """Read Eurostat bulk download file, rows are keyed by 'dimension,...,geo' and columns are periods."""
+    return pd.read_csv(path, sep='\t', compression='gzip', index_col=0, na_values=[': '])
+
+
+def get_eurostat_series(frame, key, column):
+    """Return one row of Eurostat dataset as a yearly series."""
     frame = (
         frame.stack().
-        loc['NAT_VOTE,LT', :].to_frame().
+        loc[key, :].to_frame().
         reset_index(level=0, drop=True)
     )
-
     frame.index = pd.to_datetime(frame.index.str.strip(), format='%Y')
     frame.index.name = 'datetime'
     frame[0] = frame[0].astype(float)
-    frame = frame.rename(columns={0: 'Seimo'})
+    return frame.rename(columns={0: column})
 
-    return frame
 
+register_dataset(
+    'eurostat/tsdgo310',
+    'http://ec.europa.eu/eurostat/estat-navtree-portlet-prod/BulkDownloadListing?file=data/tsdgo310.tsv.gz',
+    read_eurostat_tsv,
+)
 
-INDICATORS = [
-    ('voter-turnout', {
-        'fetch': voter_turnout,
-        'title': 'Rinkimuose dalyvavusių rinkėjų skaičius, palyginti su visų rinkėjų skaičiumi',
-        'ylabel': 'procentai',
-        'source': 'http://ec.europa.eu/eurostat/tgm/table.do?tab=table&init=1&language=en&pcode=tsdgo310&plugin=1',
-    }),
-]
+
+@indicator(
+    'voter-turnout', 'eurostat/tsdgo310',
+    title='Rinkimuose dalyvavusių rinkėjų skaičius, palyginti su visų rinkėjų skaičiumi',
+    ylabel='procentai',
+    source='http://ec.europa.eu/eurostat/tgm/table.do?tab=table&init=1&language=en&pcode=tsdgo310&plugin=1',
+)
+def voter_turnout(frame):
+    return get_eurostat_series(frame, 'NAT_VOTE,LT', 'Seimo')
 
 
 def import_indicators(indicators):
@@ -86,7 +259,63 @@ class SecondsSince(Func):
     template = "%(now)d - DATE_PART('epoch', %(expressions)s)::int"
 
 
-def update_indicators(indicators, now=None):
+def get_frame_hash(frame):
+    result = hashlib.sha256()
+    result.update(repr((frame.index.name, list(frame.columns))).encode('utf-8'))
+    result.update(pd.util.hash_pandas_object(frame, index=True).values.tobytes())
+    return result.hexdigest()
+
+
+def _fetch_indicator(fetch, params):
+    start = time.perf_counter()
+    try:
+        frame = fetch(params)
+    except NotModified:
+        frame = None
+    return frame, time.perf_counter() - start
+
+
+def _fetch(fetch, started):
+    started.append(time.monotonic())
+    return fetch()
+
+
+def fetch_indicators(fetchers, workers=4, timeout=600):
+    """Run fetch functions concurrently, yield (key, frame, error) as they finish.
+
+    At most `workers` fetches run at the same time. A fetch running longer
+    than `timeout` seconds is reported with TimeoutError and abandoned.
+    Python threads can not be killed, so fetch functions should still use
+    network timeouts, otherwise the process waits for them on exit.
+
+    """
+    executor = concurrent.futures.ThreadPoolExecutor(workers)
+    try:
+        pending = {}
+        for key, fetch in fetchers:
+            started = []
+            pending[executor.submit(_fetch, fetch, started)] = (key, started)
+        while pending:
+            done, not_done = concurrent.futures.wait(
+                pending, timeout=min(1, timeout), return_when=concurrent.futures.FIRST_COMPLETED,
+            )
+            for future in done:
+                key, started = pending.pop(future)
+                try:
+                    yield key, future.result(), None
+                except Exception as e:
+                    yield key, None, e
+            now = time.monotonic()
+            for future in not_done:
+                key, started = pending[future]
+                if started and now - started[0] > timeout:
+                    del pending[future]
+                    yield key, None, TimeoutError('fetch did not finish in %s seconds' % timeout)
+    finally:
+        executor.shutdown(wait=False)
+
+
+def update_indicators(indicators, now=None, workers=4, timeout=600, cache_ttl=3600):
     indicators_dir = os.path.join(settings.MEDIA_ROOT, 'indicators')
     if not os.path.exists(indicators_dir):
         os.mkdir(indicators_dir)
@@ -102,25 +331,227 @@ def update_indicators(indicators, now=None):
         error_count__lt=10,  # don't try to fetch indicators who returned error 10 times in a row
     )
 
+    # Fetches run in worker threads, database is only accessed from this thread.
+    datasets = DatasetCache(settings.MANOPOZICIJA_DOWNLOADS_DIR, cache_ttl)
+    fetchers = []
     for indicator in qs:
-        params = indicators[indicator.slug]
-        fetch = params['fetch']
-        try:
-            frame = fetch()
-        except Exception:
-            logger.exception('error while updating %r indicator' % indicator.slug)
+        if os.path.exists(get_indicator_path(indicator.slug, 'npy')):
+            download = Download(indicator.etag, indicator.last_modified, timeout)
+        else:
+            # Saved data are missing, so the source must be fetched even if it is not modified.
+            download = Download(timeout=timeout)
+        params = {'download': download, 'datasets': datasets}
+        fetch = functools.partial(_fetch_indicator, indicators[indicator.slug]['fetch'], params)
+        fetchers.append(((indicator, download), fetch))
+
+    for (indicator, download), result, error in fetch_indicators(fetchers, workers, timeout):
+        indicator.download_time = download.seconds
+        indicator.bytes_downloaded = download.bytes
+        if error is not None:
+            logger.error('error while updating %r indicator', indicator.slug, exc_info=error)
             indicator.error_count = indicator.error_count + 1
-            indicator.traceback = traceback.format_exc()
+            indicator.traceback = ''.join(traceback.format_exception(type(error), error, error.__traceback__))
+            indicator.fetch_time = None
             indicator.save()
         else:
-            frame.to_csv(os.path.join(indicators_dir, '%s.csv' % indicator.slug))
+            frame, indicator.fetch_time = result
+            indicator.etag = download.etag
+            indicator.last_modified = download.last_modified
+            # Source or data are not changed, if frame is None or hash is the same.
+            if frame is not None:
+                content_hash = get_frame_hash(frame)
+                if content_hash != indicator.content_hash or not os.path.exists(get_indicator_path(indicator.slug, 'npy')):
+                    save_indicator_data(indicator.slug, frame)
+                    indicator.content_hash = content_hash
             indicator.error_count = 0
             indicator.traceback = ''
             indicator.last_update = now + (datetime.datetime.utcnow() - now_)
             indicator.save()
 
 
-def get_indicator_data(indicator):
-    indicators_dir = os.path.join(settings.MEDIA_ROOT, 'indicators')
-    frame = pd.read_csv(os.path.join(indicators_dir, '%s.csv' % indicator.slug), index_col=0)
-    return list(map(list, frame.to_records()))
+def get_indicator_path(slug, ext):
+    return os.path.join(settings.MEDIA_ROOT, 'indicators', '%s.%s' % (slug, ext))
+
+
+def to_array(frame):
+    """Convert indicator frame to a structured array with index as the first field.
+
+    Structured arrays with fixed size fields are saved as .npy files, that
+    can be memory mapped without parsing.
+
+    """
+    index = frame.index.values
+    if index.dtype == object:
+        index = index.astype(str)
+    fields = [(frame.index.name or 'index', index.dtype)] + [(str(name), np.float64) for name in frame.columns]
+    array = np.empty(len(frame), dtype=fields)
+    array[fields[0][0]] = index
+    for (name, dtype), column in zip(fields[1:], frame.columns):
+        array[name] = frame[column].values.astype(np.float64)
+    return array
+
+
+# Downsampled series are precomputed with these numbers of points, for
+# series longer than that.
+RESOLUTIONS = (100, 500, 2000)
+
+# Number of points returned, if resolution is not given.
+DEFAULT_RESOLUTION = 1000
+
+
+def lttb(array, threshold):
+    """Downsample rows of a structured array with Largest-Triangle-Three-Buckets.
+
+    First and last rows are always kept, rows between them are split into
+    `threshold - 2` buckets and from each bucket the row forming the largest
+    triangle with the previously selected row and the average of the next
+    bucket is selected. Selected rows are real data points, so peaks and
+    troughs are kept, instead of being smoothed out by averaging. Triangle
+    areas of all value columns are summed, missing values are ignored.
+
+    """
+    n = len(array)
+    if threshold >= n or threshold < 3:
+        return array
+    names = array.dtype.names
+    x = array[names[0]]
+    if np.issubdtype(x.dtype, np.datetime64):
+        x = x.astype('datetime64[s]').astype(np.float64)
+    else:
+        x = np.arange(n, dtype=np.float64)
+    y = np.column_stack([array[name] for name in names[1:]])
+
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    edges = np.append(edges, n)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_x = x[end:edges[i + 2]]
+        next_y = y[end:edges[i + 2]]
+        avg_x = next_x.mean()
+        avg_y = np.nansum(next_y, axis=0) / np.maximum((~np.isnan(next_y)).sum(axis=0), 1)
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a]) -
+            (x[a] - x[start:end])[:, None] * (avg_y - y[a])
+        )
+        a = selected[i + 1] = start + np.nansum(area, axis=1).argmax()
+    return array[selected]
+
+
+def _save_array(path, array):
+    # Replace file atomically, so that readers never see partially written file.
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+
+def save_indicator_data(slug, frame):
+    """Save indicator frame as CSV for downloads and as .npy for reading.
+
+    Downsampled series are saved next to the full series, one file for each
+    of RESOLUTIONS, so that requests for long series do not have to
+    downsample all points.
+
+    """
+    path = get_indicator_path(slug, 'csv')
+    frame.to_csv(path + '.tmp')
+    os.replace(path + '.tmp', path)
+    _save_arrays(slug, to_array(frame))
+
+
+def _save_arrays(slug, array):
+    for resolution in RESOLUTIONS:
+        path = get_indicator_path(slug, 'lttb%d.npy' % resolution)
+        if resolution < len(array):
+            _save_array(path, lttb(array, resolution))
+        elif os.path.exists(path):
+            os.remove(path)
+    # Full series is saved last, so that it is never older than downsampled series.
+    _save_array(get_indicator_path(slug, 'npy'), array)
+
+
+_arrays = {}
+
+
+def _load_array(path, mtime):
+    cached = _arrays.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _arrays[path] = (mtime, np.load(path, mmap_mode='r'))
+    return cached[1]
+
+
+def load_indicator_data(slug):
+    """Return memory mapped indicator data, cached until the file changes.
+
+    Indicators updated before .npy files were written only have a CSV file,
+    it is converted once to .npy on first read.
+
+    """
+    path = get_indicator_path(slug, 'npy')
+    csv = get_indicator_path(slug, 'csv')
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    if mtime is None or mtime < os.stat(csv).st_mtime_ns:
+        # CSV file is left as is, because other threads might be reading it.
+        _save_arrays(slug, to_array(pd.read_csv(csv, index_col=0, parse_dates=True)))
+        mtime = os.stat(path).st_mtime_ns
+    return _load_array(path, mtime)
+
+
+def load_indicator_levels(slug):
+    """Return memory mapped downsampled series, from the shortest to the longest."""
+    levels = []
+    for resolution in RESOLUTIONS:
+        path = get_indicator_path(slug, 'lttb%d.npy' % resolution)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        levels.append(_load_array(path, mtime))
+    return levels
+
+
+def _slice(array, start=None, end=None):
+    index = array[array.dtype.names[0]]
+    dtype = index.dtype if np.issubdtype(index.dtype, np.datetime64) else str
+    a = 0 if start is None else index.searchsorted(np.array(start).astype(dtype), 'left')
+    b = len(index) if end is None else index.searchsorted(np.array(end).astype(dtype), 'right')
+    return array[a:b]
+
+
+def format_index(index):
+    """Format index values same as DataFrame.to_csv does."""
+    if np.issubdtype(index.dtype, np.datetime64):
+        if (index == index.astype('datetime64[D]')).all():
+            return np.datetime_as_string(index, unit='D').tolist()
+        else:
+            return [x.replace('T', ' ') for x in np.datetime_as_string(index, unit='s').tolist()]
+    return index.tolist()
+
+
+def get_indicator_data(indicator, start=None, end=None, resolution=None):
+    """Return indicator data rows between start and end dates.
+
+    If resolution is given, at most that many rows are returned. Rows are
+    downsampled from the shortest precomputed series having at least
+    `resolution` rows in the date range, or from the full series.
+
+    """
+    array = load_indicator_data(indicator.slug)
+    candidates = (load_indicator_levels(indicator.slug) if resolution else []) + [array]
+    for candidate in candidates:
+        array = _slice(candidate, start, end)
+        if resolution is None or len(array) >= resolution:
+            break
+    if resolution:
+        array = lttb(array, resolution)
+    names = array.dtype.names
+    return list(map(list, zip(format_index(array[names[0]]), *(array[name].tolist() for name in names[1:]))))
+
+
+def get_indicator_frame(indicator):
+    return pd.DataFrame(load_indicator_data(indicator.slug))
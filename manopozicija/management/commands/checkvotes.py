@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from manopozicija import helpers
+from manopozicija import services
+
+
+class Command(BaseCommand):
+    help = 'Compares incrementally updated vote counters with a full recompute.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', default=False, help="Replace wrong counters with recomputed values")
+
+    def handle(self, fix, **options):
+        printer = helpers.Printer(self.stdout, options['verbosity'])
+        printer.info('Checking vote counters...')
+        errors = services.check_vote_counters(fix=fix)
+        for name, key, stored, expected in errors:
+            printer.info('  %s %r: %r != %r' % (name, key, stored, expected))
+        if errors and not fix:
+            raise CommandError('%d inconsistent vote counters found.' % len(errors))
+        printer.info('done, %d counters %s.' % (len(errors), 'fixed' if fix else 'inconsistent'))
@@ -1,21 +1,131 @@
 import io
+import os
 import json
 import base64
 import pathlib
-import unidecode
 import collections
 import datetime
+import itertools
+import concurrent.futures
 
 from django.core.management.base import BaseCommand
 from django.core.files import File
+from django.db import connection, connections, transaction
 
 from manopozicija import models
 from manopozicija import helpers
+from manopozicija import services
+from manopozicija import thumbnails
 
 
-def clean_name(name):
-    name = ' '.join(name.strip().split())
-    return unidecode.unidecode(name).lower()
+strptime = datetime.datetime.strptime
+
+Photo = collections.namedtuple('Photo', 'ext, data')
+Election = collections.namedtuple('Term', 'body, since, until, party, photo, elected')
+Candidate = collections.namedtuple('Candidate', 'fname, lname, bdate, title, partial, elections')
+
+
+def read_candidate(line):
+    row = json.loads(line)
+    row['elections'] = [
+        Election(**dict(
+            x,
+            since=strptime(x['since'], '%Y-%m-%d'),
+            until=strptime(x['until'], '%Y-%m-%d') if x['until'] else None,
+            photo=Photo(**x['photo']),
+        )) for x in row['elections']
+    ]
+    return Candidate(**dict(
+        row,
+        bdate=strptime(row['bdate'], '%Y-%m-%d'),
+    ))
+
+
+def import_candidate(candidate, now, printer):
+    # Update candidate
+    printer.info('')
+    printer.info('%s %s %s' % (candidate.bdate.date(), candidate.fname, candidate.lname))
+    actor, created = models.Actor.objects.get_or_create(
+        birth_date=candidate.bdate,
+        first_name=candidate.fname,
+        last_name=candidate.lname,
+        defaults={
+            'title': candidate.title,
+        },
+    )
+
+    actor_groups = actor.ingroups.values_list('pk', flat=True)
+    actor_parties = {x.group_id: x for x in models.Member.objects.filter(actor=actor)}
+    for election in candidate.elections:
+        # Get election body (must be created manually)
+        body = models.Body.objects.get(name=election.body)
+
+        # Get or create election term
+        term, created = models.Term.objects.get_or_create(
+            body=body,
+            title='%d-%d metų kadencija' % (
+                election.since.year,
+                election.until.year if election.until else now.year,
+            )
+        )
+
+        # Get or create group for this election
+        group_title = {
+            'Seimas': 'Seimą',
+        }
+        group, created = models.Group.objects.get_or_create(
+            title='Kandidatai į %d metų %s' % (
+                election.since.year,
+                group_title[election.body],
+            ),
+            defaults={
+                'timestamp': election.since,
+            },
+        )
+
+        # Add current candidate to the election group
+        if group.pk not in actor_groups:
+            group.members.add(actor)
+
+        # Get or create party
+        party, created = models.Actor.objects.get_or_create(
+            first_name=election.party,
+            group=True,
+            defaults={
+                'body': body,
+                'title': 'plitinė partija',
+            },
+        )
+
+        # Update party membership information, membership without until date
+        # means, that actor is still a member of the party.
+        membership = actor_parties.get(party.pk, None)
+        if membership is None:
+            models.Member.objects.get_or_create(actor=actor, group=party, defaults={
+                'since': election.since,
+                'until': election.until,
+            })
+        elif (
+            (election.since and membership.since.date() != election.since.date()) or
+            (election.until and membership.until and membership.until.date() != election.until.date())
+        ):
+            if election.since:
+                membership.since = min(membership.since, election.since)
+            if election.until and membership.until:
+                membership.until = max(membership.until, election.until)
+            membership.save()
+
+    return actor
+
+
+def save_photo(name, data):
+    """Decode and save actor photo, returns saved file name.
+
+    Runs in worker processes, without touching the database.
+
+    """
+    content = io.BytesIO(base64.b64decode(data.encode('ascii')))
+    return models.Actor._meta.get_field('photo').storage.save(name, File(content))
 
 
 class Command(BaseCommand):
@@ -49,8 +159,19 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('path', help="Path to the NDJSON file containing photos")
+        parser.add_argument('--batch-size', type=int, default=100, help="Number of candidates committed at once")
+        parser.add_argument('--resume', action='store_true', default=False, help=(
+            "Resume interrupted import of the same file, skipping already committed batches"
+        ))
+        parser.add_argument('--force', action='store_true', default=False, help=(
+            "Import file from the beginning, even if it has not changed since last import"
+        ))
+        parser.add_argument('--workers', type=int, default=None, help=(
+            "Number of processes decoding photos and rendering thumbnails, defaults to number of CPUs, "
+            "0 does all work in this process"
+        ))
 
-    def handle(self, path, **options):
+    def handle(self, path, batch_size, resume, force, workers, **options):
         printer = helpers.Printer(self.stdout, options['verbosity'])
         path = pathlib.Path(path)
 
@@ -76,105 +197,72 @@ class Command(BaseCommand):
         # ]
 
         now = datetime.datetime.now()
-        strptime = datetime.datetime.strptime
-
-        Photo = collections.namedtuple('Photo', 'type, data')
-        Election = collections.namedtuple('Term', 'body, since, until, party, photo, elected')
-        Candidate = collections.namedtuple('Candidate', 'fname, lname, bdate, partial, elections')
-
-        with path.open(encoding='utf-8') as f:
-            for line in f:
-                row = json.loads(line)
-                row['elections'] = [
-                    Election(**dict(
-                        x,
-                        since=strptime(x['since'], '%Y-%m-%d'),
-                        until=strptime(x['until'], '%Y-%m-%d'),
-                        photo=Photo(**x['photo']),
-                    )) for x in row['elections']
-                ]
-                candidate = Candidate(**dict(
-                    row,
-                    bdate=strptime(row['bdate']),
-                ))
-
-                # Update candidate
-                printer.info('')
-                printer.info('{bdate} {fname} {lname}'.format(**row))
-                actor, created = models.Actor.objects.get_or_create(
-                    birth_date=candidate.bdate,
-                    first_name=candidate.fname,
-                    last_name=candidate.lname,
-                    defaults={
-                        'title': candidate.title,
-                    },
-                )
-
-                # Update candidate photo
-                if not actor.photo and candidate.elections:
-                    photo = candidate.elections[-1].photo
-                    filename = '%s-%s.%s' % (candidate.fname, candidate.lname, photo.ext)
-                    content = io.BytesIO(base64.b64decode(photo.data.encode('ascii')))
-                    actor.photo.save(filename, File(content), save=True)
-
-                actor_groups = actor.ingroups.values_list('pk', flat=True)
-                actor_parties = {x.pk: x for x in models.Member.objects.filter(actor=actor)}
-                for election in candidate.elections:
-                    # Get election body (must be created manually)
-                    body = models.Body.objects.get(name=election.body)
-
-                    # Get or create election term
-                    term, created = models.Term.objects.get_or_create(
-                        body=body,
-                        title='%d-%d metų kadencija' % (
-                            election.since.year,
-                            election.until.year if election.until else now.year,
-                        )
-                    )
-
-                    # Get or create group for this election
-                    group_title = {
-                        'Seimas': 'Seimą',
-                    }
-                    group, created = models.Group.objects.get_or_create(
-                        title='Kandidatai į %d metų %s' % (
-                            election.since.year,
-                            group_title[election.body],
-                        ),
-                        defaults={
-                            'timestamp': election.since,
-                        },
-                    )
-
-                    # Add current candidate to the election group
-                    if group.pk not in actor_groups:
-                        group.members.add(actor)
-
-                    # Get or create party
-                    party, created = models.Actor.objects.get_or_create(
-                        first_name=election.party,
-                        group=True,
-                        defaults={
-                            'body': body,
-                            'title': 'plitinė partija',
-                        },
-                    )
-
-                    # Update party membership information
-                    membership = actor_parties.get(party.pk, None)
-                    if membership is None:
-                        models.Member.objects.get_or_create(actor=actor, group=party, defaults={
-                            'since': election.since,
-                            'until': election.until,
-                        })
-                    elif (
-                        (election.since and membership.since.date() != election.since.date()) or
-                        (election.until and membership.until.date() != election.until.date())
-                    ):
-                        if election.since:
-                            membership.since = min(membership.since, election.since)
-                        if election.until:
-                            membership.until = max(membership.until, election.until)
-                        membership.save()
-
-            printer.info('done.')
+
+        checkpoint = services.get_import_checkpoint('importcandidates', [path], batch_size, resume, force)
+        if checkpoint is None:
+            printer.info('File has not changed since last import, use --force to import it again.')
+            return
+        if checkpoint.batches:
+            printer.info('Resuming import, skipping %d committed batches of %d candidates.' % (
+                checkpoint.batches, checkpoint.batch_size,
+            ))
+        batch_size = checkpoint.batch_size
+
+        photos = []
+        field = models.Actor._meta.get_field('photo')
+        if workers == 0:
+            # Photos are saved in a single thread of this process.
+            pool = concurrent.futures.ThreadPoolExecutor(1)
+        else:
+            # Forked workers must not share database connections with this
+            # process. Workers are forked on demand, so they are all started
+            # with no-op tasks, before the connection is opened again.
+            # Connections can not be closed inside a transaction, workers do
+            # not use them anyway.
+            if not connection.in_atomic_block:
+                connections.close_all()
+            pool = concurrent.futures.ProcessPoolExecutor(workers)
+            for future in [pool.submit(int) for i in range(workers or os.cpu_count() or 1)]:
+                future.result()
+        with pool, path.open(encoding='utf-8') as f:
+            lines = itertools.islice(f, checkpoint.batches * batch_size, None)
+            for batch in iter(lambda: list(itertools.islice(lines, batch_size)), []):
+                # Photos are decoded and saved in worker processes, while
+                # other candidates are imported.
+                saving = []
+                try:
+                    with transaction.atomic():
+                        for line in batch:
+                            candidate = read_candidate(line)
+                            actor = import_candidate(candidate, now, printer)
+                            if not actor.photo and candidate.elections:
+                                photo = candidate.elections[-1].photo
+                                filename = '%s-%s.%s' % (candidate.fname, candidate.lname, photo.ext)
+                                name = field.generate_filename(actor, filename)
+                                saving.append((actor, pool.submit(save_photo, name, photo.data)))
+                        for actor, future in saving:
+                            actor.photo.name = future.result()
+                            actor.save(update_fields=['photo'])
+                        services.commit_import_batch(checkpoint)
+                except BaseException:
+                    # Photos are saved outside of the transaction, so photos of
+                    # a rolled back batch are deleted, they are saved again,
+                    # when import is resumed.
+                    for actor, future in saving:
+                        if not future.cancel() and future.exception() is None:
+                            field.storage.delete(future.result())
+                    raise
+                photos.extend(actor.photo.name for actor, future in saving)
+
+        printer.info('')
+        printer.info('Rebuilding group parties...')
+        services.rebuild_group_parties()
+        services.complete_import(checkpoint)
+
+        # Render thumbnails now, instead of the first page views.
+        printer.info('Rendering thumbnails of %d photos...' % len(photos))
+        for name, error in thumbnails.render_many(photos, workers=workers):
+            if error:
+                printer.info('  %s: %s' % (name, error))
+
+        printer.info('done.')
@@ -1,15 +1,249 @@
 import yaml
 
+from django.core.exceptions import ValidationError
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
 
-from manopozicija import forms
 from manopozicija import models
 from manopozicija import services
 from manopozicija import helpers
 
 
+class TopicImport(object):
+    """Import topic events and quotes with a few queries per file.
+
+    All posts are validated in memory with model field validation, foreign
+    keys are not validated, because that would take a query per row. Existing
+    events, sources and topic quotes are preloaded in one query each, new rows
+    are written with bulk_create and positions are recomputed once, after all
+    posts are created.
+
+    """
+
+    def __init__(self, user, topic, printer):
+        self.user = user
+        self.topic = topic
+        self.printer = printer
+        self.approved = timezone.now() if services.is_topic_curator(user, topic) else None
+
+    def read(self, posts):
+        """Return valid events and quotes, invalid posts are reported and skipped."""
+        actors = get_actors({x['source']['actor'] for x in posts if x.get('type') == 'quote' and x.get('source')})
+        events, quotes = [], []
+        for post in posts:
+            try:
+                if post.get('type') == 'event':
+                    events.append(self.read_event(post['event']))
+                elif post.get('type') == 'quote':
+                    quotes.append(self.read_quote(actors, post))
+                else:
+                    raise ValidationError('Unknown post type: %r.' % post.get('type'))
+            except (KeyError, TypeError, ValidationError) as e:
+                self.printer.info('Error while importing %r' % post)
+                self.printer.info('\n'.join(e.messages) if isinstance(e, ValidationError) else repr(e))
+        return events, quotes
+
+    def read_event(self, data):
+        event = models.Event(
+            user=self.user,
+            type=models.Event.DOCUMENT,
+            title=data['title'],
+            source_link=data.get('source_link') or '',
+            source_title=services.get_title_from_link(data.get('source_link') or ''),
+            timestamp=data['timestamp'],
+            position=0,
+        )
+        event.full_clean(exclude=['user'], validate_unique=False)
+        return event
+
+    def read_quote(self, actors, post):
+        data = post['source']
+        if data['actor'] not in actors:
+            raise ValidationError('Actor %r not found.' % data['actor'])
+        actor = actors[data['actor']]
+        if actor is None:
+            raise ValidationError('Actor %r is ambiguous.' % data['actor'])
+        source = models.Source(
+            actor=actor,
+            actor_title=data.get('actor_title') or actor.title,
+            source_link=data['source_link'],
+            source_title=services.get_title_from_link(data['source_link']),
+            timestamp=data['timestamp'],
+        )
+        source.full_clean(exclude=['actor'], validate_unique=False)
+        quote = models.Quote(
+            user=self.user,
+            text=post['quote']['text'],
+            reference_link=post['quote'].get('reference_link') or '',
+        )
+        quote.full_clean(exclude=['user', 'source'])
+        arguments = []
+        for data in post.get('arguments') or []:
+            argument = models.PostArgument(
+                topic=self.topic,
+                title=data['title'],
+                position=data['position'],
+                counterargument=data.get('counterargument', False),
+                counterargument_title=data.get('counterargument_title') or '',
+            )
+            argument.full_clean(exclude=['topic', 'post', 'quote'])
+            if argument.position not in (-1, 1):
+                raise ValidationError('Argument position must be -1 or 1, got %r.' % argument.position)
+            arguments.append(argument)
+        return source, quote, arguments
+
+    @transaction.atomic
+    def save(self, events, quotes):
+        events = self.save_events(events)
+        quotes = self.save_quotes(quotes)
+        if not events and not quotes:
+            return []
+
+        posts = models.Post.objects.bulk_create([
+            self.get_post(event, event.timestamp)
+            for event in events
+        ] + [
+            # Same position as services.get_quote_position gives, without a query.
+            self.get_post(quote, source.timestamp, actor=source.actor, position=_average(arguments) if self.approved else 0)
+            for source, quote, arguments in quotes
+        ])
+        if self.approved:
+            # Automatically approve posts created by topic curators.
+            models.PostLog.objects.bulk_create([
+                models.PostLog(user=self.user, post=post, action=models.PostLog.VOTE, vote=1)
+                for post in posts
+            ])
+
+        arguments = []
+        for post, (source, quote, quote_arguments) in zip(posts[len(events):], quotes):
+            for argument in quote_arguments:
+                argument.post = post
+                argument.quote = quote
+                arguments.append(argument)
+        models.PostArgument.objects.bulk_create(arguments)
+
+        sources = list({source.pk: source for source, quote, arguments in quotes}.values())
+        positions = services.get_sources_positions(self.topic, sources)
+        for source in sources:
+            source.position = positions[source.pk]
+        models.Source.objects.bulk_update(sources, ['position'])
+
+        positions = services.PositionUpdates(self.topic)
+        for argument in arguments:
+            positions.argument(argument.post.actor, argument.title)
+        positions.save()
+
+        services.bump_topic_version(self.topic)
+        return posts
+
+    def get_post(self, content_object, timestamp, actor=None, position=0):
+        return models.Post(
+            body=self.topic.default_body,
+            topic=self.topic,
+            actor=actor,
+            position=position,
+            approved=self.approved,
+            timestamp=timestamp,
+            upvotes=0,
+            content_object=content_object,
+        )
+
+    def save_events(self, events):
+        """Create new events, return events to be posted to the topic."""
+        existing = {x.source_link: x for x in models.Event.objects.filter(source_link__in={x.source_link for x in events})}
+        posted = set(
+            models.Post.objects.
+            filter(topic=self.topic, event__in=existing.values()).
+            values_list('object_id', flat=True)
+        )
+        seen, create, result = set(), [], []
+        for event in events:
+            if event.source_link in seen or existing.get(event.source_link, event).pk in posted:
+                self.printer.info('"%s" already exists.' % event.title)
+                continue
+            seen.add(event.source_link)
+            if event.source_link in existing:
+                event = existing[event.source_link]
+            else:
+                create.append(event)
+            result.append(event)
+        models.Event.objects.bulk_create(create)
+        for event in result:
+            self.printer.info('"%s" imported.' % event.title)
+        return result
+
+    def save_quotes(self, quotes):
+        """Create new sources and quotes, return quotes to be posted to the topic."""
+        sources = {
+            (x.actor_id, x.source_link): x
+            for x in models.Source.objects.select_related('actor').filter(
+                actor__in={source.actor for source, quote, arguments in quotes},
+                source_link__in={source.source_link for source, quote, arguments in quotes},
+            )
+        }
+        posted = {
+            (actor_id, source_link, _normalize(text))
+            for actor_id, source_link, text in (
+                models.Quote.objects.
+                filter(post__topic=self.topic, source__in=sources.values()).
+                values_list('source__actor_id', 'source__source_link', 'text')
+            )
+        }
+        # Same text is found without queries, similar texts are checked same
+        # way as QuoteForm does, only for sources already having topic quotes.
+        posted_sources = {key[:2] for key in posted}
+        create, result = [], []
+        for source, quote, arguments in quotes:
+            key = (source.actor_id, source.source_link, _normalize(quote.text))
+            if key in posted or (
+                key[:2] in posted_sources and
+                services.is_duplicate_quote(self.topic, source.actor, source.source_link, quote.text)
+            ):
+                self.printer.info('"%s" already exists.' % quote)
+                continue
+            posted.add(key)
+            if key[:2] not in sources:
+                sources[key[:2]] = source
+                create.append(source)
+            result.append((sources[key[:2]], quote, arguments))
+        models.Source.objects.bulk_create(create)
+        for source, quote, arguments in result:
+            quote.source = source
+        models.Quote.objects.bulk_create([quote for source, quote, arguments in result])
+        for source, quote, arguments in result:
+            self.printer.info('"%s" imported.' % quote)
+        return result
+
+
+def get_actors(names):
+    """Find actors by full name, as returned by str(actor), in one query."""
+    query = Q(pk__in=[])
+    for name in names:
+        first_name, _, last_name = name.rpartition(' ')
+        query |= Q(first_name=name, last_name='') | Q(first_name=first_name, last_name=last_name)
+    actors, ambiguous = {}, set()
+    for actor in models.Actor.objects.filter(query):
+        # Group actors have only first name.
+        name = str(actor).strip()
+        if name in actors:
+            ambiguous.add(name)
+        actors[name] = actor
+    # Ambiguous names are not imported.
+    return {name: None if name in ambiguous else actor for name, actor in actors.items()}
+
+
+def _normalize(text):
+    return ' '.join(text.split())
+
+
+def _average(arguments):
+    return sum(-x.position if x.counterargument else x.position for x in arguments) / len(arguments) if arguments else 0
+
+
 class Command(BaseCommand):
-    help = 'Imports posts to an existing topic'
+    help = 'Imports events and quotes to an existing topic'
 
     def add_arguments(self, parser):
         parser.add_argument('slug', help="topic slug")
@@ -22,20 +256,6 @@ class Command(BaseCommand):
         with open(path) as f:
             posts = yaml.safe_load(f)
 
-        for post in posts:
-            if post['type'] == 'event':
-                exists = (
-                    models.Event.objects.
-                    filter(post__topic=topic, source_link=post['event']['source_link']).
-                    exists()
-                )
-                if exists:
-                    printer.info('"%s" already exists.' % post['event']['title'])
-                else:
-                    form = forms.EventForm(topic, post['event'])
-                    if form.is_valid():
-                        services.create_event(user, topic, form.cleaned_data)
-                        printer.info('"%s" imported.' % post['event']['title'])
-                    else:
-                        printer.info('Error while importing %r' % post['event'])
-                        printer.info(form.errors.as_text())
+        importer = TopicImport(user, topic, printer)
+        events, quotes = importer.read(posts)
+        importer.save(events, quotes)
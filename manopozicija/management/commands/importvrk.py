@@ -1,13 +1,38 @@
 import csv
+import time
+import heapq
+import resource
+import tempfile
 import pathlib
 import datetime
 import itertools
 import collections
 
 from django.core.management.base import BaseCommand
+from django.db import transaction
 
 from manopozicija import models
+from manopozicija import actorindex
 from manopozicija import helpers
+from manopozicija import services
+
+
+Candidate = collections.namedtuple('Candidate', 'birth_date last_name first_name')
+CandidateElection = collections.namedtuple('CandidateElection', 'elected election vienmandate daugiamandate')
+CandidateInfo = collections.namedtuple('CandidateInfo', 'candidate times_elected times_candidate membership terms')
+
+
+def todt(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d')
+
+
+def get_term_defaults(row, typemap):
+    return {
+        'body': typemap[row['RUSIS']],
+        'since': todt(row['PRADZIA']),
+        'until': todt(row['PABAIGA']) if row['PABAIGA'] else None,
+        'title': row['PAVADINIMAS'],
+    }
 
 
 def import_terms(reader, typemap):
@@ -22,24 +47,295 @@ def import_terms(reader, typemap):
         }
         if row['RUSIS'] == 'SEI':
             models.Term.objects.update_or_create(
-                source=models.Term.VRK_KADENCIJOS_CSV, source_id=row['KADENCIJOS_ID'], defaults={
-                    'body': typemap[row['RUSIS']],
-                    'since': datetime.datetime.strptime(row['PRADZIA'], '%Y-%m-%d'),
-                    'until': datetime.datetime.strptime(row['PABAIGA'], '%Y-%m-%d') if row['PABAIGA'] else None,
-                    'title': row['PAVADINIMAS'],
-                }
+                source=models.Term.VRK_KADENCIJOS_CSV, source_id=row['KADENCIJOS_ID'],
+                defaults=get_term_defaults(row, typemap),
             )
 
 
+def import_terms_bulk(reader, typemap):
+    terms = {x.source_id: x for x in models.Term.objects.filter(source=models.Term.VRK_KADENCIJOS_CSV)}
+    create, update = [], []
+    for row in reader:
+        if row['RUSIS'] == 'SEI':
+            defaults = get_term_defaults(row, typemap)
+            term = terms.get(row['KADENCIJOS_ID'])
+            if term is None:
+                create.append(models.Term(source=models.Term.VRK_KADENCIJOS_CSV, source_id=row['KADENCIJOS_ID'], **defaults))
+            elif any(getattr(term, k) != v for k, v in defaults.items()):
+                for key, value in defaults.items():
+                    setattr(term, key, value)
+                update.append(term)
+    models.Term.objects.bulk_create(create)
+    models.Term.objects.bulk_update(update, ['body', 'since', 'until', 'title'])
+
+
+def name(name):
+    return ' '.join([x.title() for x in name.split()])
+
+
+def sort_rows(rows, chunk_size):
+    """Sort rows of strings keeping at most chunk_size rows in memory.
+
+    Sorted chunks are written to temporary files and merged.
+
+    """
+    chunks = []
+    try:
+        while True:
+            chunk = sorted(itertools.islice(rows, chunk_size))
+            if not chunks and len(chunk) < chunk_size:
+                # All rows fit into a single chunk.
+                yield from chunk
+                return
+            if not chunk:
+                break
+            f = tempfile.TemporaryFile('w+', encoding='utf-8', newline='')
+            csv.writer(f).writerows(chunk)
+            f.seek(0)
+            chunks.append(f)
+            del chunk
+        yield from heapq.merge(*(csv.reader(f) for f in chunks))
+    finally:
+        for f in chunks:
+            f.close()
+
+
+def read_candidates(f, elections, organisations, chunk_size, stats):
+    """Read kandidatai.csv and yield (candidate, rounds) pairs one by one.
+
+    Rows are sorted by candidate on disk, so that memory usage does not
+    depend on file size.
+
+    """
+    def rows():
+        for row in csv.DictReader(f):
+            stats['rows'] += 1
+            if row['VR_TURO_ID'] in elections:
+                yield (
+                    row['GIMIMO_DATA'], name(row['PAVARDE']), name(row['VARDAS']),
+                    row['VR_TURO_ID'],
+                    row['VIENMANDATE_ORGANIZACIJA'],
+                    row['DAUGIAMANDATE_ORGANIZACIJA'],
+                    row['AR_ISRINKTAS'],
+                )
+
+    for key, group in itertools.groupby(sort_rows(rows(), chunk_size), key=lambda x: tuple(x[:3])):
+        stats['candidates'] += 1
+        yield Candidate(*key), [
+            CandidateElection(
+                elected=elected == 'T',
+                election=elections[election],
+                vienmandate=organisations[vienmandate] if vienmandate else None,
+                daugiamandate=organisations[daugiamandate] if daugiamandate else None,
+            )
+            for birth_date, last_name, first_name, election, vienmandate, daugiamandate, elected in group
+        ]
+
+
+def get_candidate_info(candidate, rounds, terms, printer):
+    printer.info('')
+    printer.info('%s %s %s' % candidate)
+
+    membership = {}
+    rounds = sorted(rounds, key=lambda x: x.election.term.since)
+    rounds_by_term = itertools.groupby(rounds, key=lambda x: x.election.term.id)
+
+    times_elected = sum(1 for x in rounds if x.elected)
+    times_candidate = 0
+
+    actor_terms = []
+    for term_id, term_rounds in rounds_by_term:
+        times_candidate += 1
+        term_rounds = list(term_rounds)
+        term = terms[term_id]
+        actor_terms.append(term)
+        elected = sorted([x.election.date for x in term_rounds if x.elected])
+        result = ('elected: %s' % elected[0].strftime('%Y-%m-%d')) if elected else ''
+        printer.info('  %s-%s %s' % (
+            term.since.strftime('%Y'),
+            term.until.strftime('%Y') if term.until else '    ',
+            result,
+        ))
+
+        orgs = set()
+        orgs.update(x.vienmandate for x in term_rounds if x.vienmandate)
+        orgs.update(x.daugiamandate for x in term_rounds if x.daugiamandate)
+
+        if orgs:
+            for org in sorted(orgs):
+                printer.info('    %s' % org)
+                since, until = membership.get(org, (min(elected, default=term.since), term.until))
+                membership[org] = (
+                    min(since, term.since),
+                    max(until, term.until) if until and term.until else term.until,
+                )
+
+    printer.info('  Member of:')
+    for org, (since, until) in membership.items():
+        printer.info('    %s (%s - %s)' % (
+            org,
+            since.strftime('%Y-%m-%d'),
+            until.strftime('%Y-%m-%d') if until else '',
+        ))
+
+    return CandidateInfo(candidate, times_elected, times_candidate, membership, actor_terms)
+
+
+def import_candidate(info, body):
+    candidate = info.candidate
+    actor_title = 'seimo narys' if info.times_elected > 0 else ''
+
+    actor, created = models.Actor.objects.get_or_create(
+        birth_date=candidate.birth_date,
+        first_name=candidate.first_name,
+        last_name=candidate.last_name,
+        defaults={
+            'title': actor_title,
+            'times_elected': info.times_elected,
+            'times_candidate': info.times_candidate,
+        },
+    )
+
+    if not created:
+        modified = [
+            actor.times_elected != info.times_elected,
+            actor.times_candidate != info.times_candidate,
+        ]
+        if any(modified):
+            actor.times_elected = info.times_elected
+            actor.times_candidate = info.times_candidate
+            actor.save()
+
+    for org, (since, until) in info.membership.items():
+        party, created = models.Actor.objects.get_or_create(first_name=org, group=True, defaults={
+            'title': 'plitinė partija',
+            'body': body,
+        })
+
+        models.Member.objects.get_or_create(actor=actor, group=party, defaults={
+            'since': since,
+            'until': until,
+        })
+
+    # Add this actor to all term groups
+    in_groups = actor.ingroups.values_list('pk', flat=True)
+    for term in info.terms:
+        if term.group.pk not in in_groups:
+            term.group.members.add(actor)
+
+
+class BulkImport(object):
+    """Import candidates in batches with a few queries per batch.
+
+    Existing actors, parties, party memberships and group memberships are
+    preloaded into dicts keyed by their natural keys, so that only new or
+    changed rows are written with bulk_create and bulk_update.
+
+    """
+
+    def __init__(self, body):
+        self.body = body
+        # Only ids and counters are kept, to save memory on large databases.
+        self.actors = {
+            Candidate(str(birth_date), last_name, first_name): [pk, times_elected, times_candidate]
+            for pk, birth_date, last_name, first_name, times_elected, times_candidate in (
+                models.Actor.objects.
+                filter(group=False, birth_date__isnull=False).
+                order_by('-pk').
+                values_list('pk', 'birth_date', 'last_name', 'first_name', 'times_elected', 'times_candidate').
+                iterator()
+            )
+        }
+        self.parties = {
+            x.first_name: x.pk
+            for x in models.Actor.objects.filter(group=True).order_by('-pk').only('pk', 'first_name')
+        }
+        self.members = set(models.Member.objects.values_list('actor', 'group'))
+        self.ingroups = set(models.Group.members.through.objects.values_list('actor', 'group'))
+
+    @transaction.atomic
+    def save(self, batch):
+        create, update = [], []
+        for info in batch:
+            counters = [info.times_elected, info.times_candidate]
+            actor = self.actors.get(info.candidate)
+            if actor is None:
+                create.append(models.Actor(
+                    birth_date=info.candidate.birth_date,
+                    first_name=info.candidate.first_name,
+                    last_name=info.candidate.last_name,
+                    title='seimo narys' if info.times_elected > 0 else '',
+                    times_elected=info.times_elected,
+                    times_candidate=info.times_candidate,
+                ))
+            elif actor[1:] != counters:
+                actor[1:] = counters
+                update.append(models.Actor(pk=actor[0], times_elected=info.times_elected, times_candidate=info.times_candidate))
+        for actor in models.Actor.objects.bulk_create(create):
+            key = Candidate(actor.birth_date, actor.last_name, actor.first_name)
+            self.actors[key] = [actor.pk, actor.times_elected, actor.times_candidate]
+        models.Actor.objects.bulk_update(update, ['times_elected', 'times_candidate'])
+
+        parties = sorted({org for info in batch for org in info.membership if org not in self.parties})
+        parties = models.Actor.objects.bulk_create([
+            models.Actor(first_name=org, group=True, title='plitinė partija', body=self.body)
+            for org in parties
+        ])
+        self.parties.update((x.first_name, x.pk) for x in parties)
+
+        members, ingroups = [], []
+        for info in batch:
+            actor = self.actors[info.candidate][0]
+            for org, (since, until) in info.membership.items():
+                key = (actor, self.parties[org])
+                if key not in self.members:
+                    self.members.add(key)
+                    members.append(models.Member(actor_id=key[0], group_id=key[1], since=since, until=until))
+            for term in info.terms:
+                key = (actor, term.group.pk)
+                if key not in self.ingroups:
+                    self.ingroups.add(key)
+                    ingroups.append(models.Group.members.through(actor_id=key[0], group_id=key[1]))
+        models.Member.objects.bulk_create(members)
+        models.Group.members.through.objects.bulk_create(ingroups)
+
+        return len(create), len(update)
+
+
 class Command(BaseCommand):
-    help = 'Imports posts to an existing topic'
+    help = 'Imports candidates, parties and terms from VRK CSV files'
 
     def add_arguments(self, parser):
         parser.add_argument('path', help="Path to directory with CSV files")
+        parser.add_argument('--bulk', action='store_true', default=False, help=(
+            "Preload existing rows and write changes in batches, much faster for full VRK dumps"
+        ))
+        parser.add_argument('--batch-size', type=int, default=1000, help="Number of candidates committed at once")
+        parser.add_argument('--chunk-size', type=int, default=100000, help=(
+            "Number of candidate rows sorted in memory, larger files are sorted on disk"
+        ))
+        parser.add_argument('--resume', action='store_true', default=False, help=(
+            "Resume interrupted import of the same files, skipping already committed batches"
+        ))
+        parser.add_argument('--force', action='store_true', default=False, help=(
+            "Import files from the beginning, even if they have not changed since last import"
+        ))
 
-    def handle(self, path, **options):
+    def handle(self, path, bulk, batch_size, chunk_size, resume, force, **options):
         path = pathlib.Path(path)
         printer = helpers.Printer(self.stdout, options['verbosity'])
+        start = time.perf_counter()
+
+        files = ['kadencijos.csv', 'rinkimai.csv', 'organizacijos.csv', 'kandidatai.csv']
+        checkpoint = services.get_import_checkpoint('importvrk', [path / x for x in files], batch_size, resume, force)
+        if checkpoint is None:
+            printer.info('Files have not changed since last import, use --force to import them again.')
+            return
+        if checkpoint.batches:
+            printer.info('Resuming import, skipping %d committed batches of %d candidates.' % (
+                checkpoint.batches, checkpoint.batch_size,
+            ))
+        batch_size = checkpoint.batch_size
 
         seimas, created = models.Body.objects.get_or_create(name='Seimas')
 
@@ -47,30 +343,30 @@ class Command(BaseCommand):
             'SEI': seimas,
         }
 
-        printer.info('Importing terms...')
         with (path / 'kadencijos.csv').open() as f:
-            reader = csv.DictReader(f)
-            import_terms(reader, typemap)
+            term_rows = list(csv.DictReader(f))
 
-        def todt(value):
-            return datetime.datetime.strptime(value, '%Y-%m-%d')
+        printer.info('Importing terms...')
+        if bulk:
+            import_terms_bulk(term_rows, typemap)
+        else:
+            import_terms(term_rows, typemap)
 
         printer.info('Importing candidates and parties...')
-        with (path / 'kadencijos.csv').open() as f:
-            Term = collections.namedtuple('Term', 'id body since until group')
-            terms = {
-                row['KADENCIJOS_ID']: Term(
-                    id=row['KADENCIJOS_ID'],
-                    body=typemap[row['RUSIS']],
-                    since=todt(row['PRADZIA']),
-                    until=todt(row['PABAIGA']) if row['PABAIGA'] else None,
-                    group=models.Group.objects.get_or_create(
-                        title='Kandidatai į %s metų Seimą' % todt(row['PRADZIA']).year,
-                        defaults={'timestamp': todt(row['PRADZIA'])},
-                    )[0]
-                )
-                for row in csv.DictReader(f) if row['RUSIS'] == 'SEI'
-            }
+        Term = collections.namedtuple('Term', 'id body since until group')
+        terms = {
+            row['KADENCIJOS_ID']: Term(
+                id=row['KADENCIJOS_ID'],
+                body=typemap[row['RUSIS']],
+                since=todt(row['PRADZIA']),
+                until=todt(row['PABAIGA']) if row['PABAIGA'] else None,
+                group=models.Group.objects.get_or_create(
+                    title='Kandidatai į %s metų Seimą' % todt(row['PRADZIA']).year,
+                    defaults={'timestamp': todt(row['PRADZIA'])},
+                )[0]
+            )
+            for row in term_rows if row['RUSIS'] == 'SEI'
+        }
 
         with (path / 'rinkimai.csv').open() as f:
             Election = collections.namedtuple('Election', 'term date')
@@ -88,109 +384,39 @@ class Command(BaseCommand):
                 for row in csv.DictReader(f)
             }
 
-        def name(name):
-            return ' '.join([x.title() for x in name.split()])
+        if bulk:
+            # Candidate details are printed only with higher verbosity in bulk mode.
+            details = helpers.Printer(self.stdout, options['verbosity'] - 1)
+            importer = BulkImport(seimas)
+        else:
+            details = printer
 
+        stats = collections.Counter()
         with (path / 'kandidatai.csv').open() as f:
-            Candidate = collections.namedtuple('Candidate', 'birth_date last_name first_name')
-            CandidateElection = collections.namedtuple('CandidateElection', 'elected election vienmandate daugiamandate')
-            candidates = collections.defaultdict(list)
-            for row in csv.DictReader(f):
-                if row['VR_TURO_ID'] in elections:
-                    candidate = Candidate(row['GIMIMO_DATA'], name(row['PAVARDE']), name(row['VARDAS']))
-                    vienmandate = row['VIENMANDATE_ORGANIZACIJA']
-                    daugiamandate = row['DAUGIAMANDATE_ORGANIZACIJA']
-                    candidates[candidate].append(CandidateElection(
-                        elected=row['AR_ISRINKTAS'] == 'T',
-                        election=elections[row['VR_TURO_ID']],
-                        vienmandate=organisations[vienmandate] if vienmandate else None,
-                        daugiamandate=organisations[daugiamandate] if daugiamandate else None,
-                    ))
-
-        for candidate, rounds in candidates.items():
-            printer.info('')
-            printer.info('%s %s %s' % candidate)
-
-            membership = {}
-            rounds = sorted(rounds, key=lambda x: x.election.term.since)
-            rounds_by_term = itertools.groupby(rounds, key=lambda x: x.election.term.id)
-
-            times_elected = sum(1 for x in rounds if x.elected)
-            times_candidate = 0
-
-            actor_terms = []
-            for term_id, term_rounds in rounds_by_term:
-                times_candidate += 1
-                term_rounds = list(term_rounds)
-                term = terms[term_id]
-                actor_terms.append(term)
-                elected = sorted([x.election.date for x in term_rounds if x.elected])
-                result = ('elected: %s' % elected[0].strftime('%Y-%m-%d')) if elected else ''
-                printer.info('  %s-%s %s' % (
-                    term.since.strftime('%Y'),
-                    term.until.strftime('%Y') if term.until else '    ',
-                    result,
-                ))
-
-                orgs = set()
-                orgs.update(x.vienmandate for x in term_rounds if x.vienmandate)
-                orgs.update(x.daugiamandate for x in term_rounds if x.daugiamandate)
-
-                if orgs:
-                    for org in sorted(orgs):
-                        printer.info('    %s' % org)
-                        since, until = membership.get(org, (min(elected, default=term.since), term.until))
-                        membership[org] = (
-                            min(since, term.since),
-                            max(until, term.until) if until and term.until else term.until,
-                        )
-
-            printer.info('  Member of:')
-            for org, (since, until) in membership.items():
-                printer.info('    %s (%s - %s)' % (
-                    org,
-                    since.strftime('%Y-%m-%d'),
-                    until.strftime('%Y-%m-%d') if until else '',
-                ))
+            candidates = read_candidates(f, elections, organisations, chunk_size, stats)
+            # Candidates are sorted, so batches are the same on each run and
+            # committed batches can be skipped.
+            candidates = itertools.islice(candidates, checkpoint.batches * batch_size, None)
+            infos = (get_candidate_info(c, r, terms, details) for c, r in candidates)
+            for batch in iter(lambda: list(itertools.islice(infos, batch_size)), []):
+                with transaction.atomic():
+                    if bulk:
+                        created, updated = importer.save(batch)
+                        printer.info('  %d candidates: %d created, %d updated' % (len(batch), created, updated))
+                    else:
+                        for info in batch:
+                            import_candidate(info, seimas)
+                    services.commit_import_batch(checkpoint)
 
-            actor_title = 'seimo narys' if times_elected > 0 else ''
-
-            actor, created = models.Actor.objects.get_or_create(
-                birth_date=candidate.birth_date,
-                first_name=candidate.first_name,
-                last_name=candidate.last_name,
-                defaults={
-                    'title': actor_title,
-                    'times_elected': times_elected,
-                    'times_candidate': times_candidate,
-                },
-            )
+        printer.info('')
+        printer.info('Rebuilding group parties...')
+        services.rebuild_group_parties()
+        # Bulk import does not send signals, that would update actor index.
+        actorindex.bump_version()
+        services.complete_import(checkpoint)
 
-            if not created:
-                modified = [
-                    actor.times_elected != times_elected,
-                    actor.times_candidate != times_candidate,
-                ]
-                if any(modified):
-                    actor.times_elected = times_elected
-                    actor.times_candidate = times_candidate
-                    actor.save()
-
-            for org, (since, until) in membership.items():
-                party, created = models.Actor.objects.get_or_create(first_name=org, group=True, defaults={
-                    'title': 'plitinė partija',
-                    'body': seimas,
-                })
-
-                models.Member.objects.get_or_create(actor=actor, group=party, defaults={
-                    'since': since,
-                    'until': until,
-                })
-
-            # Add this actor to all term groups
-            in_groups = actor.ingroups.values_list('pk', flat=True)
-            for term in actor_terms:
-                if term.group.pk not in in_groups:
-                    term.group.members.add(actor)
-
-        printer.info('done.')
+        seconds = time.perf_counter() - start
+        printer.info('done, %d rows, %d candidates in %.1fs (%.0f rows/s), peak memory %d MB.' % (
+            stats['rows'], stats['candidates'], seconds, stats['rows'] / seconds if seconds else 0,
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024,
+        ))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from manopozicija import helpers
+from manopozicija import services
+
+
+class Command(BaseCommand):
+    help = 'Recomputes queued quote, source and actor argument positions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help="Number of positions recomputed in one transaction")
+        parser.add_argument('--loop', action='store_true', default=False, help="Keep waiting for new updates")
+        parser.add_argument('--interval', type=float, default=1, help="Seconds to wait, when queue is empty")
+
+    def handle(self, batch_size, loop, interval, **options):
+        printer = helpers.Printer(self.stdout, options['verbosity'])
+        while True:
+            count = 0
+            while True:
+                processed = services.process_position_updates(batch_size)
+                count += processed
+                if processed < batch_size:
+                    break
+            if count:
+                printer.info('%d positions updated.' % count)
+            if not loop:
+                break
+            time.sleep(interval)
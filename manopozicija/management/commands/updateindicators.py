@@ -6,13 +6,20 @@ from manopozicija import indicators
 class Command(BaseCommand):
     help = 'Parses Lithuanian names from vardai.vlkk.lt and writes to specified output file.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help="Number of indicators fetched at the same time")
+        parser.add_argument('--timeout', type=float, default=600, help="Seconds to wait for a single indicator")
+        parser.add_argument('--cache-ttl', type=float, default=3600, help=(
+            "Seconds, during which downloaded datasets are reused without checking if they have changed"
+        ))
+
     def _info(self, verbosity, message):
         if verbosity > 0:
             self.stdout.write(message)
 
-    def handle(self, *args, **options):
+    def handle(self, *args, workers, timeout, cache_ttl, **options):
         self._info(options['verbosity'], 'Importing indicators...')
         indicators.import_indicators(indicators.INDICATORS)
 
         self._info(options['verbosity'], 'Updating indicators...')
-        indicators.update_indicators(indicators.INDICATORS)
+        indicators.update_indicators(indicators.INDICATORS, workers=workers, timeout=timeout, cache_ttl=cache_ttl)
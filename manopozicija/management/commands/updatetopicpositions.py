@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from manopozicija import helpers
+from manopozicija import services
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds denormalized user topic positions from user post positions.'
+
+    def handle(self, *args, **options):
+        printer = helpers.Printer(self.stdout, options['verbosity'])
+        printer.info('Rebuilding user topic positions...')
+        count = services.rebuild_user_topic_positions()
+        printer.info('done, %d positions updated.' % count)
@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from manopozicija import models
+from manopozicija import helpers
+from manopozicija import thumbnails
+
+
+# (model, image field, thumbnails) rendered in templates.
+IMAGES = [
+    (models.Actor, 'photo', (thumbnails.PHOTO, thumbnails.SMALL_PHOTO)),
+    (models.Curator, 'photo', (thumbnails.PHOTO,)),
+    (models.Topic, 'logo', (thumbnails.LOGO,)),
+]
+
+
+class Command(BaseCommand):
+    help = 'Renders thumbnails used in templates for all actor and curator photos and topic logos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help=(
+            "Number of rendering processes, defaults to number of CPUs, 0 renders in this process"
+        ))
+
+    def handle(self, workers, **options):
+        printer = helpers.Printer(self.stdout, options['verbosity'])
+        for model, field, geometries in IMAGES:
+            names = list(
+                model.objects.
+                exclude(**{field: ''}).
+                order_by(field).
+                values_list(field, flat=True).
+                distinct()
+            )
+            printer.info('Rendering %s %ss...' % (model._meta.verbose_name, field))
+            start = time.perf_counter()
+            failed = 0
+            for name, error in thumbnails.render_many(names, geometries, workers):
+                if error:
+                    failed += 1
+                    printer.info('  %s: %s' % (name, error))
+            seconds = time.perf_counter() - start
+            rendered = (len(names) - failed) * len(geometries)
+            printer.info('  %d images, %d thumbnails in %.1fs (%.0f thumbnails/s), %d failed.' % (
+                len(names), rendered, seconds, rendered / seconds if seconds else 0, failed,
+            ))
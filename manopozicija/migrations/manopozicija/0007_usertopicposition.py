@@ -0,0 +1,51 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_user_topic_positions(apps, schema_editor):
+    """Same as services.rebuild_user_topic_positions, with historical models."""
+    UserPostPosition = apps.get_model('manopozicija', 'UserPostPosition')
+    UserTopicPosition = apps.get_model('manopozicija', 'UserTopicPosition')
+    rows = (
+        UserPostPosition.objects.
+        values('user', 'post__topic').
+        annotate(position=models.Avg('position'), count=models.Count('pk')).
+        order_by()
+    )
+    UserTopicPosition.objects.bulk_create((
+        UserTopicPosition(
+            user_id=row['user'],
+            topic_id=row['post__topic'],
+            position=row['position'] or 0,
+            count=row['count'],
+        )
+        for row in rows.iterator()
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('manopozicija', '0006_auto_20160726_1014'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserTopicPosition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.FloatField(default=0)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='manopozicija.Topic')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'topic')},
+            },
+        ),
+        migrations.RunPython(fill_user_topic_positions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:46
+
+from django.db import migrations, models
+
+
+def fill_user_argument_totals(apps, schema_editor):
+    """Same as `checkvotes --fix` for user argument positions, with historical models."""
+    Argument = apps.get_model('manopozicija', 'Argument')
+    UserPostPosition = apps.get_model('manopozicija', 'UserPostPosition')
+    UserArgumentPosition = apps.get_model('manopozicija', 'UserArgumentPosition')
+    rows = (
+        UserPostPosition.objects.
+        filter(post__postargument__isnull=False).
+        exclude(position=0).
+        values('user', 'post__topic', 'post__postargument__title').
+        annotate(
+            total=models.Sum(models.Case(
+                models.When(post__postargument__counterargument=True, then=models.F('post__postargument__position') * -1),
+                default=models.F('post__postargument__position'),
+            ) * models.F('position')),
+            count=models.Count('post__postargument'),
+        ).
+        order_by()
+    )
+    expected = {
+        (x['user'], x['post__topic'], x['post__postargument__title']): (x['total'], x['count'])
+        for x in rows
+    }
+    user_arguments = list(UserArgumentPosition.objects.select_related('argument'))
+    for user_argument in user_arguments:
+        key = (user_argument.user_id, user_argument.argument.topic_id, user_argument.argument.title)
+        user_argument.total, user_argument.count = expected.pop(key, (0, 0))
+        user_argument.position = user_argument.total / user_argument.count if user_argument.count else 0
+    UserArgumentPosition.objects.bulk_update(user_arguments, ['total', 'count', 'position'], batch_size=1000)
+    for (user, topic, title), (total, count) in expected.items():
+        argument, created = Argument.objects.get_or_create(topic_id=topic, title=title)
+        UserArgumentPosition.objects.update_or_create(user_id=user, argument=argument, defaults={
+            'total': total,
+            'count': count,
+            'position': total / count,
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manopozicija', '0007_usertopicposition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userargumentposition',
+            name='count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userargumentposition',
+            name='total',
+            field=models.FloatField(default=0),
+        ),
+        migrations.RunPython(fill_user_argument_totals, migrations.RunPython.noop),
+    ]
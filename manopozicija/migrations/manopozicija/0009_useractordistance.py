@@ -0,0 +1,84 @@
+# Generated by Django 2.2.28 on 2026-10-18 07:52
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Abs
+import django.db.models.deletion
+
+
+def fill_user_actor_distances(apps, schema_editor):
+    """Same as `checkvotes --fix` for user distances to actors, with historical models."""
+    UserPostPosition = apps.get_model('manopozicija', 'UserPostPosition')
+    UserArgumentPosition = apps.get_model('manopozicija', 'UserArgumentPosition')
+    UserActorDistance = apps.get_model('manopozicija', 'UserActorDistance')
+    post_positions = (
+        UserPostPosition.objects.
+        filter(post__actor__isnull=False).
+        exclude(position=0).
+        annotate(actor=models.F('post__actor')).
+        values('user', 'actor').
+        annotate(
+            distance=models.ExpressionWrapper(
+                models.Sum(Abs(models.F('position') - 1) / 2),
+                output_field=models.FloatField(),
+            ),
+            weight=models.Count('pk'),
+        ).
+        order_by()
+    )
+    argument_positions = (
+        UserArgumentPosition.objects.
+        filter(argument__actorargumentposition__isnull=False).
+        exclude(position=0).
+        annotate(actor=models.F('argument__actorargumentposition__actor')).
+        values('user', 'actor').
+        annotate(
+            distance=models.ExpressionWrapper(
+                models.Sum(Abs(models.F('position') - models.F('argument__actorargumentposition__position')) / 2),
+                output_field=models.FloatField(),
+            ),
+            weight=models.Count('argument__actorargumentposition'),
+        ).
+        order_by()
+    )
+    distances = {}
+    for x in list(post_positions) + list(argument_positions):
+        total, weight = distances.get((x['user'], x['actor']), (0, 0))
+        distances[x['user'], x['actor']] = (total + (x['distance'] or 0), weight + (x['weight'] or 1))
+    UserActorDistance.objects.bulk_create([
+        UserActorDistance(
+            user_id=user,
+            actor_id=actor,
+            total=total,
+            weight=weight,
+            distance=total / weight if weight else 0,
+        )
+        for (user, actor), (total, weight) in distances.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('manopozicija', '0008_userargumentposition_total_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserActorDistance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.FloatField(default=0)),
+                ('total', models.FloatField(default=0)),
+                ('weight', models.PositiveIntegerField(default=0)),
+                ('actor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='manopozicija.Actor')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'actor')},
+                'index_together': {('user', 'distance')},
+            },
+        ),
+        migrations.RunPython(fill_user_actor_distances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manopozicija', '0009_useractordistance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('command', models.CharField(max_length=64, unique=True)),
+                ('checksum', models.CharField(max_length=64)),
+                ('batch_size', models.PositiveIntegerField()),
+                ('batches', models.PositiveIntegerField(default=0)),
+                ('started', models.DateTimeField()),
+                ('completed', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
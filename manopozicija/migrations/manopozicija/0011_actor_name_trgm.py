@@ -0,0 +1,32 @@
+from django.db import migrations
+from manopozicija.migrations import LoadExtension
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manopozicija', '0010_importcheckpoint'),
+    ]
+
+    operations = [
+        LoadExtension('unaccent'),
+        # unaccent() is only STABLE, because dictionary can be changed, but
+        # index expressions must be IMMUTABLE. Dictionary and function are
+        # schema qualified, so that the wrapper does not depend on search_path.
+        migrations.RunSQL(
+            "CREATE OR REPLACE FUNCTION immutable_unaccent(text) RETURNS text "
+            "LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT AS "
+            "$$ SELECT public.unaccent(regdictionary 'public.unaccent', $1) $$",
+            "DROP FUNCTION immutable_unaccent(text)",
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX manopozicija_actor_first_name_trgm ON manopozicija_actor "
+            "USING gin (immutable_unaccent(lower(first_name)) gin_trgm_ops)",
+            "DROP INDEX manopozicija_actor_first_name_trgm",
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX manopozicija_actor_last_name_trgm ON manopozicija_actor "
+            "USING gin (immutable_unaccent(lower(last_name)) gin_trgm_ops)",
+            "DROP INDEX manopozicija_actor_last_name_trgm",
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 08:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manopozicija', '0011_actor_name_trgm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PositionUpdate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'quote'), (2, 'source'), (3, 'argument')])),
+                ('object_id', models.PositiveIntegerField()),
+                ('title', models.CharField(blank=True, max_length=255)),
+                ('updated', models.DateTimeField()),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='manopozicija.Topic')),
+            ],
+            options={
+                'unique_together': {('kind', 'topic', 'object_id', 'title')},
+            },
+        ),
+    ]
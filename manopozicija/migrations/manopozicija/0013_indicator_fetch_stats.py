@@ -0,0 +1,43 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manopozicija', '0012_positionupdate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indicator',
+            name='bytes_downloaded',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='indicator',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='indicator',
+            name='download_time',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='indicator',
+            name='etag',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='indicator',
+            name='fetch_time',
+            field=models.FloatField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='indicator',
+            name='last_modified',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
@@ -68,6 +68,31 @@ class Indicator(models.Model):
     Key performance indicators are data sources plotted on the topic
     diagram, showing how government impacts certain indicators.
 
+    Attributes
+    ----------
+
+    etag : str
+        ETag header of the last downloaded source.
+
+    last_modified : str
+        Last-Modified header of the last downloaded source. Both headers are
+        sent back with the next request, so that unchanged source is not
+        downloaded again.
+
+    content_hash : str
+        SHA-256 hash of the last fetched data, data files are only rewritten
+        when data change.
+
+    fetch_time : float
+        Seconds spent on the last fetch, including download and parsing.
+
+    download_time : float
+        Seconds spent on downloading in the last fetch.
+
+    bytes_downloaded : int
+        Number of bytes downloaded in the last fetch, 0 if source was not
+        modified.
+
     """
     slug = models.SlugField(unique=True, editable=False)
     created = CreationDateTimeField(editable=False)
@@ -82,6 +107,12 @@ class Indicator(models.Model):
     title = models.CharField(max_length=255)
     ylabel = models.CharField(max_length=255)
     source = models.URLField(_("Šaltinis"))
+    etag = models.CharField(max_length=255, blank=True, editable=False)
+    last_modified = models.CharField(max_length=64, blank=True, editable=False)
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
+    fetch_time = models.FloatField(null=True, blank=True, editable=False)
+    download_time = models.FloatField(null=True, blank=True, editable=False)
+    bytes_downloaded = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.title
@@ -620,15 +651,90 @@ class UserPostPosition(models.Model):
         unique_together = ('user', 'post')
 
 
+class UserTopicPosition(models.Model):
+    """User position about a topic.
+
+    Denormalized average of all user positions about topic posts, kept up to
+    date by `services.update_user_position`.
+
+    Attributes
+    ----------
+
+    position : float
+        Average of UserPostPosition.position values of a topic.
+
+    count : int
+        Number of UserPostPosition rows of a topic.
+
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
+    position = models.FloatField(default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'topic')
+
+
 class UserArgumentPosition(models.Model):
+    """User position about a topic argument.
+
+    Attributes
+    ----------
+
+    position : float
+        Average of user votes for posts having this argument, multiplied by
+        argument positions.
+
+    total : float
+        Sum of values averaged in position.
+
+    count : int
+        Number of values averaged in position.
+
+    """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     argument = models.ForeignKey(Argument, on_delete=models.CASCADE)
     position = models.FloatField(default=0)
+    total = models.FloatField(default=0)
+    count = models.PositiveIntegerField(default=0)
 
     class Meta:
         unique_together = ('user', 'argument')
 
 
+class UserActorDistance(models.Model):
+    """Distance between user and actor positions.
+
+    Denormalized result of `services.compute_positions` for all actors, kept
+    up to date by `services.update_user_position` and
+    `services.update_actor_topic_argument_position`, so that comparison page
+    needs a single query.
+
+    Attributes
+    ----------
+
+    distance : float
+        Average distance, from 0 (same positions) to 1 (opposite positions).
+
+    total : float
+        Sum of distances averaged in distance.
+
+    weight : int
+        Number of distances averaged in distance.
+
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    actor = models.ForeignKey(Actor, on_delete=models.CASCADE)
+    distance = models.FloatField(default=0)
+    total = models.FloatField(default=0)
+    weight = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'actor')
+        index_together = ('user', 'distance')
+
+
 class Group(models.Model):
     """Mainly used for comparison page.
 
@@ -641,3 +747,90 @@ class Group(models.Model):
 
     def __str__(self):
         return self.title
+
+
+class ImportCheckpoint(models.Model):
+    """Progress of the last run of an import command.
+
+    Import commands commit data in batches and update checkpoint in the same
+    transaction with each batch, so that an interrupted import can be resumed
+    from the last committed batch.
+
+    Attributes
+    ----------
+
+    command : str
+        Import command name.
+
+    checksum : str
+        SHA-256 hash of imported files content.
+
+    batch_size : int
+        Batch size used by the import, batches can be skipped only if batch
+        size does not change.
+
+    batches : int
+        Number of committed batches.
+
+    completed : datetime
+        Time, when import was completed, None if import was interrupted.
+
+    """
+    command = models.CharField(max_length=64, unique=True)
+    checksum = models.CharField(max_length=64)
+    batch_size = models.PositiveIntegerField()
+    batches = models.PositiveIntegerField(default=0)
+    started = models.DateTimeField()
+    completed = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return '%s: %d batches' % (self.command, self.batches)
+
+
+class PositionUpdate(models.Model):
+    """Queued recomputation of a stored position.
+
+    Changes of quotes, arguments and curator votes only queue positions that
+    depend on them, and `processpositions` command recomputes them later.
+    Repeated changes of the same object are coalesced into one row, until the
+    row is processed.
+
+    Attributes
+    ----------
+
+    kind : int
+        Which position to recompute: QUOTE - Post.position of a quote post,
+        SOURCE - Source.position, ARGUMENT - ActorArgumentPosition.position.
+
+    topic : Topic
+        Topic of the position.
+
+    object_id : int
+        Post id for QUOTE, Source id for SOURCE and Actor id for ARGUMENT.
+
+    title : str
+        Argument title for ARGUMENT, empty otherwise.
+
+    updated : datetime.datetime
+        Time, when recomputation was last requested.
+
+    """
+    QUOTE = 1
+    SOURCE = 2
+    ARGUMENT = 3
+    KIND_CHOICES = (
+        (QUOTE, 'quote'),
+        (SOURCE, 'source'),
+        (ARGUMENT, 'argument'),
+    )
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    title = models.CharField(max_length=255, blank=True)
+    updated = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('kind', 'topic', 'object_id', 'title')
+
+    def __str__(self):
+        return '%s: %s' % (self.get_kind_display(), self.object_id)
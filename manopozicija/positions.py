@@ -0,0 +1,137 @@
+"""Position comparison with NumPy arrays.
+
+Computes the same distances between user and actor positions as
+`services.compute_positions`, but loads all positions into arrays and
+compares many users at once, which is much faster than running SQL
+aggregation queries for each user.
+
+"""
+
+import collections
+
+import numpy as np
+
+from manopozicija import models
+
+
+ActorPositions = collections.namedtuple('ActorPositions', ['actors', 'arguments', 'positions'])
+ActorPositions.__doc__ = """Argument positions of group members.
+
+Attributes
+----------
+
+actors : numpy.ndarray
+    Sorted actor ids.
+
+arguments : numpy.ndarray
+    Sorted ids of arguments, having at least one actor position.
+
+positions : numpy.ndarray
+    Actor positions of (actors, arguments) shape, NaN if actor does not
+    have a position about an argument.
+
+"""
+
+
+def _to_array(rows, columns):
+    return np.array(list(rows), dtype=float).reshape(-1, columns)
+
+
+def load_actor_positions(group):
+    actors = np.array(sorted(group.members.values_list('pk', flat=True)), dtype=np.int64)
+    rows = _to_array(
+        models.ActorArgumentPosition.objects.
+        filter(actor__ingroup=group).
+        values_list('actor', 'argument', 'position'),
+        3,
+    )
+    arguments = np.unique(rows[:, 1]).astype(np.int64)
+    positions = np.full((len(actors), len(arguments)), np.nan)
+    positions[
+        np.searchsorted(actors, rows[:, 0]),
+        np.searchsorted(arguments, rows[:, 1]),
+    ] = rows[:, 2]
+    return ActorPositions(actors, arguments, positions)
+
+
+def compute_distances(group, users, actor_positions=None):
+    """Compute distances between users and group members.
+
+    Parameters
+    ----------
+
+    group : models.Group
+        Users are compared with members of this group.
+
+    users : list
+        List of User instances.
+
+    actor_positions : ActorPositions
+        Preloaded actor positions of the group, loaded if not given.
+
+    Returns
+    -------
+
+    (users, actors, total, weight) tuple, where users and actors are sorted id
+    arrays and total and weight are arrays of (users, actors) shape. Distance
+    is total / weight, users and actors having zero weight are not compared.
+
+    """
+    actors, arguments, positions = actor_positions or load_actor_positions(group)
+    users = np.array(sorted({user.pk for user in users}), dtype=np.int64)
+    total = np.zeros((len(users), len(actors)))
+    weight = np.zeros((len(users), len(actors)), dtype=np.int64)
+
+    # User votes for quotes are compared with quote author position, which is 1.
+    rows = _to_array(
+        models.UserPostPosition.objects.
+        filter(user__in=users.tolist(), post__actor__ingroup=group).
+        exclude(position=0).
+        values_list('user', 'post__actor', 'position'),
+        3,
+    )
+    index = np.searchsorted(users, rows[:, 0]), np.searchsorted(actors, rows[:, 1])
+    np.add.at(total, index, np.abs(rows[:, 2] - 1) / 2)
+    np.add.at(weight, index, 1)
+
+    # Users having a position about an argument are compared with all actors
+    # having a position about the same argument.
+    rows = _to_array(
+        models.UserArgumentPosition.objects.
+        filter(user__in=users.tolist(), argument__in=arguments.tolist()).
+        exclude(position=0).
+        values_list('user', 'argument', 'position'),
+        3,
+    )
+    user_positions = np.zeros((len(users), len(arguments)))
+    user_positions[np.searchsorted(users, rows[:, 0]), np.searchsorted(arguments, rows[:, 1])] = rows[:, 2]
+    user_mask = user_positions != 0
+    actor_mask = ~np.isnan(positions)
+    weight += user_mask.astype(np.int64) @ actor_mask.T.astype(np.int64)
+    for i in range(len(arguments)):
+        distance = np.abs(user_positions[:, i, None] - positions[None, :, i]) / 2
+        mask = user_mask[:, i, None] & actor_mask[None, :, i]
+        total += np.where(mask, distance, 0)
+
+    return users, actors, total, weight
+
+
+def compare_users_positions(group, users, actor_positions=None):
+    """Compare positions of many users with group members at once.
+
+    Returns a dict of user ids and lists of (actor id, distance) pairs, same
+    as returned by `services.compare_positions` for each user.
+
+    """
+    users, actors, total, weight = compute_distances(group, users, actor_positions)
+    result = {}
+    for i, user in enumerate(users.tolist()):
+        mask = weight[i] > 0
+        distance = total[i, mask] / weight[i, mask]
+        order = np.lexsort((actors[mask], distance))
+        result[user] = list(zip(actors[mask][order].tolist(), distance[order].tolist()))
+    return result
+
+
+def compare_positions(group, user):
+    return compare_users_positions(group, [user])[user.pk]
@@ -1,9 +1,18 @@
+import math
+import time
+import hashlib
 import urllib
+import unidecode
 import itertools
+import collections
 
+from django.conf import settings
+from django.db import connection, transaction
 from django.utils import timezone
+from django.core.cache import cache
 from django.db.models import FloatField
-from django.db.models import F, Case, When, Count, Sum, Avg, ExpressionWrapper
+from django.db.models import F, Case, When, Count, Sum, Avg, ExpressionWrapper, Prefetch
+from django.db.models.functions import Coalesce, NullIf
 from django.utils.translation import ugettext
 from django.contrib.contenttypes.models import ContentType
 
@@ -36,9 +45,41 @@ def create_event(user, topic, event: dict):
         # Automatically approve posts created by topic curators.
         models.PostLog.objects.create(user=user, post=post, action=models.PostLog.VOTE, vote=1)
 
+    bump_topic_version(topic)
+
     return event
 
 
+def is_duplicate_quote(topic, actor, source_link, text, exclude=None, similarity=0.9):
+    """Check if a similar quote from the same source is already posted in the topic.
+
+    Everything is checked in a single query. Source is looked up in a
+    subquery by its unique key, so trigram similarity is only computed for
+    quotes of that source. Raw SQL is used, because for sources with a few
+    quotes building the query with ORM takes longer than running it.
+
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS ('
+            '  SELECT 1 FROM {quote} q'
+            '  JOIN {post} p ON p.object_id = q.id AND p.content_type_id = %s AND p.topic_id = %s'
+            '  WHERE q.source_id = (SELECT id FROM {source} WHERE actor_id = %s AND source_link = %s)'
+            '    AND similarity(q.text, %s) > %s AND q.id <> %s'
+            ')'.format(
+                quote=models.Quote._meta.db_table,
+                post=models.Post._meta.db_table,
+                source=models.Source._meta.db_table,
+            ),
+            [
+                ContentType.objects.get_for_model(models.Quote).pk, topic.pk,
+                actor.pk, source_link,
+                text, similarity, exclude or 0,
+            ],
+        )
+        return cursor.fetchone()[0]
+
+
 def create_quote(user, topic, source: dict, quote: dict, arguments: list):
     source['actor_title'] = source['actor'].title
     source['source_title'] = get_title_from_link(source['source_link'])
@@ -68,20 +109,21 @@ def create_quote(user, topic, source: dict, quote: dict, arguments: list):
         # Automatically approve posts created by topic curators.
         models.PostLog.objects.create(user=user, post=post, action=models.PostLog.VOTE, vote=1)
 
+    positions = PositionUpdates(topic)
     for argument in arguments:
         if argument.get('title'):
             models.PostArgument.objects.create(topic=topic, post=post, quote=quote, **argument)
-            update_actor_topic_argument_position(source.actor, topic, argument['title'])
-
-    post.position = get_quote_position(topic, quote)
-    post.save()
+            positions.argument(source.actor, argument['title'])
+    positions.quote(post)
+    positions.source(source)
+    positions.save()
 
-    source.position = get_source_position(topic, source)
-    source.save()
+    bump_topic_version(topic)
 
     return quote
 
 
+@transaction.atomic
 def update_quote(user, topic, post, quote, arguments, data):
     # XXX: candidate to merge with create_quote
     #      save_quote(user, topic, data, post=None, quote=None, arguments=None)
@@ -105,19 +147,24 @@ def update_quote(user, topic, post, quote, arguments, data):
     is_curator = is_topic_curator(user, topic)
     approved = timezone.now() if is_curator else None
 
+    # Votes were given to the old version of the quote.
+    _delete_user_positions(post)
+    post.refresh_from_db(fields=['upvotes', 'downvotes'])
+
     post.body = topic.default_body
     post.topic = topic
     post.actor = source.actor
-    post.position = 0
     post.approved = approved
     post.timestamp = source.timestamp
-    post.upvotes = 0
     post.content_object = quote
 
     if is_curator:
         # Automatically approve posts created by topic curators.
         models.PostLog.objects.create(user=user, post=post, action=models.PostLog.VOTE, vote=1)
 
+    post.save()
+
+    positions = PositionUpdates(topic)
     for argument in data['arguments']:
         instance = argument.pop('id', None)
         if argument.get('title'):
@@ -127,15 +174,14 @@ def update_quote(user, topic, post, quote, arguments, data):
                 instance.save()
             else:
                 models.PostArgument.objects.create(topic=topic, post=post, quote=quote, **argument)
-            update_actor_topic_argument_position(source.actor, topic, argument['title'])
+            positions.argument(source.actor, argument['title'])
         elif instance:
             instance.delete()
+    positions.quote(post)
+    positions.source(source)
+    positions.save()
 
-    post.position = get_quote_position(topic, quote)
-    post.save()
-
-    source.position = get_source_position(topic, source)
-    source.save()
+    bump_topic_version(topic)
 
     return quote
 
@@ -159,16 +205,22 @@ def create_curator(user, topic, user_data: dict, curator: dict):
         content_object=curator,
     )
 
+    bump_topic_version(topic)
+
     return curator
 
 
+@transaction.atomic
 def delete_post(post):
+    _delete_user_positions(post)
     post.delete()
     quote = post.content_object
-    source = quote.source
 
-    source.position = get_source_position(post.topic, source)
-    source.save()
+    positions = PositionUpdates(post.topic)
+    positions.source(quote.source)
+    positions.save()
+
+    bump_topic_version(post.topic)
 
 
 def is_topic_curator(user, topic):
@@ -181,6 +233,52 @@ def is_topic_curator(user, topic):
         return False
 
 
+def _get_topic_version_key(topic):
+    return 'manopozicija:topic:%d:version' % topic.pk
+
+
+def get_topic_version(topic):
+    """Return current topic version used as a part of topic cache keys.
+
+    Version is initialized from current time, so that cache entries left from
+    an evicted version counter are never reused.
+
+    """
+    key = _get_topic_version_key(topic)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_topic_cache_key(topic, *parts):
+    return 'manopozicija:topic:%d:%s:%s' % (topic.pk, get_topic_version(topic), ':'.join(parts))
+
+
+def bump_topic_version(topic):
+    """Invalidate all cached topic data.
+
+    Inside a transaction version is bumped once more after commit, because
+    parallel requests could have cached data, read before commit, under the
+    version bumped before commit. Version is still bumped right away, so that
+    changed data are seen in the same transaction.
+
+    """
+    if connection.in_atomic_block:
+        transaction.on_commit(lambda: _bump_topic_version(topic))
+    return _bump_topic_version(topic)
+
+
+def _bump_topic_version(topic):
+    key = _get_topic_version_key(topic)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), timeout=None)
+        return cache.get(key)
+
+
 def get_title_from_link(link):
     title = urllib.parse.urlparse(link).netloc
     if title.startswith('www.'):
@@ -200,6 +298,21 @@ def get_source_position(topic, source):
     return agg['position'] or 0
 
 
+def get_sources_positions(topic, sources):
+    """Same as get_source_position, but for many sources in one query."""
+    positions = dict(
+        models.PostArgument.objects.
+        filter(topic=topic, quote__source__in=sources, post__approved__isnull=False).
+        values('quote__source').
+        annotate(position=Avg(Case(
+            When(counterargument=True, then=F('position') * -1),
+            default=F('position')
+        ))).
+        values_list('quote__source', 'position')
+    )
+    return {source.pk: positions.get(source.pk) or 0 for source in sources}
+
+
 def get_quote_position(topic, quote):
     agg = (
         models.PostArgument.objects.
@@ -212,6 +325,112 @@ def get_quote_position(topic, quote):
     return agg['position'] or 0
 
 
+class PositionUpdates(object):
+    """Positions, that have to be recomputed after a change.
+
+    Positions are collected during a change, so that each position is
+    recomputed once, however many arguments of it were changed. If
+    MANOPOZICIJA_DEFER_POSITIONS is enabled, positions are queued and
+    recomputed by `processpositions` command, otherwise they are recomputed
+    right away in this process.
+
+    """
+
+    def __init__(self, topic):
+        self.topic = topic
+        self.objects = {}
+
+    def quote(self, post):
+        self.objects[(models.PositionUpdate.QUOTE, post.pk, '')] = post
+
+    def source(self, source):
+        if source is not None:
+            self.objects[(models.PositionUpdate.SOURCE, source.pk, '')] = source
+
+    def argument(self, actor, title):
+        self.objects[(models.PositionUpdate.ARGUMENT, actor.pk, title)] = actor
+
+    def save(self):
+        if settings.MANOPOZICIJA_DEFER_POSITIONS:
+            queue_position_updates(self.topic, self.objects)
+        else:
+            for (kind, object_id, title), obj in sorted(self.objects.items(), key=lambda x: x[0]):
+                _update_position(kind, self.topic, obj, title)
+        self.objects = {}
+
+
+def queue_position_updates(topic, keys):
+    """Queue (kind, object_id, title) position updates of a topic.
+
+    Already queued updates are touched instead of inserted. Updating the
+    queued row locks it until the change is committed, so that
+    `process_position_updates` does not take it and read positions before
+    the change.
+
+    """
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO {table} (kind, topic_id, object_id, title, updated) VALUES (%s, %s, %s, %s, %s) '
+            'ON CONFLICT (kind, topic_id, object_id, title) DO UPDATE SET updated = EXCLUDED.updated'.format(
+                table=models.PositionUpdate._meta.db_table,
+            ),
+            [(kind, topic.pk, object_id, title, now) for kind, object_id, title in sorted(keys)],
+        )
+
+
+@transaction.atomic
+def process_position_updates(limit=100):
+    """Recompute queued positions, return number of processed updates.
+
+    Updates are taken and deleted in one statement, skipping rows locked by
+    changes in progress, so that several workers can run at the same time
+    and a change made during recomputation is queued again.
+
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'DELETE FROM {table} WHERE id IN ('
+            '  SELECT id FROM {table} ORDER BY updated LIMIT %s FOR UPDATE SKIP LOCKED'
+            ') RETURNING kind, topic_id, object_id, title'.format(
+                table=models.PositionUpdate._meta.db_table,
+            ),
+            [limit],
+        )
+        updates = sorted(cursor.fetchall())
+
+    ids = collections.defaultdict(set)
+    for kind, topic_id, object_id, title in updates:
+        ids[kind].add(object_id)
+    objects = {
+        models.PositionUpdate.QUOTE: models.Post.objects.in_bulk(ids[models.PositionUpdate.QUOTE]),
+        models.PositionUpdate.SOURCE: models.Source.objects.in_bulk(ids[models.PositionUpdate.SOURCE]),
+        models.PositionUpdate.ARGUMENT: models.Actor.objects.in_bulk(ids[models.PositionUpdate.ARGUMENT]),
+    }
+    topics = models.Topic.objects.in_bulk({topic_id for kind, topic_id, object_id, title in updates})
+
+    for kind, topic_id, object_id, title in updates:
+        # Objects could be deleted after update was queued.
+        obj = objects[kind].get(object_id)
+        if obj is not None:
+            _update_position(kind, topics[topic_id], obj, title)
+    for topic in topics.values():
+        bump_topic_version(topic)
+
+    return len(updates)
+
+
+def _update_position(kind, topic, obj, title):
+    if kind == models.PositionUpdate.QUOTE:
+        obj.position = get_quote_position(topic, obj.content_object)
+        obj.save(update_fields=['position'])
+    elif kind == models.PositionUpdate.SOURCE:
+        obj.position = get_source_position(topic, obj)
+        obj.save(update_fields=['position'])
+    elif kind == models.PositionUpdate.ARGUMENT:
+        update_actor_topic_argument_position(obj, topic, title)
+
+
 def get_topic_arguments(topic):
     return (
         models.PostArgument.objects.
@@ -222,6 +441,45 @@ def get_topic_arguments(topic):
     )
 
 
+def get_content_objects(posts):
+    """Load content objects of all given posts with one query per content type.
+
+    Loaded objects are assigned to `Post.content_object`, so accessing it
+    later does not hit the database. Quote arguments are prefetched too and
+    are available via `quote.postargument_set.all()` ordered by pk.
+
+    Posts, whose content objects were deleted, are not returned.
+
+    """
+    querysets = {
+        models.Event: models.Event.objects.all(),
+        models.Quote: (
+            models.Quote.objects.
+            select_related('source__actor').
+            prefetch_related(Prefetch('postargument_set', queryset=models.PostArgument.objects.order_by('pk')))
+        ),
+        models.Curator: models.Curator.objects.select_related('user'),
+    }
+
+    object_ids = collections.defaultdict(set)
+    for post in posts:
+        object_ids[post.content_type_id].add(post.object_id)
+
+    objects = {}
+    for content_type_id, ids in object_ids.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        objects[content_type_id] = querysets.get(model, model.objects.all()).in_bulk(ids)
+
+    result = []
+    for post in posts:
+        content_object = objects[post.content_type_id].get(post.object_id)
+        if content_object is not None:
+            post.content_object = content_object
+            result.append(post)
+
+    return result
+
+
 def get_topic_posts(topic, queue=False):
     result = []
 
@@ -232,7 +490,7 @@ def get_topic_posts(topic, queue=False):
             order_by('-created', '-pk')
         )
     else:
-        curator_type = ContentType.objects.get(app_label='manopozicija', model='curator')
+        curator_type = ContentType.objects.get_for_model(models.Curator)
         qs = (
             models.Post.objects.
             exclude(content_type=curator_type).
@@ -240,7 +498,13 @@ def get_topic_posts(topic, queue=False):
             order_by('-timestamp', 'pk')
         )
 
-    groups = itertools.groupby(qs, key=lambda x: (x.content_type.app_label, x.content_type.model))
+    posts = get_content_objects(list(qs))
+
+    def content_type(post):
+        content_type = ContentType.objects.get_for_id(post.content_type_id)
+        return content_type.app_label, content_type.model
+
+    groups = itertools.groupby(posts, key=content_type)
     for content_type, posts in groups:
         if content_type == ('manopozicija', 'event'):
             for post in posts:
@@ -250,7 +514,7 @@ def get_topic_posts(topic, queue=False):
                     'event': post.content_object,
                 })
         elif content_type == ('manopozicija', 'quote'):
-            for _, quotes in itertools.groupby(posts, key=lambda x: x.content_object.source.pk):
+            for _, quotes in itertools.groupby(posts, key=lambda x: x.content_object.source_id):
                 quotes = list(quotes)
                 result.append({
                     'type': quotes[0].content_type.model,
@@ -340,7 +604,7 @@ def dump_topic_posts(topic, **kwargs):
             for post, quote in row['quotes']:
                 votes = get_post_votes_display(post)
                 result.append(' |      %s' % _align_both_sides(quote.text, '(%s)' % votes, middle + 4))
-                for argument in quote.postargument_set.order_by('title'):
+                for argument in sorted(quote.postargument_set.all(), key=lambda x: x.title):
                     if argument.counterargument and argument.counterargument_title:
                         counterargument = ' < ' + argument.counterargument_title
                     elif argument.counterargument:
@@ -363,29 +627,230 @@ def get_post_votes(post):
     return agg['upvotes'] or 0, abs(agg['downvotes'] or 0)
 
 
-def update_user_post_argument_positions(user, post):
-    post_arguments = list(post.postargument_set.distinct().values_list('title', flat=True))
+def _split_vote(vote):
+    return (vote, 0) if vote > 0 else (0, -vote)
+
+
+def _get_argument_sign(argument):
+    return -argument.position if argument.counterargument else argument.position
+
+
+def get_user_argument_votes(**filters):
+    """Recompute user argument positions from all user votes.
+
+    Returns a dict of (user id, topic id, argument title) keys and
+    (total, count) values, see UserArgumentPosition.
+
+    """
     rows = (
         models.UserPostPosition.objects.
-        filter(post__topic=post.topic).
+        filter(post__postargument__isnull=False, **filters).
         exclude(position=0).
-        annotate(argument=F('post__postargument__title')).
-        values('argument').
-        annotate(position=Avg(Case(
-            When(post__postargument__counterargument=True, then=F('post__postargument__position') * -1),
-            default=F('post__postargument__position'),
-        ) * F('position'))).
-        filter(argument__in=post_arguments)
+        values('user', 'post__topic', 'post__postargument__title').
+        annotate(
+            total=Sum(Case(
+                When(post__postargument__counterargument=True, then=F('post__postargument__position') * -1),
+                default=F('post__postargument__position'),
+            ) * F('position')),
+            count=Count('post__postargument'),
+        ).
+        order_by()
     )
+    return {
+        (x['user'], x['post__topic'], x['post__postargument__title']): (x['total'], x['count'])
+        for x in rows
+    }
+
+
+def _update_post_votes(post, old, new):
+    old_upvotes, old_downvotes = _split_vote(old)
+    new_upvotes, new_downvotes = _split_vote(new)
+    models.Post.objects.filter(pk=post.pk).update(
+        upvotes=F('upvotes') + (new_upvotes - old_upvotes),
+        downvotes=F('downvotes') + (new_downvotes - old_downvotes),
+    )
+
+
+def _update_user_argument_positions(user, post, old, new):
+    deltas = collections.defaultdict(lambda: [0, 0])
+    for argument in post.postargument_set.all():
+        sign = _get_argument_sign(argument)
+        if old:
+            deltas[argument.title][0] -= sign * old
+            deltas[argument.title][1] -= 1
+        if new:
+            deltas[argument.title][0] += sign * new
+            deltas[argument.title][1] += 1
+
+    arguments = [
+        models.Argument.objects.get_or_create(topic=post.topic, title=title)[0]
+        for title, (total, count) in sorted(deltas.items())
+        if total != 0 or count != 0
+    ]
+    _lock_arguments(arguments)
+
+    # Old and new user positions of changed arguments, see _get_user_distance_deltas.
+    positions = {}
+
+    for argument in arguments:
+        total, count = deltas[argument.title]
+        user_argument, created = (
+            models.UserArgumentPosition.objects.
+            select_for_update().
+            get_or_create(user=user, argument=argument)
+        )
+        models.UserArgumentPosition.objects.filter(pk=user_argument.pk).update(
+            total=F('total') + total,
+            count=F('count') + count,
+            position=Coalesce(ExpressionWrapper(
+                (F('total') + total) / NullIf(F('count') + count, 0),
+                output_field=FloatField(),
+            ), 0),
+        )
+        position = _get_average(user_argument.total + total, user_argument.count + count)[2]
+        positions[argument.pk] = (user_argument.position, position)
+
+    return positions
+
+
+def _lock_arguments(arguments):
+    """Share lock arguments, whose user positions are being changed.
+
+    Actor position changes lock the argument exclusively, see
+    update_actor_topic_argument_position, so user and actor positions of an
+    argument are never changed concurrently and distance deltas are always
+    computed from committed positions.
+
+    """
+    if not arguments:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute((
+            'SELECT id FROM {argument} WHERE id IN %s ORDER BY id FOR SHARE'
+        ).format(
+            argument=models.Argument._meta.db_table,
+        ), [tuple(argument.pk for argument in arguments)])
+
+
+def _update_user_topic_position(user, topic, old, new):
+    # None means, that user has not voted or the vote was deleted.
+    count = (0 if new is None else 1) - (0 if old is None else 1)
+    user_topic, created = models.UserTopicPosition.objects.get_or_create(user=user, topic=topic)
+    models.UserTopicPosition.objects.filter(pk=user_topic.pk).update(
+        count=F('count') + count,
+        position=Coalesce(ExpressionWrapper(
+            (F('position') * F('count') + ((new or 0) - (old or 0))) / NullIf(F('count') + count, 0),
+            output_field=FloatField(),
+        ), 0),
+    )
+
+
+def _get_distance(user_position, actor_position):
+    # Returns (distance, weight) pair, neutral user positions are not compared.
+    if user_position and actor_position is not None:
+        return abs(user_position - actor_position) / 2, 1
+    else:
+        return 0, 0
+
+
+def _add_distance_delta(deltas, key, old, new):
+    deltas[key][0] += new[0] - old[0]
+    deltas[key][1] += new[1] - old[1]
+
+
+def _get_user_distance_deltas(user, post, old, new, arguments):
+    deltas = collections.defaultdict(lambda: [0, 0])
+
+    # User vote for a quote is compared with quote author position, which is 1.
+    if post.actor_id:
+        _add_distance_delta(deltas, (user.pk, post.actor_id), _get_distance(old, 1), _get_distance(new, 1))
+
+    actor_positions = (
+        models.ActorArgumentPosition.objects.
+        filter(argument__in=arguments).
+        values_list('argument', 'actor', 'position')
+    )
+    for argument, actor, position in actor_positions:
+        old_position, new_position = arguments[argument]
+        _add_distance_delta(
+            deltas, (user.pk, actor),
+            _get_distance(old_position, position),
+            _get_distance(new_position, position),
+        )
+
+    return deltas
+
+
+def _get_actor_distance_deltas(actor, argument, old, new):
+    deltas = collections.defaultdict(lambda: [0, 0])
+    user_positions = (
+        models.UserArgumentPosition.objects.
+        filter(argument=argument).
+        exclude(position=0).
+        values_list('user', 'position')
+    )
+    for user, position in user_positions:
+        _add_distance_delta(deltas, (user, actor.pk), _get_distance(position, old), _get_distance(position, new))
+    return deltas
+
+
+def _update_user_actor_distances(deltas):
+    """Add (distance, weight) deltas to UserActorDistance rows.
+
+    Deltas is a dict of (user id, actor id) keys, where either user or actor
+    is the same for all keys.
+
+    """
+    deltas = {k: v for k, v in deltas.items() if v[0] or v[1]}
+    if not deltas:
+        return
+
+    rows = (
+        models.UserActorDistance.objects.
+        select_for_update().
+        filter(
+            user_id__in={user for user, actor in deltas},
+            actor_id__in={actor for user, actor in deltas},
+        )
+    )
+    changed = []
     for row in rows:
-        argument, created = models.Argument.objects.get_or_create(topic=post.topic, title=row['argument'])
-        models.UserArgumentPosition.objects.update_or_create(user=user, argument=argument, defaults={
-            'position': row['position'],
-        })
+        key = (row.user_id, row.actor_id)
+        if key in deltas:
+            total, weight = deltas.pop(key)
+            row.total, row.weight, row.distance = _get_average(row.total + total, row.weight + weight)
+            changed.append(row)
+    models.UserActorDistance.objects.bulk_update(changed, ['total', 'weight', 'distance'], batch_size=500)
+
+    models.UserActorDistance.objects.bulk_create([
+        models.UserActorDistance(
+            user_id=user,
+            actor_id=actor,
+            total=total,
+            weight=weight,
+            distance=_get_average(total, weight)[2],
+        )
+        for (user, actor), (total, weight) in deltas.items()
+    ], batch_size=500)
+
 
+def _delete_user_positions(post):
+    """Delete all user votes of a post and update vote counters."""
+    user_positions = post.userpostposition_set.select_related('user').select_for_update()
+    for user_position in user_positions:
+        old = user_position.position
+        _update_post_votes(post, old, 0)
+        arguments = _update_user_argument_positions(user_position.user, post, old, 0)
+        _update_user_topic_position(user_position.user, post.topic, old, None)
+        _update_user_actor_distances(_get_user_distance_deltas(user_position.user, post, old, 0, arguments))
+    user_positions.delete()
 
+
+@transaction.atomic
 def update_actor_topic_argument_position(actor, topic, argument_title):
     argument, created = models.Argument.objects.get_or_create(topic=topic, title=argument_title)
+    # Wait for concurrent user votes on this argument, see _lock_arguments.
+    argument = models.Argument.objects.select_for_update().get(pk=argument.pk)
     agg = (
         models.PostArgument.objects.
         filter(topic=topic, post__actor=actor, title=argument.title).
@@ -394,19 +859,165 @@ def update_actor_topic_argument_position(actor, topic, argument_title):
             default=F('position'),
         )))
     )
+    actor_argument = (
+        models.ActorArgumentPosition.objects.
+        select_for_update().
+        filter(actor=actor, argument=argument).
+        first()
+    )
+    old = actor_argument.position if actor_argument else None
+    new = agg['position'] or 0
     models.ActorArgumentPosition.objects.update_or_create(actor=actor, argument=argument, defaults={
-        'position': agg['position'] or 0,
+        'position': new,
     })
+    if old != new:
+        _update_user_actor_distances(_get_actor_distance_deltas(actor, argument, old, new))
 
 
+@transaction.atomic
 def update_user_position(user, post, vote: int):
-    models.UserPostPosition.objects.update_or_create(user=user, post=post, defaults={'position': vote})
-    post.upvotes, post.downvotes = get_post_votes(post)
-    post.save()
-    update_user_post_argument_positions(user, post)
+    """Save user vote and update all vote counters incrementally.
+
+    Post vote counters, user argument positions, user topic position and
+    user distances to actors are updated with a difference between old and
+    new vote, instead of aggregating all votes again.
+
+    """
+    user_position, created = (
+        models.UserPostPosition.objects.
+        select_for_update().
+        get_or_create(user=user, post=post, defaults={'position': vote})
+    )
+    old = None if created else user_position.position
+    if old != vote:
+        if not created:
+            user_position.position = vote
+            user_position.save(update_fields=['position'])
+        _update_post_votes(post, old or 0, vote)
+        arguments = _update_user_argument_positions(user, post, old or 0, vote)
+        _update_user_topic_position(user, post.topic, old, vote)
+        _update_user_actor_distances(_get_user_distance_deltas(user, post, old or 0, vote, arguments))
+        bump_topic_version(post.topic)
+    post.refresh_from_db(fields=['upvotes', 'downvotes'])
     return post.upvotes, post.downvotes
 
 
+def check_vote_counters(fix=False):
+    """Compare incrementally updated vote counters with a full recompute.
+
+    Returns a list of (name, key, stored, expected) tuples, one for each
+    inconsistent counter. If fix is True, inconsistent counters are replaced
+    with recomputed values.
+
+    """
+    errors = []
+
+    # Post upvotes and downvotes
+    expected = {
+        x['post']: (x['upvotes'], -x['downvotes'])
+        for x in (
+            models.UserPostPosition.objects.
+            values('post').
+            annotate(
+                upvotes=Sum(Case(When(position__gt=0, then=F('position')), default=0)),
+                downvotes=Sum(Case(When(position__lt=0, then=F('position')), default=0)),
+            ).
+            order_by()
+        )
+    }
+    for pk, upvotes, downvotes in models.Post.objects.values_list('pk', 'upvotes', 'downvotes').iterator():
+        votes = expected.get(pk, (0, 0))
+        if (upvotes, downvotes) != votes:
+            errors.append(('post', pk, (upvotes, downvotes), votes))
+            if fix:
+                models.Post.objects.filter(pk=pk).update(upvotes=votes[0], downvotes=votes[1])
+
+    # User argument positions
+    expected = get_user_argument_votes()
+    rows = (
+        models.UserArgumentPosition.objects.
+        values_list('pk', 'user', 'argument__topic', 'argument__title', 'total', 'count', 'position').
+        iterator()
+    )
+    for pk, user, topic, title, total, count, position in rows:
+        key = (user, topic, title)
+        votes = expected.pop(key, (0, 0))
+        stored = (total, count, position)
+        if not _votes_match(stored, _get_average(*votes)):
+            errors.append(('argument', key, stored, _get_average(*votes)))
+            if fix:
+                total, count, position = _get_average(*votes)
+                models.UserArgumentPosition.objects.filter(pk=pk).update(total=total, count=count, position=position)
+    for (user, topic, title), votes in expected.items():
+        errors.append(('argument', (user, topic, title), None, _get_average(*votes)))
+        if fix:
+            total, count, position = _get_average(*votes)
+            argument, created = models.Argument.objects.get_or_create(topic_id=topic, title=title)
+            models.UserArgumentPosition.objects.update_or_create(user_id=user, argument=argument, defaults={
+                'total': total,
+                'count': count,
+                'position': position,
+            })
+
+    # User topic positions
+    expected = {
+        (x['user'], x['post__topic']): (x['total'], x['count'])
+        for x in (
+            models.UserPostPosition.objects.
+            values('user', 'post__topic').
+            annotate(total=Sum('position'), count=Count('pk')).
+            order_by()
+        )
+    }
+    rows = models.UserTopicPosition.objects.values_list('pk', 'user', 'topic', 'count', 'position').iterator()
+    for pk, user, topic, count, position in rows:
+        key = (user, topic)
+        votes = _get_average(*expected.pop(key, (0, 0)))[1:]
+        if not _votes_match((count, position), votes):
+            errors.append(('topic', key, (count, position), votes))
+            if fix:
+                models.UserTopicPosition.objects.filter(pk=pk).update(count=votes[0], position=votes[1])
+    for (user, topic), votes in expected.items():
+        votes = _get_average(*votes)[1:]
+        errors.append(('topic', (user, topic), None, votes))
+        if fix:
+            models.UserTopicPosition.objects.update_or_create(user_id=user, topic_id=topic, defaults={
+                'count': votes[0],
+                'position': votes[1],
+            })
+
+    # User distances to actors
+    expected = get_user_actor_distances()
+    rows = models.UserActorDistance.objects.values_list('pk', 'user', 'actor', 'total', 'weight', 'distance').iterator()
+    for pk, user, actor, total, weight, distance in rows:
+        key = (user, actor)
+        votes = _get_average(*expected.pop(key, (0, 0)))
+        stored = (total, weight, distance)
+        if not _votes_match(stored, votes):
+            errors.append(('distance', key, stored, votes))
+            if fix:
+                models.UserActorDistance.objects.filter(pk=pk).update(total=votes[0], weight=votes[1], distance=votes[2])
+    for (user, actor), votes in expected.items():
+        votes = _get_average(*votes)
+        errors.append(('distance', (user, actor), None, votes))
+        if fix:
+            models.UserActorDistance.objects.update_or_create(user_id=user, actor_id=actor, defaults={
+                'total': votes[0],
+                'weight': votes[1],
+                'distance': votes[2],
+            })
+
+    return errors
+
+
+def _get_average(total, count):
+    return total, count, (total / count if count else 0)
+
+
+def _votes_match(stored, expected):
+    return all(math.isclose(a, b, abs_tol=1e-9) for a, b in zip(stored, expected))
+
+
 def get_curator_votes(post):
     agg = models.PostLog.objects.filter(post=post).aggregate(
         upvotes=Sum(Case(When(vote__gt=0, then=F('vote')), default=0)),
@@ -431,14 +1042,12 @@ def update_curator_position(user, post, vote: int):
 
     # Update quote and source positions, since it depends on post approval state
     if content_type == ('manopozicija', 'quote'):
-        quote = post.content_object
-        source = quote.source
-
-        post.position = get_quote_position(post.topic, quote)
-        post.save()
+        positions = PositionUpdates(post.topic)
+        positions.quote(post)
+        positions.source(post.content_object.source)
+        positions.save()
 
-        source.position = get_source_position(post.topic, source)
-        source.save()
+    bump_topic_version(post.topic)
 
     return post.curator_upvotes, post.curator_downvotes
 
@@ -471,22 +1080,36 @@ def get_topic_curators(topic):
     )
 
 
-def compare_positions(group, user):
+def get_user_actor_distances(group=None, **filters):
+    """Recompute distances between user and actor positions from all votes.
+
+    Returns a dict of (user id, actor id) keys and (total, weight) values,
+    see UserActorDistance.
+
+    """
+    if group is None:
+        post_filters = {'post__actor__isnull': False}
+        argument_filters = {'argument__actorargumentposition__isnull': False}
+    else:
+        post_filters = {'post__actor__ingroup': group}
+        argument_filters = {'argument__actorargumentposition__actor__ingroup': group}
+
     post_positions = (
         models.UserPostPosition.objects.
-        filter(user=user, post__actor__ingroup=group).
+        filter(**post_filters, **filters).
         exclude(position=0).
         annotate(actor=F('post__actor')).
         values('user', 'actor').
         annotate(
             distance=ExpressionWrapper(Sum(Sqrt(Power(F('position') - 1, 2)) / 2), output_field=FloatField()),
             weight=Count('pk'),
-        )
+        ).
+        order_by()
     )
 
     argument_positions = (
         models.UserArgumentPosition.objects.
-        filter(user=user, argument__actorargumentposition__actor__ingroup=group).
+        filter(**argument_filters, **filters).
         exclude(position=0).
         annotate(actor=F('argument__actorargumentposition__actor')).
         values('user', 'actor').
@@ -495,29 +1118,104 @@ def compare_positions(group, user):
                 Sum(Sqrt(Power(F('position') - F('argument__actorargumentposition__position'), 2)) / 2)
             ), output_field=FloatField()),
             weight=Count('argument__actorargumentposition'),
-        )
+        ).
+        order_by()
     )
 
-    result = []
-
-    def key(x):
-        return x['user'], x['actor']
-
-    positions = sorted(itertools.chain(post_positions, argument_positions), key=key)
-    groups = itertools.groupby(positions, key=key)
-    for (user, actor), group in groups:
-        group = list(group)
-        value = sum(x['distance'] or 0 for x in group)
-        weight = sum(x['weight'] or 1 for x in group)
-        distance = value / weight
-        result.append((actor, distance))
+    result = collections.defaultdict(lambda: [0, 0])
+    for x in itertools.chain(post_positions, argument_positions):
+        result[x['user'], x['actor']][0] += x['distance'] or 0
+        result[x['user'], x['actor']][1] += x['weight'] or 1
 
     # TODO: calculate post role positions (reuse ActorPostPosition model)
     # TODO: calculate positions for groups of actors
 
+    return {k: tuple(v) for k, v in result.items()}
+
+
+def compute_positions(group, user):
+    """Same as compare_positions, but computed from all user votes."""
+    result = [
+        (actor, total / weight)
+        for (user_id, actor), (total, weight) in get_user_actor_distances(group, user=user).items()
+    ]
     return sorted(result, key=lambda x: (x[1], x[0]))
 
 
+def _get_group_parties_key(group_id):
+    return 'manopozicija:group:%d:parties' % group_id
+
+
+def rebuild_group_parties(groups=None):
+    """Precompute and cache current parties of all group members.
+
+    Returns a dict of group ids and {actor id: party id} dicts.
+
+    """
+    now = timezone.now()
+    groups = models.Group.objects.all() if groups is None else groups
+    result = {group.pk: {} for group in groups}
+    latest = {}
+    members = (
+        models.Member.objects.
+        filter(actor__ingroup__in=list(result), group__title='plitinė partija').
+        values_list('actor__ingroup', 'actor', 'group', 'since', 'until')
+    )
+    for group, actor, party, since, until in members:
+        # Current membership or the one, that ended most recently.
+        key = (until or now, since)
+        if (group, actor) not in latest or key >= latest[group, actor]:
+            latest[group, actor] = key
+            result[group][actor] = party
+    cache.set_many({_get_group_parties_key(k): v for k, v in result.items()}, timeout=None)
+    return result
+
+
+def get_group_parties(group):
+    """Return a dict of group member actor ids and their current party ids."""
+    parties = cache.get(_get_group_parties_key(group.pk))
+    if parties is None:
+        parties = rebuild_group_parties([group])[group.pk]
+    return parties
+
+
+def invalidate_group_parties(group_ids):
+    cache.delete_many([_get_group_parties_key(x) for x in group_ids])
+
+
+def _get_actor_distances(group, user):
+    return (
+        models.UserActorDistance.objects.
+        filter(user=user, actor__ingroup=group, weight__gt=0).
+        values_list('actor', 'distance')
+    )
+
+
+def get_closest_actors(group, user, threshold, limit, offset=0):
+    """Return a page of (actor id, distance) pairs closer than threshold, closest first."""
+    return list(
+        _get_actor_distances(group, user).
+        filter(distance__lt=threshold).
+        order_by('distance', 'actor')
+        [offset:offset + limit]
+    )
+
+
+def get_farthest_actors(group, user, threshold, limit, offset=0):
+    """Return a page of (actor id, distance) pairs not closer than threshold, farthest first."""
+    return list(
+        _get_actor_distances(group, user).
+        filter(distance__gte=threshold).
+        order_by('-distance', '-actor')
+        [offset:offset + limit]
+    )
+
+
+def compare_positions(group, user):
+    """Return (actor id, distance) pairs of group members, closest first."""
+    return list(_get_actor_distances(group, user).order_by('distance', 'actor'))
+
+
 def get_user_quote_positions(group, user):
     return (
         models.UserPostPosition.objects.
@@ -563,12 +1261,43 @@ def get_user_event_positions(group, user):
 
 
 def get_user_topic_position(user, topic):
-    agg = (
+    return get_users_topic_positions([user], topic).get(user.pk, 0)
+
+
+def get_users_topic_positions(users, topic):
+    """Get topic positions of many users with a single query.
+
+    Returns a dict of user ids and positions. Users, who have not voted in
+    the topic, are not included.
+
+    """
+    return dict(
+        models.UserTopicPosition.objects.
+        filter(user__in=users, topic=topic).
+        values_list('user_id', 'position')
+    )
+
+
+@transaction.atomic
+def rebuild_user_topic_positions():
+    """Rebuild all UserTopicPosition rows from UserPostPosition."""
+    rows = (
         models.UserPostPosition.objects.
-        filter(user=user, post__topic=topic).
-        aggregate(position=Avg('position'))
+        values('user', 'post__topic').
+        annotate(position=Avg('position'), count=Count('pk')).
+        order_by()
     )
-    return agg['position'] or 0
+    models.UserTopicPosition.objects.all().delete()
+    models.UserTopicPosition.objects.bulk_create((
+        models.UserTopicPosition(
+            user_id=row['user'],
+            topic_id=row['post__topic'],
+            position=row['position'] or 0,
+            count=row['count'],
+        )
+        for row in rows.iterator()
+    ), batch_size=1000)
+    return models.UserTopicPosition.objects.count()
 
 
 def get_bot_user(username):
@@ -576,3 +1305,58 @@ def get_bot_user(username):
     if created:
         user.set_unusable_password()
     return user
+
+
+def clean_name(name):
+    name = ' '.join(name.strip().split())
+    return unidecode.unidecode(name).lower()
+
+
+def get_files_checksum(paths):
+    checksum = hashlib.sha256()
+    for path in paths:
+        checksum.update(path.name.encode('utf-8'))
+        with path.open('rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                checksum.update(chunk)
+    return checksum.hexdigest()
+
+
+def get_import_checkpoint(command, paths, batch_size, resume=False, force=False):
+    """Start a new import or resume an interrupted one.
+
+    Returns ImportCheckpoint, where `batches` is the number of already
+    committed batches to skip, or None if the same files have already been
+    imported completely and import is not forced.
+
+    An interrupted import is resumed only with `resume`, otherwise it starts
+    from the beginning. Resumed import must use `batch_size` of the
+    checkpoint, in order to skip the same rows.
+
+    """
+    checksum = get_files_checksum(paths)
+    checkpoint = models.ImportCheckpoint.objects.filter(command=command).first()
+    if checkpoint and checkpoint.checksum == checksum and not force:
+        if checkpoint.completed:
+            return None
+        if resume:
+            return checkpoint
+    checkpoint, created = models.ImportCheckpoint.objects.update_or_create(command=command, defaults={
+        'checksum': checksum,
+        'batch_size': batch_size,
+        'batches': 0,
+        'started': timezone.now(),
+        'completed': None,
+    })
+    return checkpoint
+
+
+def commit_import_batch(checkpoint):
+    """Mark next batch as committed, must be called in batch transaction."""
+    checkpoint.batches += 1
+    checkpoint.save(update_fields=['batches'])
+
+
+def complete_import(checkpoint):
+    checkpoint.completed = timezone.now()
+    checkpoint.save(update_fields=['completed'])
@@ -177,6 +177,32 @@ INSTALLED_APPS += (
 
 MANOPOZICIJA_TOPIC_LOGO_SIZE = Size(256, 200)
 
+# How long rendered topic timeline is kept in cache, in seconds. Cached
+# timeline is invalidated anyway, when topic posts or votes change.
+MANOPOZICIJA_TOPIC_CACHE_TIMEOUT = 60 * 60 * 24
+
+# How long actor autocomplete results are kept in cache, in seconds. New
+# actors appear in autocomplete only after cached results expire.
+MANOPOZICIJA_AUTOCOMPLETE_CACHE_TIMEOUT = 60
+
+# How long thumbnail urls of images are kept in cache, in seconds. Thumbnails
+# of a replaced image, saved with the same name, appear only after cached
+# urls expire.
+MANOPOZICIJA_THUMBNAIL_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Search actors in autocomplete using in-memory index of names, kept in each
+# process, instead of database queries.
+MANOPOZICIJA_ACTOR_INDEX = False
+
+# Queue quote, source and actor argument position updates, instead of
+# recomputing them in the request. Queued positions are recomputed by
+# `processpositions` command, which must be run continuously.
+MANOPOZICIJA_DEFER_POSITIONS = False
+
+# Directory, where datasets of indicators are downloaded. Downloaded files
+# are shared by all indicators of a dataset.
+MANOPOZICIJA_DOWNLOADS_DIR = str(PROJECT_DIR / 'var/downloads')
+
 
 # django-allauth
 # http://django-allauth.readthedocs.org/
@@ -0,0 +1,59 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from manopozicija import models
+from manopozicija import services
+from manopozicija import actorindex
+
+
+@receiver([post_save, post_delete], sender=models.Actor)
+def bump_actors_version(sender, instance, **kwargs):
+    actorindex.bump_version()
+
+
+@receiver([post_save, post_delete], sender=models.Member)
+def invalidate_member_group_parties(sender, instance, **kwargs):
+    services.invalidate_group_parties(
+        models.Group.objects.filter(members=instance.actor_id).values_list('pk', flat=True)
+    )
+
+
+@receiver(m2m_changed, sender=models.Group.members.through)
+def invalidate_group_members_parties(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        services.invalidate_group_parties([instance.pk])
+    elif pk_set:
+        services.invalidate_group_parties(pk_set)
+    else:
+        # Actor was removed from all groups.
+        services.invalidate_group_parties(models.Group.objects.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=models.Topic)
+def bump_saved_topic_version(sender, instance, **kwargs):
+    services.bump_topic_version(instance)
+
+
+@receiver([post_save, pre_delete], sender=models.Actor)
+def bump_actor_topics_version(sender, instance, **kwargs):
+    # Actor names, titles and photos are shown in cached topic timelines.
+    # Related posts are deleted before post_delete, so topics are found in pre_delete.
+    for topic in models.Topic.objects.filter(post__actor=instance.pk).distinct():
+        services.bump_topic_version(topic)
+
+
+@receiver([post_save, pre_delete], sender=models.Curator)
+def bump_curator_topics_version(sender, instance, **kwargs):
+    curator_type = ContentType.objects.get_for_model(models.Curator)
+    posts = models.Post.objects.filter(content_type=curator_type, object_id=instance.pk)
+    for topic in models.Topic.objects.filter(post__in=posts).distinct():
+        services.bump_topic_version(topic)
+
+
+@receiver([post_save, post_delete], sender=models.TopicCurator)
+def bump_topic_curators_version(sender, instance, **kwargs):
+    # Topic itself might be already deleted, only its pk is needed.
+    services.bump_topic_version(models.Topic(pk=instance.topic_id))
@@ -106,7 +106,10 @@
     var selector = '#kpi-chart';
     var fontColor = '#666666';
 
-    d3.json($(selector).data('kpi-url'), function (json) {
+    // One point per pixel is enough, longer series are downsampled by the server.
+    var resolution = Math.max(3, Math.round($(selector).outerWidth()));
+
+    d3.json($(selector).data('kpi-url') + '?resolution=' + resolution, function (json) {
 
         var timeline = {min: new Date(1990, 0, 1), max: d3.timeDay.floor(new Date)};
 
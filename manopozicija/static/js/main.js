@@ -75,4 +75,19 @@ var manopozicija = window.manopozicija || {};
         $.post(manopozicija.urls['js:curator-post-vote'](post_id), {'vote': vote});
     };
 
+    // Position comparison
+
+    manopozicija.load_positions = function (elem, group_id) {
+        var $button = $(elem), offset = $button.data('offset');
+        $button.prop('disabled', true);
+        $.getJSON(manopozicija.urls['js:compare-positions-page'](group_id), {'offset': offset}, function (data) {
+            $('.js-compare-positions').append(data.html);
+            $button.data('offset', data.offset);
+            $button.prop('disabled', false);
+            if (!data.more) {
+                $button.hide();
+            }
+        });
+    };
+
 }(manopozicija, jQuery));  //eslint-disable-line no-undef
@@ -0,0 +1,35 @@
+from manopozicija import actorindex
+from manopozicija import factories
+from manopozicija import models
+
+
+def _search(q):
+    return [x.label for x in actorindex.search(q)]
+
+
+def test_actor_index(db, settings, tmpdir):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': tmpdir.strpath}}
+    factories.PersonActorFactory(photo='')
+    factories.PersonActorFactory(first_name='Juozas', last_name='Bernatonis')
+    factories.PersonActorFactory(first_name='Eugenijus', last_name='Gentvilas', photo='')
+    factories.PartyActorFactory(first_name='Liberalų sąjūdis')
+
+    assert _search('') == ['Liberalų sąjūdis ', 'Juozas Bernatonis', 'Mantas Adomėnas', 'Eugenijus Gentvilas']
+    assert _search('  ADOMĖN') == ['Mantas Adomėnas']
+    assert _search('liberalu sa') == ['Liberalų sąjūdis ']
+    assert _search('e') == ['Eugenijus Gentvilas']
+    assert _search('z') == []
+
+    # Index is rebuilt, when actors change.
+    index = actorindex.get_index()
+    assert actorindex.get_index() is index
+    actor = factories.PersonActorFactory(first_name='Eglė', last_name='Šimonytė', photo='')
+    assert _search('e') == ['Eugenijus Gentvilas', 'Eglė Šimonytė']
+    actor.delete()
+    assert _search('e') == ['Eugenijus Gentvilas']
+
+    # Bulk updates do not send signals, version has to be bumped explicitly.
+    models.Actor.objects.filter(last_name='Gentvilas').update(last_name='Gentvilaitis')
+    assert _search('gentvilai') == []
+    actorindex.bump_version()
+    assert _search('gentvilai') == ['Eugenijus Gentvilaitis']
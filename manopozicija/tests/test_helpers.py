@@ -1,3 +1,10 @@
+import mock
+import pytest
+
+from django.db import transaction
+from django.contrib.auth.models import AnonymousUser
+
+from manopozicija import models
 from manopozicija import factories
 from manopozicija import services
 from manopozicija import helpers
@@ -24,3 +31,131 @@ def test_get_arguments(app):
             {'count': 1, 'position': -1, 'title': 'balsavimas nekontroliuojamoje aplinkoje'},
         )
     ]
+
+
+def _get_votes(posts):
+    result = []
+    for post in posts:
+        if post['type'] == 'quotes':
+            result.extend(('quote', x['post']['votes'], x['post']['user']) for x in post['quotes'])
+        else:
+            result.append((post['type'], post['post']['votes'], post['post']['user']))
+    return result
+
+
+@pytest.mark.parametrize('backend', [
+    'django.core.cache.backends.filebased.FileBasedCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+])
+def test_get_topic_posts_cache(app, settings, tmpdir, django_assert_num_queries, backend):
+    settings.CACHES = {'default': {'BACKEND': backend, 'LOCATION': tmpdir.strpath}}
+
+    user = factories.UserFactory()
+    topic = factories.TopicFactory()
+    factories.TopicCuratorFactory(user=user, topic=topic)
+    event_post, quote_post = factories.create_topic_posts(topic, user, [
+        ('event', 1, 0, 'Balsavimo internetu koncepcijos patvirtinimas', 'lrs.lt', '2006-11-26'),
+        ('quote', 'Mantas Adomėnas', 'seimo narys', 'kauno.diena.lt', '2016-03-22', [
+            (0, 1, 'Atidaroma galimybė prekiauti balsais ir likti nebaudžiamam.', [
+                (-1, 'balsų pirkimas', None),
+            ]),
+        ]),
+    ])
+    anonymous = AnonymousUser()
+
+    posts = helpers.get_topic_posts(anonymous, topic)
+    assert posts == helpers.get_posts(anonymous, topic, services.get_topic_posts(topic))
+    assert _get_votes(posts) == [
+        ('quote', -1, {'upvote': '', 'downvote': ''}),
+        ('event', 1, {'upvote': '', 'downvote': ''}),
+    ]
+
+    # Anonymous timeline is served from cache.
+    with django_assert_num_queries(0):
+        helpers.get_topic_posts(anonymous, topic)
+
+    # Only user and curator votes are queried for a registered user.
+    with django_assert_num_queries(2):
+        posts = helpers.get_topic_posts(user, topic)
+    assert _get_votes(posts) == [
+        ('quote', -1, {'upvote': '', 'downvote': 'active'}),
+        ('event', 1, {'upvote': 'active', 'downvote': ''}),
+    ]
+
+    # Votes invalidate cached timeline.
+    services.update_user_position(user, event_post, -1)
+    posts = helpers.get_topic_posts(user, topic)
+    assert _get_votes(posts) == [
+        ('quote', -1, {'upvote': '', 'downvote': 'active'}),
+        ('event', -1, {'upvote': '', 'downvote': 'active'}),
+    ]
+
+    # Anonymous users do not see votes of other users.
+    assert _get_votes(helpers.get_topic_posts(anonymous, topic)) == [
+        ('quote', -1, {'upvote': '', 'downvote': ''}),
+        ('event', -1, {'upvote': '', 'downvote': ''}),
+    ]
+
+
+def test_topic_cache_invalidation(app, settings, tmpdir):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+    user = factories.UserFactory()
+    topic = factories.TopicFactory()
+    factories.TopicCuratorFactory(user=user, topic=topic)
+    factories.create_topic_posts(topic, user, [
+        ('quote', 'Mantas Adomėnas', 'seimo narys', 'kauno.diena.lt', '2016-03-22', [
+            (0, 1, 'Atidaroma galimybė prekiauti balsais ir likti nebaudžiamam.', [
+                (-1, 'balsų pirkimas', None),
+            ]),
+        ]),
+    ])
+    anonymous = AnonymousUser()
+    assert helpers.get_topic_posts(anonymous, topic)[0]['source']['actor']['name'] == 'Mantas Adomėnas'
+
+    # Actor changes invalidate timelines of topics, where actor is quoted.
+    actor = models.Actor.objects.get(first_name='Mantas')
+    actor.first_name = 'Mantas Vardenis'
+    actor.save()
+    assert helpers.get_topic_posts(anonymous, topic)[0]['source']['actor']['name'] == 'Mantas Vardenis Adomėnas'
+
+    # Topic and topic curator changes invalidate cached topic data.
+    version = services.get_topic_version(topic)
+    topic.save()
+    assert services.get_topic_version(topic) > version
+    version = services.get_topic_version(topic)
+    models.TopicCurator.objects.filter(topic=topic).delete()
+    assert services.get_topic_version(topic) > version
+
+    # Inside a transaction, version is bumped once more after commit.
+    version = services.get_topic_version(topic)
+    with mock.patch.object(transaction, 'on_commit') as on_commit:
+        services.bump_topic_version(topic)
+    assert services.get_topic_version(topic) == version + 1
+    on_commit.call_args[0][0]()
+    assert services.get_topic_version(topic) == version + 2
+
+
+def test_get_positions(app):
+    user = factories.UserFactory()
+    distances = [0.1, 0.3, 0.2, 0.5, 0.9, 0.7, 0.4]
+    actors = [factories.PersonActorFactory(first_name='Actor', last_name=str(i)) for i in range(len(distances))]
+    group = factories.GroupFactory(members=actors)
+    for actor, distance in zip(actors, distances):
+        models.UserActorDistance.objects.create(user=user, actor=actor, total=distance, weight=1, distance=distance)
+
+    def dump(positions):
+        return [
+            tuple(x and (str(x['actor']), x['distance']) for x in row)
+            for row in positions
+        ]
+
+    assert dump(helpers.get_positions(group, user, limit=2)) == [
+        (('Actor 0', 0.1), ('Actor 4', 0.9)),
+        (('Actor 2', 0.2), ('Actor 5', 0.7)),
+    ]
+    assert dump(helpers.get_positions(group, user, limit=2, offset=2)) == [
+        (('Actor 1', 0.3), ('Actor 3', 0.5)),
+        (None, ('Actor 6', 0.4)),
+    ]
+    assert dump(helpers.get_positions(group, user, limit=2, offset=4)) == []
@@ -0,0 +1,136 @@
+import io
+import json
+import base64
+import datetime
+
+import mock
+import pytest
+from PIL import Image
+
+from django.core.management import call_command
+
+from manopozicija import models
+
+
+def _photo(color):
+    f = io.BytesIO()
+    Image.new('RGB', (100, 120), color).save(f, 'PNG')
+    return {'ext': 'png', 'data': base64.b64encode(f.getvalue()).decode('ascii')}
+
+
+def test_importcandidates(db, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir.mkdir('media'))
+    seimas = models.Body.objects.create(name='Seimas')
+    models.Term.objects.create(
+        body=seimas, title='2012-2016 metų kadencija', since=datetime.datetime(2012, 11, 16),
+        source=models.Term.VRK_KADENCIJOS_CSV, source_id='652',
+    )
+    path = tmpdir.join('kandidatai.ndjson')
+    path.write_text('\n'.join(json.dumps({
+        'fname': fname,
+        'lname': lname,
+        'bdate': bdate,
+        'title': '',
+        'partial': True,
+        'elections': [{
+            'body': 'Seimas',
+            'since': '2012-11-16',
+            'until': '2016-11-14',
+            'party': party,
+            'photo': _photo(color),
+            'elected': True,
+        }],
+    }) for fname, lname, bdate, party, color in [
+        ('Mantas', 'Adomėnas', '1972-05-22', 'Tėvynės sąjunga', 'red'),
+        ('Juozas', 'Bernatonis', '1953-02-20', 'Lietuvos socialdemokratų partija', 'green'),
+        ('Eugenijus', 'Gentvilas', '1960-03-01', 'Liberalų sąjūdis', 'blue'),
+    ]) + '\n', encoding='utf-8')
+
+    call_command('importcandidates', str(path), batch_size=2, workers=2, verbosity=0)
+    actors = models.Actor.objects.filter(group=False).order_by('last_name')
+    assert [(x.last_name, x.photo.name.endswith('.png')) for x in actors] == [
+        ('Adomėnas', True),
+        ('Bernatonis', True),
+        ('Gentvilas', True),
+    ]
+    assert [Image.open(x.photo.path).getpixel((0, 0)) for x in actors] == [(255, 0, 0), (0, 128, 0), (0, 0, 255)]
+    assert sorted(models.Member.objects.values_list('actor__last_name', 'group__first_name')) == [
+        ('Adomėnas', 'Tėvynės sąjunga'),
+        ('Bernatonis', 'Lietuvos socialdemokratų partija'),
+        ('Gentvilas', 'Liberalų sąjūdis'),
+    ]
+
+    # Existing photos are not replaced.
+    photos = [x.photo.name for x in actors]
+    call_command('importcandidates', str(path), force=True, workers=2, verbosity=0)
+    assert [x.photo.name for x in actors.all()] == photos
+    assert models.Actor.objects.filter(group=False).count() == 3
+
+
+def test_importcandidates_current_member(db, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir.mkdir('media'))
+    seimas = models.Body.objects.create(name='Seimas')
+    for since, until in [(2012, 2016), (2016, datetime.datetime.now().year)]:
+        models.Term.objects.create(
+            body=seimas, title='%d-%d metų kadencija' % (since, until), since=datetime.datetime(since, 11, 14),
+            source=models.Term.VRK_KADENCIJOS_CSV, source_id=str(since),
+        )
+    path = tmpdir.join('kandidatai.ndjson')
+
+    def write(since, until):
+        path.write_text(json.dumps({
+            'fname': 'Mantas',
+            'lname': 'Adomėnas',
+            'bdate': '1972-05-22',
+            'title': '',
+            'partial': True,
+            'elections': [{
+                'body': 'Seimas',
+                'since': since,
+                'until': until,
+                'party': 'Tėvynės sąjunga',
+                'photo': _photo('red'),
+                'elected': True,
+            }],
+        }) + '\n', encoding='utf-8')
+
+    write('2016-11-14', None)
+    call_command('importcandidates', str(path), workers=1, verbosity=0)
+    write('2012-11-16', '2016-11-14')
+    call_command('importcandidates', str(path), workers=1, verbosity=0)
+    assert list(models.Member.objects.values_list('group__first_name', 'since', 'until')) == [
+        ('Tėvynės sąjunga', datetime.datetime(2012, 11, 16), None),
+    ]
+
+
+def test_importcandidates_rollback(db, settings, tmpdir):
+    media = tmpdir.mkdir('media')
+    settings.MEDIA_ROOT = str(media)
+    seimas = models.Body.objects.create(name='Seimas')
+    models.Term.objects.create(
+        body=seimas, title='2012-2016 metų kadencija', since=datetime.datetime(2012, 11, 16),
+        source=models.Term.VRK_KADENCIJOS_CSV, source_id='652',
+    )
+    path = tmpdir.join('kandidatai.ndjson')
+    path.write_text(json.dumps({
+        'fname': 'Mantas',
+        'lname': 'Adomėnas',
+        'bdate': '1972-05-22',
+        'title': '',
+        'partial': True,
+        'elections': [{
+            'body': 'Seimas',
+            'since': '2012-11-16',
+            'until': '2016-11-14',
+            'party': 'Tėvynės sąjunga',
+            'photo': _photo('red'),
+            'elected': True,
+        }],
+    }) + '\n', encoding='utf-8')
+
+    # Photos of a rolled back batch are deleted.
+    with mock.patch('manopozicija.services.commit_import_batch', side_effect=RuntimeError):
+        with pytest.raises(RuntimeError):
+            call_command('importcandidates', str(path), workers=0, verbosity=0)
+    assert [x for x in media.visit() if x.isfile()] == []
+    assert not models.Actor.objects.filter(group=False).exists()
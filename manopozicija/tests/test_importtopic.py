@@ -0,0 +1,132 @@
+import textwrap
+
+from django.core.management import call_command
+
+from manopozicija import models
+from manopozicija import services
+from manopozicija import factories
+from manopozicija.management.commands.importtopic import get_actors
+
+
+POSTS = textwrap.dedent('''\
+    - type: event
+      event:
+        title: Balsavimo internetu koncepcijos patvirtinimas
+        source_link: https://e-seimas.lrs.lt/portal/legalAct/lt/TAD/TAIS.287235
+        timestamp: 2006-11-26
+    - type: quote
+      source:
+        actor: Mantas Adomėnas
+        source_link: http://kauno.diena.lt/naujienos/lietuva/politika/skinasi-kelia-balsavimas-internetu-740017
+        timestamp: 2016-03-22
+      quote:
+        text: Nepasiduokime paviršutiniškiems šūkiams – šiuolaikiška, modernu.
+      arguments:
+        - title: šiuolaikiška, modernu
+          position: 1
+          counterargument: true
+    - type: quote
+      source:
+        actor: Mantas Adomėnas
+        source_link: http://kauno.diena.lt/naujienos/lietuva/politika/skinasi-kelia-balsavimas-internetu-740017
+        timestamp: 2016-03-22
+      quote:
+        text: Atidaroma galimybė prekiauti balsais ir likti nebaudžiamam.
+      arguments:
+        - title: balsų pirkimas
+          position: -1
+    - type: quote
+      source:
+        actor: Vardenis Pavardenis
+        source_link: http://example.com/
+        timestamp: 2016-03-22
+      quote:
+        text: Nežinomas autorius.
+''')
+
+
+def test_importtopic(app, tmpdir, capsys, django_assert_num_queries):
+    topic = factories.TopicFactory(slug='balsavimas-internetu')
+    actor = factories.PersonActorFactory()
+    factories.TopicCuratorFactory(user=services.get_bot_user('importbot'), topic=topic)
+    path = tmpdir.join('posts.yml')
+    path.write_text(POSTS, encoding='utf-8')
+
+    call_command('importtopic', topic.slug, str(path))
+    assert services.dump_topic_posts(topic) == '\n'.join([
+        '( ) (n) Mantas Adomėnas (seimo narys)                                          kauno.diena.lt 2016-03-22    ',
+        ' |      Nepasiduokime paviršutiniškiems šūkiams – šiuolaikiška, modernu.                                 (0)',
+        ' |      - (y) šiuolaikiška, modernu < (counterargument)                                                     ',
+        ' |      Atidaroma galimybė prekiauti balsais ir likti nebaudžiamam.                                      (0)',
+        ' |      - (n) balsų pirkimas                                                                                ',
+        ' |                                                                                                          ',
+        ' o  (-) Balsavimo internetu koncepcijos patvirtinimas                         e-seimas.lrs.lt 2006-11-26 (0)',
+    ])
+    assert "Actor 'Vardenis Pavardenis' not found." in capsys.readouterr().out
+
+    # Positions are recomputed once, same as services.create_quote does per quote.
+    source = models.Source.objects.get(actor=actor)
+    assert source.position == services.get_source_position(topic, source) == -1
+    assert [
+        post.position == services.get_quote_position(topic, post.content_object)
+        for post in models.Post.objects.filter(actor=actor)
+    ] == [True, True]
+    assert list(models.ActorArgumentPosition.objects.filter(actor=actor).order_by('argument__title').values_list('argument__title', 'position')) == [
+        ('balsų pirkimas', -1),
+        ('šiuolaikiška, modernu', -1),
+    ]
+
+    # Importing the same file again does not create duplicates, existing
+    # events, sources and quotes are read with one query each.
+    with django_assert_num_queries(10):
+        call_command('importtopic', topic.slug, str(path))
+    assert models.Post.objects.filter(topic=topic).count() == 3
+    assert capsys.readouterr().out.count('already exists.') == 3
+
+
+def test_importtopic_duplicates(app, tmpdir, capsys):
+    topic = factories.TopicFactory(slug='balsavimas-internetu')
+    factories.PersonActorFactory()
+    factories.TopicCuratorFactory(user=services.get_bot_user('importbot'), topic=topic)
+    path = tmpdir.join('posts.yml')
+    path.write_text(POSTS, encoding='utf-8')
+    call_command('importtopic', topic.slug, str(path))
+    capsys.readouterr()
+
+    # Similar quotes are duplicates, same as in QuoteForm.
+    path.write_text(POSTS.replace('likti nebaudžiamam.', 'likti nebaudžiamam!'), encoding='utf-8')
+    call_command('importtopic', topic.slug, str(path))
+    assert capsys.readouterr().out.count('already exists.') == 3
+    assert models.Post.objects.filter(topic=topic).count() == 3
+
+
+def test_importtopic_group_actor(app, tmpdir, capsys):
+    topic = factories.TopicFactory(slug='balsavimas-internetu')
+    party = factories.PartyActorFactory()
+    factories.TopicCuratorFactory(user=services.get_bot_user('importbot'), topic=topic)
+    path = tmpdir.join('posts.yml')
+    path.write_text(textwrap.dedent('''\
+        - type: quote
+          source:
+            actor: Lietuvos Žaliųjų Partija
+            source_link: http://example.com/
+            timestamp: 2016-03-22
+          quote:
+            text: Balsavimas internetu būtų patogus.
+    '''), encoding='utf-8')
+    call_command('importtopic', topic.slug, str(path))
+    assert 'not found' not in capsys.readouterr().out
+    assert list(models.Post.objects.filter(topic=topic).values_list('actor', flat=True)) == [party.pk]
+
+
+def test_get_actors(db):
+    actor = factories.PersonActorFactory(first_name='Mantas', last_name='Adomėnas')
+    # get_or_create factory can not create actors with the same name.
+    for i in range(3):
+        models.Actor.objects.create(first_name='Vardenis', last_name='Pavardenis', title='seimo narys')
+    party = factories.PartyActorFactory()
+    assert get_actors(['Mantas Adomėnas', 'Vardenis Pavardenis', 'Lietuvos Žaliųjų Partija', 'Nėra Tokio']) == {
+        'Mantas Adomėnas': actor,
+        'Vardenis Pavardenis': None,
+        'Lietuvos Žaliųjų Partija': party,
+    }
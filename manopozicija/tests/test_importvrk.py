@@ -0,0 +1,117 @@
+import pathlib
+
+import pytest
+
+from django.core.management import call_command
+
+from manopozicija import models
+from manopozicija.management.commands import importvrk
+
+FIXTURES = pathlib.Path(__file__).parent / 'fixtures/vrk'
+
+
+def dump():
+    return {
+        'terms': sorted(
+            (source_id, str(since.date()), str(until.date()) if until else None)
+            for source_id, since, until in models.Term.objects.values_list('source_id', 'since', 'until')
+        ),
+        'actors': sorted(
+            models.Actor.objects.
+            filter(group=False).
+            values_list('first_name', 'last_name', 'title', 'times_elected', 'times_candidate')
+        ),
+        'members': sorted(
+            (actor, party, str(since.date()), str(until.date()) if until else None)
+            for actor, party, since, until in (
+                models.Member.objects.
+                values_list('actor__last_name', 'group__first_name', 'since', 'until')
+            )
+        ),
+        'groups': sorted(models.Group.members.through.objects.values_list('group__title', 'actor__last_name')),
+    }
+
+
+EXPECTED = {
+    'terms': [
+        ('641', '2008-11-17', '2012-11-16'),
+        ('652', '2012-11-16', '2016-11-14'),
+        ('664', '2016-11-17', None),
+    ],
+    'actors': [
+        ('Eugenijus', 'Gentvilas', '', 0, 1),
+        ('Juozas', 'Bernatonis', 'seimo narys', 1, 2),
+        ('Mantas', 'Adomėnas', 'seimo narys', 3, 3),
+    ],
+    'members': [
+        ('Adomėnas', 'Tėvynės sąjunga-Lietuvos krikščionys demokratai', '2008-10-26', None),
+        ('Bernatonis', 'Lietuvos socialdemokratų partija', '2012-10-28', None),
+        ('Gentvilas', 'Liberalų sąjūdis', '2016-11-17', None),
+    ],
+    'groups': [
+        ('Kandidatai į 2008 metų Seimą', 'Adomėnas'),
+        ('Kandidatai į 2012 metų Seimą', 'Adomėnas'),
+        ('Kandidatai į 2012 metų Seimą', 'Bernatonis'),
+        ('Kandidatai į 2016 metų Seimą', 'Adomėnas'),
+        ('Kandidatai į 2016 metų Seimą', 'Bernatonis'),
+        ('Kandidatai į 2016 metų Seimą', 'Gentvilas'),
+    ],
+}
+
+
+@pytest.mark.parametrize('options', [
+    {},
+    {'bulk': True},
+    {'bulk': True, 'batch_size': 1},
+    # Candidates are sorted on disk, when they do not fit into a chunk.
+    {'chunk_size': 2},
+    {'bulk': True, 'batch_size': 2, 'chunk_size': 3},
+])
+def test_importvrk(db, options):
+    call_command('importvrk', str(FIXTURES), verbosity=0, **options)
+    assert dump() == EXPECTED
+
+    # Importing same data again does not create duplicates and fixes changed rows.
+    models.Actor.objects.filter(last_name='Adomėnas').update(times_candidate=1)
+    call_command('importvrk', str(FIXTURES), verbosity=0, force=True, **options)
+    assert dump() == EXPECTED
+
+
+@pytest.mark.parametrize('options', [
+    {'batch_size': 1},
+    {'bulk': True, 'batch_size': 1},
+])
+def test_importvrk_resume(db, monkeypatch, options):
+    def interrupt(func):
+        calls = []
+
+        def wrapper(*args):
+            calls.append(args)
+            if len(calls) > 1:
+                raise RuntimeError('interrupted')
+            return func(*args)
+        return wrapper
+
+    # Import is interrupted, while importing the second candidate.
+    with monkeypatch.context() as m:
+        m.setattr(importvrk, 'import_candidate', interrupt(importvrk.import_candidate))
+        m.setattr(importvrk.BulkImport, 'save', interrupt(importvrk.BulkImport.save))
+        with pytest.raises(RuntimeError):
+            call_command('importvrk', str(FIXTURES), verbosity=0, **options)
+    checkpoint = models.ImportCheckpoint.objects.get(command='importvrk')
+    assert (checkpoint.batches, checkpoint.completed) == (1, None)
+    assert len(dump()['actors']) == 1
+
+    # Resumed import skips the first batch.
+    call_command('importvrk', str(FIXTURES), verbosity=0, resume=True, **options)
+    checkpoint.refresh_from_db()
+    assert checkpoint.batches == 3
+    assert checkpoint.completed is not None
+    assert dump() == EXPECTED
+
+    # Unchanged files are not imported again, unless forced.
+    models.Actor.objects.filter(last_name='Adomėnas').update(times_candidate=1)
+    call_command('importvrk', str(FIXTURES), verbosity=0, **options)
+    assert dump() != EXPECTED
+    call_command('importvrk', str(FIXTURES), verbosity=0, force=True, **options)
+    assert dump() == EXPECTED
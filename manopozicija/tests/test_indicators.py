@@ -1,6 +1,11 @@
 import io
+import os
 import mock
+import functools
 import datetime
+import threading
+import urllib.error
+import urllib.request
 import pytest
 import pkg_resources as pres
 import pandas as pd
@@ -10,6 +15,7 @@ from django.urls import reverse
 
 from manopozicija import factories
 from manopozicija import indicators
+from manopozicija import services
 from manopozicija.models import Indicator
 
 timedelta = datetime.timedelta
@@ -99,12 +105,18 @@ def test_update_indicators(settings, tmpdir):
     assert indicator.last_update >= now
     assert ls(tmpdir, tmpdir / 'indicators') == [
         'indicators/a.csv',
+        'indicators/a.npy',
         'indicators/c.csv',
+        'indicators/c.npy',
     ]
     assert tuples(pd.read_csv(str(tmpdir / 'indicators/a.csv'), index_col=0)) == [
         (1, 0.1),
         (2, 0.2),
     ]
+    assert indicators.get_indicator_data(indicator) == [
+        [1, 0.1],
+        [2, 0.2],
+    ]
 
 
 @pytest.mark.django_db
@@ -126,9 +138,186 @@ def test_update_indicators_error(settings, tmpdir):
     assert ls(tmpdir, tmpdir / 'indicators') == []
 
 
+@pytest.mark.django_db
+def test_update_indicators_concurrently(settings, tmpdir):
+    if not settings.DATABASES['default']['ENGINE'].startswith('django.db.backends.postgresql'):
+        pytest.skip('postgresql only')
+
+    settings.MEDIA_ROOT = tmpdir.strpath
+
+    # Local files stand in for remote sources.
+    sources = tmpdir.mkdir('sources')
+    sources.join('a.csv').write('datetime,y\n2016-01-01,1\n')
+    sources.join('b.csv').write('datetime,y\n2016-01-01,2\n')
+
+    # Both fetches wait for each other, so they only finish, if they run concurrently.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fetch(name):
+        def func(params):
+            barrier.wait()
+            return pd.read_csv(params['download'](str(sources / name)), index_col=0, parse_dates=True)
+        return func
+
+    hang = threading.Event()
+    for slug in ['a', 'b', 'c']:
+        Indicator.objects.create(slug=slug, last_update=None, update_freq=10)
+    indicators_ = [
+        ('a', {'fetch': fetch('a.csv')}),
+        ('b', {'fetch': fetch('b.csv')}),
+        ('c', {'fetch': lambda params: hang.wait(5)}),
+    ]
+
+    now = datetime.datetime(2016, 1, 1, 0, 0, 0)
+    indicators.update_indicators(indicators_, now, workers=3, timeout=0.5)
+    hang.set()
+
+    assert [(x.slug, x.error_count, x.last_update is not None) for x in Indicator.objects.order_by('slug')] == [
+        ('a', 0, True),
+        ('b', 0, True),
+        ('c', 1, False),
+    ]
+    assert 'TimeoutError' in Indicator.objects.get(slug='c').traceback
+    assert indicators.get_indicator_data(Indicator.objects.get(slug='b')) == [['2016-01-01', 2.0]]
+
+
+@pytest.mark.django_db
+def test_update_indicators_conditionally(settings, tmpdir):
+    if not settings.DATABASES['default']['ENGINE'].startswith('django.db.backends.postgresql'):
+        pytest.skip('postgresql only')
+
+    settings.MEDIA_ROOT = tmpdir.strpath
+    source = tmpdir.mkdir('sources').join('a.csv')
+    source.write('datetime,y\n2016-01-01,1\n')
+    csv = tmpdir.join('indicators', 'a.csv')
+
+    def fetch(params):
+        return pd.read_csv(params['download'](str(source)), index_col=0, parse_dates=True)
+
+    def update(seconds):
+        now = datetime.datetime(2016, 1, 1, 0, 0, 0) + timedelta(seconds=seconds)
+        indicators.update_indicators([('a', {'fetch': fetch})], now)
+        return Indicator.objects.get(slug='a')
+
+    Indicator.objects.create(slug='a', last_update=None, update_freq=10)
+    indicator = update(0)
+    assert indicator.bytes_downloaded == source.size()
+    assert indicator.last_modified != ''
+    assert indicator.content_hash != ''
+    assert indicator.fetch_time >= indicator.download_time > 0
+    assert indicators.get_indicator_data(indicator) == [['2016-01-01', 1.0]]
+    last_update, mtime = indicator.last_update, csv.mtime()
+
+    # Source is not modified, so it is not downloaded.
+    os.utime(str(csv), (mtime - 100, mtime - 100))
+    indicator = update(20)
+    assert indicator.bytes_downloaded == 0
+    assert indicator.last_update > last_update
+    assert csv.mtime() == mtime - 100
+
+    # Source is modified, but data are the same.
+    source.setmtime(source.mtime() + 100)
+    indicator = update(40)
+    assert indicator.bytes_downloaded == source.size()
+    assert csv.mtime() == mtime - 100
+
+    # Data are changed.
+    source.write('datetime,y\n2016-01-01,2\n')
+    source.setmtime(source.mtime() + 200)
+    indicator = update(60)
+    assert csv.mtime() > mtime - 100
+    assert indicators.get_indicator_data(indicator) == [['2016-01-01', 2.0]]
+
+
+@pytest.mark.django_db
+def test_update_indicators_from_dataset(settings, tmpdir, monkeypatch):
+    if not settings.DATABASES['default']['ENGINE'].startswith('django.db.backends.postgresql'):
+        pytest.skip('postgresql only')
+
+    settings.MEDIA_ROOT = tmpdir.strpath
+    settings.MANOPOZICIJA_DOWNLOADS_DIR = tmpdir.join('downloads').strpath
+    source = tmpdir.mkdir('sources').join('dataset.csv')
+    source.write('key,2015,2016\na,1,2\nb,3,4\n')
+
+    parse = mock.Mock(side_effect=lambda path: pd.read_csv(path, index_col=0))
+    monkeypatch.setitem(indicators.DATASETS, 'test', {'url': source.strpath, 'parse': parse})
+
+    def transform(key):
+        def func(frame):
+            frame = frame.loc[key].to_frame()
+            frame.index = pd.to_datetime(frame.index, format='%Y')
+            frame.index.name = 'datetime'
+            return frame
+        return func
+
+    indicators_ = [
+        ('a', {'fetch': functools.partial(indicators.fetch_dataset, 'test', transform('a'))}),
+        ('b', {'fetch': functools.partial(indicators.fetch_dataset, 'test', transform('b'))}),
+    ]
+    Indicator.objects.create(slug='a', last_update=None, update_freq=10)
+    Indicator.objects.create(slug='b', last_update=None, update_freq=10)
+
+    def update(seconds, cache_ttl):
+        now = datetime.datetime(2016, 1, 1, 0, 0, 0) + timedelta(seconds=seconds)
+        indicators.update_indicators(indicators_, now, cache_ttl=cache_ttl)
+        return [x.bytes_downloaded for x in Indicator.objects.order_by('slug')]
+
+    # Dataset is downloaded and parsed once for both indicators.
+    assert sorted(update(0, cache_ttl=3600)) == [0, source.size()]
+    assert parse.call_count == 1
+    assert [indicators.get_indicator_data(x) for x in Indicator.objects.order_by('slug')] == [
+        [['2015-01-01', 1.0], ['2016-01-01', 2.0]],
+        [['2015-01-01', 3.0], ['2016-01-01', 4.0]],
+    ]
+
+    # Downloaded file is reused in the next run, while it is not expired, and
+    # since indicators were already made from it, it is not parsed again.
+    assert update(20, cache_ttl=3600) == [0, 0]
+    assert parse.call_count == 1
+
+    # Expired file is revalidated, but not downloaded nor parsed, if source is not modified.
+    assert update(40, cache_ttl=0) == [0, 0]
+    assert parse.call_count == 1
+
+    # Indicator with missing data is made from the cached file.
+    os.remove(indicators.get_indicator_path('a', 'npy'))
+    assert update(60, cache_ttl=3600) == [0, 0]
+    assert parse.call_count == 2
+    assert os.path.exists(indicators.get_indicator_path('a', 'npy'))
+
+    source.setmtime(source.mtime() + 100)
+    assert sorted(update(80, cache_ttl=0)) == [0, source.size()]
+    assert parse.call_count == 3
+
+
+def test_dataset_cache_not_modified(tmpdir, monkeypatch):
+    response = io.BytesIO(b'data')
+    response.headers = {'ETag': '"v1"'}
+    responses = [
+        response,
+        urllib.error.HTTPError('http://example.com/data.csv', 304, 'Not Modified', {}, None),
+    ]
+    urlopen = mock.Mock(side_effect=responses)
+    monkeypatch.setattr(urllib.request, 'urlopen', urlopen)
+    parse = mock.Mock(return_value='frame')
+    monkeypatch.setitem(indicators.DATASETS, 'test', {'url': 'http://example.com/data.csv', 'parse': parse})
+
+    download = indicators.Download()
+    assert indicators.DatasetCache(tmpdir.strpath, ttl=0).get('test', download) == 'frame'
+    assert download.etag == '"v1"'
+    assert parse.call_count == 1
+
+    # Server responds with 304, indicator was made from the same file, so it is not parsed.
+    download = indicators.Download(etag='"v1"')
+    with pytest.raises(indicators.NotModified):
+        indicators.DatasetCache(tmpdir.strpath, ttl=0).get('test', download)
+    assert urlopen.call_args[0][0].get_header('If-none-match') == '"v1"'
+    assert parse.call_count == 1
+
+
 def test_voter_turnout():
     path = pres.resource_filename('manopozicija.tests', 'fixtures/indicators/voter_turnout.tsv.gz')
-    frame = indicators.voter_turnout({'source': path})
+    frame = indicators.voter_turnout(indicators.read_eurostat_tsv(path))
 
     assert tuples(frame) == [
         (dt(1992, 1, 1), 75.2),
@@ -153,7 +342,7 @@ def test_voter_turnout():
     ])
 
 
-def test_topic_kpi(app, settings, tmpdir):
+def test_topic_kpi(app, settings, tmpdir, monkeypatch):
     settings.MEDIA_ROOT = tmpdir.strpath
 
     user = factories.UserFactory()
@@ -164,12 +353,14 @@ def test_topic_kpi(app, settings, tmpdir):
         ('event', 0, 1, 'Balsavimo internetu koncepcijos patvirtinimas', 'lrs.lt', '2006-11-26'),
     ])
 
-    tmpdir.mkdir('indicators').join('%s.csv' % indicators[0].slug).write('\n'.join([
+    csv = tmpdir.mkdir('indicators').join('%s.csv' % indicators[0].slug)
+    csv.write('\n'.join([
         'datetime,Seimo',
         '1992-01-01,75.2',
         '1996-01-01,52.9',
         '',
     ]))
+    csv_stat = csv.stat()
 
     resp = app.get(reverse('topic-kpi', args=[topic.pk, topic.slug]))
     assert resp.json == {
@@ -193,3 +384,115 @@ def test_topic_kpi(app, settings, tmpdir):
             },
         ],
     }
+
+    # CSV file was converted once, now data are read from .npy file.
+    assert tmpdir.join('indicators', '%s.npy' % indicators[0].slug).exists()
+    assert csv.stat().mtime == csv_stat.mtime and csv.stat().ino == csv_stat.ino
+    monkeypatch.setattr(pd, 'read_csv', mock.Mock(side_effect=AssertionError('CSV file parsed')))
+    assert app.get(reverse('topic-kpi', args=[topic.pk, topic.slug])).json == resp.json
+
+
+def test_downsampled_indicator_data(settings, tmpdir):
+    settings.MEDIA_ROOT = tmpdir.strpath
+    tmpdir.mkdir('indicators')
+
+    index = pd.date_range('2000-01-01', periods=10000, freq='D', name='datetime')
+    values = numpy.sin(numpy.arange(len(index)) / 100)
+    values[5000] = 10  # a spike, that must not be lost
+    frame = pd.DataFrame({'value': values}, index=index)
+    indicators.save_indicator_data('daily', frame)
+    assert ls(tmpdir, tmpdir.join('indicators')) == [
+        'indicators/daily.csv',
+        'indicators/daily.lttb100.npy',
+        'indicators/daily.lttb2000.npy',
+        'indicators/daily.lttb500.npy',
+        'indicators/daily.npy',
+    ]
+
+    indicator = Indicator(slug='daily')
+    data = indicators.get_indicator_data(indicator, resolution=100)
+    assert len(data) == 100
+    assert data[0] == ['2000-01-01', values[0]]
+    assert data[-1] == ['2027-05-18', values[-1]]
+    assert ['2013-09-09', 10.0] in data
+
+    # Precomputed series are used, if they have enough points in the date range.
+    start, end = datetime.date(2010, 1, 1), datetime.date(2010, 12, 31)
+    with mock.patch.object(indicators, 'lttb', side_effect=lambda array, threshold: array):
+        assert [
+            len(indicators.get_indicator_data(indicator, start, end, resolution=x))
+            for x in [10, 50, 100]
+        ] == [18, 73, 365]
+
+    data = indicators.get_indicator_data(indicator, start, end, resolution=100)
+    assert len(data) == 100
+    assert data[0][0] == '2010-01-01'
+    assert data[-1][0] == '2010-12-31'
+
+    # Precomputed series are removed, when series becomes shorter.
+    indicators.save_indicator_data('daily', frame[:200])
+    assert ls(tmpdir, tmpdir.join('indicators')) == [
+        'indicators/daily.csv',
+        'indicators/daily.lttb100.npy',
+        'indicators/daily.npy',
+    ]
+    assert len(indicators.get_indicator_data(indicator)) == 200
+
+
+def test_topic_kpi_conditional(app, settings, tmpdir):
+    settings.MEDIA_ROOT = tmpdir.strpath
+
+    user = factories.UserFactory()
+    topic = factories.TopicFactory()
+    indicator = topic.indicators.get()
+    indicator.last_update = datetime.datetime(2016, 1, 1, 12, 0, 0)
+    indicator.save()
+    factories.TopicCuratorFactory(user=user, topic=topic)
+    post, = factories.create_topic_posts(topic, user, [
+        ('event', 0, 1, 'Balsavimo internetu koncepcijos patvirtinimas', 'lrs.lt', '2006-11-26'),
+    ])
+
+    tmpdir.mkdir('indicators').join('%s.csv' % indicator.slug).write('\n'.join([
+        'datetime,Seimo',
+        '1992-01-01,75.2',
+        '1996-01-01,52.9',
+        '2000-01-01,58.2',
+        '',
+    ]))
+
+    url = reverse('topic-kpi', args=[topic.pk, topic.slug])
+    resp = app.get(url, {'start': '1995-01-01', 'end': '2000-01-01'})
+    assert resp.json['indicators'][0]['data'] == [
+        ['1996-01-01', 52.9],
+        ['2000-01-01', 58.2],
+    ]
+    assert list(app.get(url, {'resolution': 1}, status=400).json['errors']) == ['resolution']
+
+    # Data are not sent again, if nothing has changed.
+    resp = app.get(url)
+    etag = resp.headers['ETag']
+    last_modified = resp.headers['Last-Modified']
+    app.get(url, headers={'If-None-Match': etag}, status=304)
+    app.get(url, headers={'If-Modified-Since': last_modified}, status=304)
+
+    # Other range or resolution of the same data has other ETag.
+    resp = app.get(url, {'resolution': 100}, headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    resp = app.get(url, {'start': '1995-01-01'}, headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+
+    # Indicator update changes both ETag and Last-Modified.
+    indicator.last_update = datetime.datetime(2030, 2, 11, 0, 0, 0)
+    indicator.save()
+    resp = app.get(url, headers={'If-None-Match': etag})
+    assert resp.status_code == 200
+    assert resp.headers['ETag'] != etag
+    assert resp.headers['Last-Modified'] == 'Mon, 11 Feb 2030 00:00:00 GMT'
+    app.get(url, headers={'If-Modified-Since': 'Mon, 11 Feb 2030 00:00:00 GMT'}, status=304)
+
+    # Event changes are seen by ETag.
+    etag = resp.headers['ETag']
+    services.bump_topic_version(topic)
+    assert app.get(url, headers={'If-None-Match': etag}).json['events'][0]['id'] == post.pk
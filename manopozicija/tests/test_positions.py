@@ -0,0 +1,63 @@
+import random
+
+import pytest
+
+from manopozicija import factories
+from manopozicija import models
+from manopozicija import positions
+from manopozicija import services
+
+
+def _approx(result):
+    return [(actor, pytest.approx(distance)) for actor, distance in result]
+
+
+@pytest.fixture
+def topic_votes(app):
+    rng = random.Random(0)
+    topic = factories.TopicFactory()
+    users = [factories.UserFactory(first_name='u%d' % i) for i in range(4)]
+    arguments = ['šiuolaikiška, modernu', 'balsų pirkimas', 'didės užsienio lietuvių aktyvumas rinkimuose']
+    posts = factories.create_topic_posts(topic, users[0], [
+        ('quote', name, 'seimo narys', 'delfi.lt', '2016-03-%02d' % (i + 1), [
+            (rng.choice([0, 1]), rng.choice([0, 1]), 'Citata %d' % i, [
+                (rng.choice([-1, 1]), title, rng.choice([None, True]))
+                for title in rng.sample(arguments, rng.randint(1, len(arguments)))
+            ]),
+        ])
+        for i, name in enumerate([
+            'Mantas Adomėnas',
+            'Eligijus Masiulis',
+            'Juozas Bernatonis',
+            'Mantas Adomėnas',
+            'Eligijus Masiulis',
+            'Andrius Kubilius',
+        ])
+    ])
+    for user in users[1:]:
+        for post in rng.sample(posts, 4):
+            services.update_user_position(user, post, rng.choice([-1, 0, 1]))
+
+    members = models.Actor.objects.exclude(first_name='Andrius').values_list('pk', flat=True)
+    group = factories.GroupFactory(members=list(members))
+    return group, users
+
+
+def test_compare_positions(topic_votes):
+    group, users = topic_votes
+    for user in users:
+        expected = services.compute_positions(group, user)
+        assert expected
+        assert positions.compare_positions(group, user) == _approx(expected)
+        assert services.compare_positions(group, user) == _approx(expected)
+
+
+def test_compare_users_positions(topic_votes):
+    group, users = topic_votes
+    user = factories.UserFactory(first_name='nevotes')
+    actor_positions = positions.load_actor_positions(group)
+    result = positions.compare_users_positions(group, users + [user], actor_positions)
+    assert result == {
+        **{x.pk: _approx(services.compute_positions(group, x)) for x in users},
+        user.pk: [],
+    }
@@ -1,7 +1,15 @@
+import datetime
 import itertools
+import pytest
+
+from django.db import connection
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.contrib.auth.models import AnonymousUser
 
 from manopozicija import models
 from manopozicija import services
+from manopozicija import helpers
 from manopozicija import factories
 
 
@@ -50,6 +58,61 @@ def test_get_topic_posts(app):
     ])
 
 
+def test_get_topic_posts_deleted_content(app):
+    user = factories.UserFactory()
+    topic = factories.TopicFactory()
+    factories.TopicCuratorFactory(user=user, topic=topic)
+    factories.create_topic_posts(topic, None, [
+        ('event', 1, 0, 'Balsavimo internetu koncepcijos patvirtinimas', 'lrs.lt', '2006-11-26'),
+        ('event', 1, 0, 'Balsavimo internetu įstatymo projektas', 'lrs.lt', '2008-01-01'),
+    ])
+
+    # Posts are generic relations, so content objects can be deleted without deleting posts.
+    event = models.Event.objects.get(title='Balsavimo internetu įstatymo projektas')
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM manopozicija_event WHERE id = %s', [event.pk])
+
+    assert services.dump_topic_posts(topic) == '\n'.join([
+        ' o  (-) Balsavimo internetu koncepcijos patvirtinimas                                  lrs.lt 2006-11-26 (1)',
+    ])
+
+
+def test_get_topic_posts_query_count(app, django_assert_num_queries):
+    topic = factories.TopicFactory()
+    sources = [
+        factories.SourceFactory(
+            actor=factories.PersonActorFactory(first_name='Vardenis', last_name='Pavardenis%d' % i),
+            source_link='http://delfi.lt/%d' % i,
+        )
+        for i in range(10)
+    ]
+    for i in range(1000):
+        if i % 2:
+            event = factories.EventFactory(title='Įvykis %d' % i, source_link='http://lrs.lt/%d' % i)
+            factories.PostFactory(topic=topic, content_object=event)
+        else:
+            quote = factories.QuoteFactory(source=sources[i // 2 % 10], text='Citata %d' % i)
+            post = factories.PostFactory(topic=topic, content_object=quote)
+            factories.PostArgumentFactory(
+                topic=topic, post=post, quote=quote,
+                title='argumentas %d' % (i % 3), counterargument=False,
+            )
+
+    # Warm up content type cache.
+    services.get_topic_posts(topic)
+
+    # One query for posts, one for each content type and one for quote arguments.
+    with django_assert_num_queries(4):
+        posts = services.get_topic_posts(topic)
+        context = helpers.get_posts(AnonymousUser(), topic, posts)
+
+    assert sum(len(x['quotes']) if x['type'] == 'quotes' else 1 for x in context) == 1000
+    assert all(len(quote['arguments']) == 1 for x in context if x['type'] == 'quotes' for quote in x['quotes'])
+
+    with django_assert_num_queries(4):
+        services.dump_topic_posts(topic)
+
+
 def test_create_quote(app):
     user = factories.UserFactory()
     topic = factories.TopicFactory()
@@ -79,6 +142,59 @@ def test_create_quote(app):
     ])
 
 
+def test_deferred_positions(app, settings):
+    settings.MANOPOZICIJA_DEFER_POSITIONS = True
+    user = factories.UserFactory()
+    topic = factories.TopicFactory()
+    factories.TopicCuratorFactory(user=user, topic=topic)
+    source, quote, arguments = factories.get_quote_form_data()
+    actor = source['actor']
+    services.create_quote(user, topic, source, quote, arguments)
+    source, quote, arguments = factories.get_quote_form_data(
+        text='Atidaroma galimybė prekiauti balsais ir likti nebaudžiamam.'
+    )
+    arguments[0].update(title='balsų pirkimas', position=-1, counterargument=False)
+    services.create_quote(user, topic, source, quote, arguments)
+
+    # Both quotes queued the same source, it is recomputed once.
+    assert sorted(models.PositionUpdate.objects.values_list('kind', 'title')) == [
+        (models.PositionUpdate.QUOTE, ''),
+        (models.PositionUpdate.QUOTE, ''),
+        (models.PositionUpdate.SOURCE, ''),
+        (models.PositionUpdate.ARGUMENT, 'balsų pirkimas'),
+        (models.PositionUpdate.ARGUMENT, 'šiuolaikiška, modernu'),
+    ]
+    assert list(models.Post.objects.filter(actor=actor).values_list('position', flat=True)) == [0, 0]
+    assert models.Source.objects.get(actor=actor).position == 0
+    assert models.ActorArgumentPosition.objects.filter(actor=actor).count() == 0
+
+    call_command('processpositions', batch_size=2)
+    assert models.PositionUpdate.objects.count() == 0
+    assert list(models.Post.objects.filter(actor=actor).order_by('pk').values_list('position', flat=True)) == [-1, -1]
+    assert models.Source.objects.get(actor=actor).position == -1
+    assert sorted(models.ActorArgumentPosition.objects.filter(actor=actor).values_list('argument__title', 'position')) == [
+        ('balsų pirkimas', -1),
+        ('šiuolaikiška, modernu', -1),
+    ]
+
+
+def test_is_duplicate_quote(app):
+    user = factories.UserFactory()
+    topic = factories.TopicFactory()
+    source, quote, arguments = factories.get_quote_form_data(
+        text='Atidaroma galimybė prekiauti balsais ir likti nebaudžiamam.'
+    )
+    actor, source_link = source['actor'], source['source_link']
+    quote = services.create_quote(user, topic, source, quote, arguments)
+
+    similar = 'Atidaroma nauja galimybė prekiauti balsais ir likti nebaudžiamam.'
+    assert services.is_duplicate_quote(topic, actor, source_link, similar) is True
+    assert services.is_duplicate_quote(topic, actor, source_link, similar, exclude=quote.pk) is False
+    assert services.is_duplicate_quote(topic, actor, source_link, 'Balsų pirkimas.') is False
+    assert services.is_duplicate_quote(topic, actor, 'http://example.com/', similar) is False
+    assert services.is_duplicate_quote(factories.TopicFactory(title='Kita tema'), actor, source_link, similar) is False
+
+
 def test_get_post_votes(app):
     user = (factories.UserFactory(first_name='u%d' % i) for i in itertools.count())
     event = factories.EventFactory()
@@ -230,3 +346,150 @@ def test_compare_positions(app):
         (mantas_adomenas, 0.125),
         (eligijus_masiulis, 1.0),
     ]
+    assert services.compute_positions(group, user) == services.compare_positions(group, user)
+
+    # Precomputed distances follow actor argument position changes and new votes
+    factories.create_topic_posts(topic, user, [
+        ('quote', 'Eligijus Masiulis', 'seimo narys', 'lrt.lt', '2016-04-01', [
+            (0, 1, 'Balsavimas internetu bus saugus.', [
+                (-1, 'šiuolaikiška, modernu', None),
+                (1, 'balsų pirkimas', None),
+            ]),
+        ]),
+    ])
+    other = factories.UserFactory(first_name='other')
+    post = models.Post.objects.filter(actor=mantas_adomenas).order_by('pk').first()
+    services.update_user_position(other, post, -1)
+    assert services.compare_positions(group, user) == [
+        (mantas_adomenas, 0.0),
+        (eligijus_masiulis, 1.0),
+    ]
+    assert services.compare_positions(group, other) == [
+        (eligijus_masiulis, 0.5),
+        (mantas_adomenas, 0.75),
+    ]
+    for u in (user, other):
+        assert services.compare_positions(group, u) == [
+            (actor, pytest.approx(distance)) for actor, distance in services.compute_positions(group, u)
+        ]
+
+
+def test_get_user_topic_position(app):
+    users = [factories.UserFactory(first_name='u%d' % i) for i in range(3)]
+    topic = factories.TopicFactory()
+    posts = [
+        factories.PostFactory(topic=topic, content_object=factories.EventFactory(
+            title='Įvykis %d' % i,
+            source_link='http://lrs.lt/%d' % i,
+        ))
+        for i in range(3)
+    ]
+
+    services.update_user_position(users[0], posts[0], 1)
+    services.update_user_position(users[0], posts[1], 1)
+    services.update_user_position(users[0], posts[2], -1)
+    services.update_user_position(users[1], posts[0], -1)
+    services.update_user_position(users[1], posts[0], 1)
+
+    assert services.get_user_topic_position(users[0], topic) == 1 / 3
+    assert services.get_user_topic_position(users[1], topic) == 1
+    assert services.get_user_topic_position(users[2], topic) == 0
+    assert services.get_users_topic_positions(users, topic) == {
+        users[0].pk: 1 / 3,
+        users[1].pk: 1,
+    }
+
+    def dump():
+        return sorted(models.UserTopicPosition.objects.values_list('user', 'topic', 'position', 'count'))
+
+    expected = dump()
+    assert expected == [
+        (users[0].pk, topic.pk, 1 / 3, 3),
+        (users[1].pk, topic.pk, 1, 1),
+    ]
+
+    models.UserTopicPosition.objects.all().delete()
+    call_command('updatetopicpositions', verbosity=0)
+    assert dump() == expected
+
+
+def test_check_vote_counters(app):
+    users = [factories.UserFactory(first_name='u%d' % i) for i in range(2)]
+    topic = factories.TopicFactory()
+    posts = factories.create_topic_posts(topic, users[0], [
+        ('quote', 'Mantas Adomėnas', 'seimo narys', 'kauno.diena.lt', '2016-03-22', [
+            (1, 0, 'Nepasiduokime paviršutiniškiems šūkiams – šiuolaikiška, modernu.', [
+                (1, 'šiuolaikiška, modernu', True),
+            ]),
+            (1, 0, 'Atidaroma galimybė prekiauti balsais ir likti nebaudžiamam.', [
+                (-1, 'balsų pirkimas', None),
+                (1, 'šiuolaikiška, modernu', None),
+            ]),
+        ]),
+    ])
+
+    services.update_user_position(users[1], posts[0], -1)
+    services.update_user_position(users[1], posts[1], 1)
+    services.update_user_position(users[1], posts[1], 0)
+    services.update_user_position(users[1], posts[0], 1)
+
+    def dump():
+        return sorted(
+            models.UserArgumentPosition.objects.
+            values_list('user__first_name', 'argument__title', 'total', 'count', 'position')
+        )
+
+    assert dump() == [
+        ('u0', 'balsų pirkimas', -1, 1, -1),
+        ('u0', 'šiuolaikiška, modernu', 0, 2, 0),
+        ('u1', 'balsų pirkimas', 0, 0, 0),
+        ('u1', 'šiuolaikiška, modernu', -1, 1, -1),
+    ]
+    assert services.check_vote_counters() == []
+
+    models.Post.objects.filter(pk=posts[0].pk).update(upvotes=5)
+    models.UserArgumentPosition.objects.filter(user=users[1]).delete()
+    models.UserTopicPosition.objects.filter(user=users[0]).update(position=0.5)
+    with pytest.raises(CommandError):
+        call_command('checkvotes', verbosity=0)
+
+    call_command('checkvotes', fix=True, verbosity=0)
+    assert services.check_vote_counters() == []
+    assert dump() == [
+        ('u0', 'balsų pirkimas', -1, 1, -1),
+        ('u0', 'šiuolaikiška, modernu', 0, 2, 0),
+        ('u1', 'šiuolaikiška, modernu', -1, 1, -1),
+    ]
+    assert services.get_post_votes(posts[0]) == (2, 0)
+
+
+def test_get_group_parties(app, django_assert_num_queries):
+    actors = [factories.PersonActorFactory(first_name='Actor', last_name=str(i)) for i in range(3)]
+    parties = [
+        factories.PersonActorFactory(first_name='Party %d' % i, last_name='', group=True, title='plitinė partija')
+        for i in range(2)
+    ]
+    group = factories.GroupFactory(members=actors[:2])
+    models.Member.objects.create(actor=actors[0], group=parties[0], since=datetime.datetime(2004, 1, 1), until=datetime.datetime(2008, 1, 1))
+    models.Member.objects.create(actor=actors[0], group=parties[1], since=datetime.datetime(2008, 1, 1), until=None)
+    models.Member.objects.create(actor=actors[1], group=parties[0], since=datetime.datetime(2012, 1, 1), until=datetime.datetime(2016, 1, 1))
+    models.Member.objects.create(actor=actors[2], group=parties[0], since=datetime.datetime(2012, 1, 1), until=None)
+
+    assert services.get_group_parties(group) == {
+        actors[0].pk: parties[1].pk,
+        actors[1].pk: parties[0].pk,
+    }
+    with django_assert_num_queries(0):
+        services.get_group_parties(group)
+
+    # Cache is invalidated on membership changes
+    models.Member.objects.filter(actor=actors[1]).update(until=None)
+    models.Member.objects.create(actor=actors[1], group=parties[1], since=datetime.datetime(2016, 1, 1), until=None)
+    group.members.add(actors[2])
+    assert services.get_group_parties(group) == {
+        actors[0].pk: parties[1].pk,
+        actors[1].pk: parties[1].pk,
+        actors[2].pk: parties[0].pk,
+    }
+    models.Member.objects.filter(actor=actors[0], group=parties[1]).get().delete()
+    assert services.get_group_parties(group)[actors[0].pk] == parties[0].pk
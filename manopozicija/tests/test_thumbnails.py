@@ -0,0 +1,55 @@
+import mock
+import pytest
+
+from PIL import Image
+
+from manopozicija import thumbnails
+
+
+def _transparent(mode):
+    image = Image.new('RGBA', (4, 2), (255, 0, 0, 255))
+    image.putpixel((0, 0), (0, 0, 0, 0))
+    if mode == 'P':
+        image = image.convert('P')
+        image.info['transparency'] = image.getpixel((0, 0))
+        return image
+    return image.convert(mode)
+
+
+@pytest.mark.parametrize('mode, expected', [
+    ('RGBA', [(255, 255, 255), (255, 0, 0)]),
+    ('LA', [(255, 255, 255), (76, 76, 76)]),
+    ('P', [(255, 255, 255), (255, 0, 0)]),
+    ('RGB', [(0, 0, 0), (255, 0, 0)]),
+])
+def test_flatten(mode, expected):
+    image = thumbnails.flatten(_transparent(mode), '#FFF')
+    assert image.mode in ('RGB', 'L')
+    assert [image.convert('RGB').getpixel(xy) for xy in [(0, 0), (1, 0)]] == expected
+
+
+def test_engine_get_image(tmpdir):
+    path = tmpdir.join('a.png')
+    _transparent('RGBA').save(str(path))
+
+    class Source:
+        key = 'a.png'
+
+        def read(self):
+            return path.read_binary()
+
+    engine = thumbnails.Engine()
+    image = engine.get_image(Source())
+    assert engine.get_image(Source()) is image
+    assert engine._flatten(image, '#FFF') is engine._flatten(image, '#FFF')
+
+
+def test_get_urls(settings):
+    settings.MANOPOZICIJA_THUMBNAIL_CACHE_TIMEOUT = 60
+    with mock.patch('manopozicija.thumbnails.cache') as cache, \
+            mock.patch('manopozicija.thumbnails.get_thumbnail') as get_thumbnail:
+        cache.get_many.return_value = {}
+        get_thumbnail.return_value.url = '/media/cache/a.jpg'
+        assert thumbnails.get_urls(['a.png']) == {'a.png': '/media/cache/a.jpg'}
+    key, = cache.set_many.call_args[0][0]
+    assert cache.set_many.call_args == mock.call({key: '/media/cache/a.jpg'}, timeout=60)
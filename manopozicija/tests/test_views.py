@@ -1,12 +1,16 @@
+import re
+
 import pytest
 
 from webtest import Upload
 
+from django.core.cache import cache
 from django.urls import reverse
 
 from manopozicija import models
 from manopozicija import services
 from manopozicija import factories
+from manopozicija import views
 
 
 def test_create_person(app):
@@ -36,6 +40,37 @@ def test_create_group(app):
     assert models.Actor.objects.filter(first_name='Lietuvos Žaliųjų Partija').exists()
 
 
+@pytest.mark.parametrize('index', [False, True])
+def test_autocomplete_actor(app, settings, tmpdir, index):
+    settings.CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': tmpdir.strpath}}
+    settings.MANOPOZICIJA_ACTOR_INDEX = index
+    factories.UserFactory()
+    factories.PersonActorFactory(photo='')
+    factories.PersonActorFactory(first_name='Juozas', last_name='Bernatonis')
+    factories.PersonActorFactory(first_name='Eugenijus', last_name='Gentvilas', photo='')
+    factories.PartyActorFactory(first_name='Liberalų sąjūdis')
+
+    def search(q):
+        resp = app.get(reverse('autocomplete-actor'), {'q': q}, user='vardenis')
+        return [re.sub(r'<img src="[^"]+" /> ', '', x['text']) for x in resp.json['results']]
+
+    # Actors are not shown to anonymous users.
+    assert app.get(reverse('autocomplete-actor'), {'q': 'e'}).json['results'] == []
+
+    # Case and accents are ignored.
+    assert search('ADOMEN') == ['Mantas Adomėnas']
+    assert search('liberalu') == ['Liberalų sąjūdis ']
+    assert search('bern') == ['Juozas Bernatonis']
+    assert search('e') == ['Eugenijus Gentvilas']
+    assert search('x') == []
+
+    # Results are cached.
+    factories.PersonActorFactory(first_name='Eglė', last_name='Šimonytė')
+    assert search('e') == ['Eugenijus Gentvilas']
+    cache.clear()
+    assert search('e') == ['Eglė Šimonytė', 'Eugenijus Gentvilas']
+
+
 def test_create_event(app):
     user = factories.UserFactory()
     topic = factories.TopicFactory()
@@ -278,7 +313,7 @@ def test_topic_details(app):
     app.get(reverse('topic-details', args=[topic.pk, topic.slug]), user=user)
 
 
-def test_compare(app):
+def test_compare(app, monkeypatch):
     user = factories.UserFactory()
     topic = factories.TopicFactory()
     factories.TopicCuratorFactory(user=user, topic=topic)
@@ -299,7 +334,24 @@ def test_compare(app):
         ]),
     ])
     group = factories.GroupFactory(members=models.Actor.objects.all())
-    app.get(reverse('compare-positions', args=[group.pk, group.slug]), user=user)
+    resp = app.get(reverse('compare-positions', args=[group.pk, group.slug]), user=user)
+    assert resp.html.select('.js-compare-positions .event-name')[0].text == 'Mantas Adomėnas'
+
+    resp = app.get(reverse('js:compare-positions-page', args=[group.pk]), {'offset': 0}, user=user)
+    assert resp.json['offset'] == 1
+    assert resp.json['more'] is False
+    assert 'Mantas Adomėnas' in resp.json['html']
+    assert 'Eligijus Masiulis' in resp.json['html']
+
+    resp = app.get(reverse('js:compare-positions-page', args=[group.pk]), {'offset': 1}, user=user)
+    assert resp.json['html'].strip() == ''
+    assert resp.json['offset'] == 1
+
+    # No more pages, when the last page is full.
+    monkeypatch.setattr(views, 'COMPARE_POSITIONS_PAGE_SIZE', 1)
+    resp = app.get(reverse('js:compare-positions-page', args=[group.pk]), {'offset': 0}, user=user)
+    assert resp.json['offset'] == 1
+    assert resp.json['more'] is False
 
 
 def test_update_post_permission(App, app):
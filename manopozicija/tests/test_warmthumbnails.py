@@ -0,0 +1,27 @@
+import io
+import re
+
+from django.core.management import call_command
+
+from manopozicija import factories
+
+
+def test_warmthumbnails(db, settings, tmpdir):
+    settings.MEDIA_ROOT = str(tmpdir)
+    factories.PersonActorFactory()
+    factories.PersonActorFactory(first_name='Juozas', last_name='Bernatonis')
+    factories.PersonActorFactory(first_name='Eugenijus', last_name='Gentvilas', photo='')
+    factories.CuratorFactory()
+    factories.TopicFactory()
+
+    stdout = io.StringIO()
+    call_command('warmthumbnails', stdout=stdout)
+    output = stdout.getvalue()
+    assert re.findall(r'^Rendering .*|^  \d+ images', output, re.MULTILINE) == [
+        'Rendering actor photos...',
+        '  2 images',
+        'Rendering curator photos...',
+        '  1 images',
+        'Rendering topic logos...',
+        '  1 images',
+    ]
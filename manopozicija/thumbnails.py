@@ -1,10 +1,39 @@
 import logging
+import threading
+import collections
+import concurrent.futures
 
 from PIL import Image, ImageColor
+from sorl.thumbnail import get_thumbnail
+from sorl.thumbnail.helpers import serialize, tokey
 from sorl.thumbnail.engines.pil_engine import Engine
 
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, connections
+
 logger = logging.getLogger(__file__)
 
+# Thumbnail (geometry, options) used in templates and autocomplete.
+PHOTO = ('70x70', {'crop': '50% 0%', 'background': '#FFF'})
+SMALL_PHOTO = ('40x40', {'crop': '50% 0%', 'background': '#FFF'})
+LOGO = ('256x200', {'crop': 'center', 'background': '#FFF'})
+
+
+def flatten(image, background):
+    """Paste image having transparency on a background color.
+
+    Returns RGB image, images without transparency are returned as is.
+
+    """
+    if image.mode in ('LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+    if image.mode != 'RGBA':
+        return image
+    result = Image.new('RGB', image.size, ImageColor.getcolor(background, 'RGB'))
+    result.paste(image, mask=image.getchannel('A'))
+    return result
+
 
 class Engine(Engine):
     """Sorl Thumbnail Engine that accepts background color
@@ -12,17 +41,102 @@ class Engine(Engine):
     Created on Sunday, February 2012 by Yuji Tomita
 
     https://yuji.wordpress.com/2012/02/26/sorl-thumbnail-convert-png-to-jpeg-with-background-color/
+
+    Source image is flattened on the background before other processing,
+    because JPEG thumbnails are converted to RGB dropping transparency.
+    Decoded and flattened source images are kept for a few sources, so that
+    all thumbnails of the same source are created from a single decoded
+    image.
+
     """
+
+    cache_size = 4
+
+    def __init__(self):
+        super().__init__()
+        self._lock = threading.Lock()
+        # {source key: (image, {background: flattened image})}
+        self._sources = collections.OrderedDict()
+
+    def get_image(self, source):
+        with self._lock:
+            if source.key in self._sources:
+                self._sources.move_to_end(source.key)
+                return self._sources[source.key][0]
+        image = super().get_image(source)
+        image.load()
+        with self._lock:
+            self._sources[source.key] = (image, {})
+            while len(self._sources) > self.cache_size:
+                self._sources.popitem(last=False)
+        return image
+
+    def _flatten(self, image, background):
+        with self._lock:
+            flattened = next((x for source, x in self._sources.values() if source is image), {})
+        if background not in flattened:
+            flattened[background] = flatten(image, background)
+        return flattened[background]
+
     def create(self, image, geometry, options):
-        ALPHA = 3  # 3 is the alpha of an RGBA image.
-        thumb = super(Engine, self).create(image, geometry, options)
         background = options.get('background')
         if background:
+            image = self._flatten(image, background)
+        return super().create(image, geometry, options)
+
+
+def get_urls(names, thumbnail=SMALL_PHOTO):
+    """Return a dict of image names and their thumbnail urls.
+
+    Urls are cached for MANOPOZICIJA_THUMBNAIL_CACHE_TIMEOUT seconds, so that
+    a page of images needs a single cache lookup.
+    Images, whose thumbnails can't be created, are mapped to None.
+
+    """
+    geometry, options = thumbnail
+    keys = {name: 'manopozicija:thumbnail:%s' % tokey(name, geometry, serialize(options)) for name in names}
+    cached = cache.get_many(list(keys.values()))
+    urls = {name: cached.get(key) for name, key in keys.items()}
+    missing = {}
+    for name, url in urls.items():
+        if url is None:
             try:
-                bgthumb = Image.new('RGB', thumb.size, ImageColor.getcolor(background, 'RGB'))
-                bgthumb.paste(thumb, mask=thumb.split()[ALPHA])
-                return bgthumb
+                urls[name] = missing[keys[name]] = get_thumbnail(name, geometry, **options).url
             except Exception:
-                logger.exception('error while creating %r thumbnail with parameter: %r, %r', image, geometry, options)
-                return thumb
-        return thumb
+                logger.exception('error while creating %r thumbnail %r', name, geometry)
+    cache.set_many(missing, timeout=settings.MANOPOZICIJA_THUMBNAIL_CACHE_TIMEOUT)
+    return urls
+
+
+def render(name, thumbnails=(PHOTO, SMALL_PHOTO)):
+    """Render thumbnails of a stored image, if they are not rendered yet."""
+    for geometry, options in thumbnails:
+        get_thumbnail(name, geometry, **options)
+
+
+def render_many(names, thumbnails=(PHOTO, SMALL_PHOTO), workers=None):
+    """Render thumbnails of many images in worker processes.
+
+    Yields (name, exception) pairs in completion order, exception is None if
+    all thumbnails of an image were rendered.
+
+    Workers open their own database connections, so rendering falls back to
+    the current process inside a transaction or if workers is 0.
+
+    """
+    if workers == 0 or connection.in_atomic_block:
+        for name in names:
+            try:
+                render(name, thumbnails)
+            except Exception as e:
+                yield name, e
+            else:
+                yield name, None
+        return
+
+    # Forked workers must not share database connections with this process.
+    connections.close_all()
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(render, name, thumbnails): name for name in names}
+        for future in concurrent.futures.as_completed(futures):
+            yield futures[future], future.exception()
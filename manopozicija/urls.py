@@ -25,6 +25,7 @@ urlpatterns = [
     path('', include(([
         path('naudotojo-balsas/<int:post_id>/', views.user_post_vote, name='user-post-vote'),
         path('kuratoriaus-balsas/<int:post_id>/', views.curator_post_vote, name='curator-post-vote'),
+        path('palyginimas/<int:object_id>/', views.compare_positions_page, name='compare-positions-page'),
     ], 'js'))),
 ]
 
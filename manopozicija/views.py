@@ -1,9 +1,12 @@
 import logging
 
 from django.http import JsonResponse, Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.shortcuts import render
 from django.shortcuts import redirect
 from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 from django.utils.translation import ugettext
 from django.contrib.auth.decorators import login_required
 from django.forms import formset_factory, modelformset_factory
@@ -13,7 +16,7 @@ from manopozicija import models
 from manopozicija import services
 from manopozicija import forms
 from manopozicija import helpers
-from manopozicija.indicators import get_indicator_data
+from manopozicija.indicators import DEFAULT_RESOLUTION, get_indicator_data
 
 logger = logging.getLogger(__name__)
 
@@ -31,11 +34,8 @@ def topic_details(request, object_id, slug):
     return render(request, 'manopozicija/topic_details.html', {
         'topic': topic,
         'arguments': helpers.get_arguments(services.get_topic_arguments(topic)),
-        'posts': helpers.get_posts(request.user, topic, services.get_topic_posts(topic)),
-        'queue': (
-            helpers.get_posts(request.user, topic, services.get_topic_posts(topic, queue=True))
-            if is_topic_curator else []
-        ),
+        'posts': helpers.get_topic_posts(request.user, topic),
+        'queue': helpers.get_topic_posts(request.user, topic, queue=True) if is_topic_curator else [],
         'has_indicators': topic.indicators.count() > 0,
         'indicators': helpers.get_indicators(topic),
         'is_topic_curator': is_topic_curator,
@@ -45,31 +45,48 @@ def topic_details(request, object_id, slug):
 
 def topic_kpi(request, object_id, slug):
     topic = get_object_or_404(models.Topic, pk=object_id)
-    event_type = ContentType.objects.get(app_label='manopozicija', model='event')
-    return JsonResponse({
-        'indicators': [
-            {
-                'id': x.pk,
-                'ylabel': x.ylabel,
-                'data': get_indicator_data(x),
-            }
-            for x in topic.indicators.all()
-        ],
-        'events': [
-            {
-                'id': x.pk,
-                'title': x.content_object.title,
-                'date': x.timestamp.strftime('%Y-%m-%d'),
-                'source': x.content_object.source_link,
-                'position': x.position,
-            }
-            for x in (
-                models.Post.objects.
-                filter(topic=topic, content_type=event_type, approved__isnull=False).
-                order_by('timestamp')
-            )
-        ],
-    })
+    form = forms.KpiForm(request.GET)
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+
+    params = form.cleaned_data
+    indicators = list(topic.indicators.all())
+    etag, last_modified = helpers.get_topic_kpi_validators(topic, indicators, params)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = JsonResponse({
+            'indicators': [
+                {
+                    'id': x.pk,
+                    'ylabel': x.ylabel,
+                    'data': get_indicator_data(
+                        x, params['start'], params['end'],
+                        params['resolution'] or DEFAULT_RESOLUTION,
+                    ),
+                }
+                for x in indicators
+            ],
+            'events': [
+                {
+                    'id': x['post__pk'],
+                    'title': x['title'],
+                    'date': x['post__timestamp'].strftime('%Y-%m-%d'),
+                    'source': x['source_link'],
+                    'position': x['post__position'],
+                }
+                for x in (
+                    models.Event.objects.
+                    filter(post__topic=topic, post__approved__isnull=False).
+                    order_by('post__timestamp').
+                    values('post__pk', 'title', 'post__timestamp', 'source_link', 'post__position')
+                )
+            ],
+        })
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, no_cache=True)
+    return response
 
 
 @login_required
@@ -282,10 +299,36 @@ def user_post_vote(request, post_id):
     return JsonResponse({'success': False})
 
 
+COMPARE_POSITIONS_PAGE_SIZE = 20
+
+
+def _get_positions_page(group, user, offset=0):
+    # One more row is fetched, to know if there is a next page.
+    positions = helpers.get_positions(group, user, COMPARE_POSITIONS_PAGE_SIZE + 1, offset)
+    return positions[:COMPARE_POSITIONS_PAGE_SIZE], len(positions) > COMPARE_POSITIONS_PAGE_SIZE
+
+
 @login_required
 def compare_positions(request, object_id, slug):
     group = get_object_or_404(models.Group, pk=object_id)
+    positions, more = _get_positions_page(group, request.user)
     return render(request, 'manopozicija/compare_positions.html', {
         'group': group,
-        'positions': helpers.get_positions(group, request.user),
+        'positions': positions,
+        'more': more,
+    })
+
+
+@login_required
+def compare_positions_page(request, object_id):
+    group = get_object_or_404(models.Group, pk=object_id)
+    try:
+        offset = max(0, int(request.GET.get('offset', 0)))
+    except ValueError:
+        raise Http404
+    positions, more = _get_positions_page(group, request.user, offset)
+    return JsonResponse({
+        'html': render_to_string('manopozicija/_compare_positions.html', {'positions': positions}, request),
+        'offset': offset + len(positions),
+        'more': more,
     })
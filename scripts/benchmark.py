@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Benchmark project code on generated data.
+
+Generated data is rolled back, generated thumbnails are not saved. Run it
+with project python, for example:
+
+    bin/python scripts/benchmark.py positions --votes 1000 10000
+
+"""
+
+import argparse
+import contextlib
+import pathlib
+import random
+import time
+
+import django
+import numpy as np
+
+from manopozicija.utils.scripting import set_up_environment
+
+set_up_environment()
+django.setup()
+
+from PIL import Image, ImageColor  # noqa: E402
+from sorl.thumbnail import default  # noqa: E402
+from sorl.thumbnail.images import ImageFile  # noqa: E402
+from sorl.thumbnail.parsers import parse_geometry  # noqa: E402
+from sorl.thumbnail.engines.pil_engine import Engine as PILEngine  # noqa: E402
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.contrib.contenttypes.models import ContentType  # noqa: E402
+from django.core.files.storage import FileSystemStorage  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from django.db.models import Value  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from manopozicija import actorindex  # noqa: E402
+from manopozicija import autocomplete  # noqa: E402
+from manopozicija import models  # noqa: E402
+from manopozicija import positions  # noqa: E402
+from manopozicija import services  # noqa: E402
+from manopozicija import thumbnails  # noqa: E402
+from manopozicija.db import Similarity  # noqa: E402
+
+
+FIRST_NAMES = ['Mantas', 'Juozas', 'Eugenijus', 'Eglė', 'Aušrinė', 'Žygimantas', 'Ingrida', 'Gabrielius', 'Viktorija', 'Šarūnas']
+SYLLABLES = ['ad', 'o', 'mė', 'nas', 'ber', 'na', 'to', 'nis', 'gen', 'tvi', 'las', 'šim', 'ny', 'tė', 'ku', 'bi', 'lius', 'žu', 'ką', 'čius']
+LETTERS = 'aąbcčdeęėfghiįyjklmnoprsštuųūvzž'
+
+
+@contextlib.contextmanager
+def rollback():
+    """Roll back all data generated for a benchmark."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+def analyze():
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def timeit(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return (time.perf_counter() - start) * 1000, result
+
+
+def report(name, times, extra=''):
+    p50, p99 = np.percentile(times, [50, 99])
+    print('  %-12s p50: %8.3f ms, p99: %8.3f ms, min: %8.3f ms%s' % (name, p50, p99, min(times), extra))
+
+
+# Positions
+# ---------
+
+def benchmark_positions(args):
+    for n in args.votes:
+        with rollback():
+            print('Generating %d votes...' % n)
+            group, users = generate_votes(random.Random(args.seed), n, args.votes_per_user, args.actors, args.arguments)
+            for name, func in [
+                ('query', services.compute_positions),
+                ('precomputed', services.compare_positions),
+                ('numpy', positions.compare_positions),
+            ]:
+                report(name, [timeit(func, group, users[0])[0] for i in range(args.repeat)])
+
+            # All users at once, time is given per user.
+            for name, func in [
+                ('query', lambda group, users: [services.compute_positions(group, user) for user in users]),
+                ('numpy', positions.compare_users_positions),
+            ]:
+                times = [timeit(func, group, users)[0] / len(users) for i in range(max(1, args.repeat // 10))]
+                report(name, times, ' per user, %d users' % len(users))
+
+
+def generate_votes(rng, votes, votes_per_user, actors, arguments):
+    now = timezone.now()
+    body = models.Body.objects.create(name='Benchmark')
+    topic = models.Topic.objects.create(title='Benchmark', default_body=body)
+
+    actors = models.Actor.objects.bulk_create([
+        models.Actor(first_name='Actor', last_name=str(i), title='benchmark')
+        for i in range(actors)
+    ])
+    group = models.Group.objects.create(title='Benchmark', timestamp=now)
+    group.members.set(actors)
+
+    arguments = models.Argument.objects.bulk_create([
+        models.Argument(topic=topic, title='argument %d' % i)
+        for i in range(arguments)
+    ])
+    models.ActorArgumentPosition.objects.bulk_create([
+        models.ActorArgumentPosition(actor=actor, argument=argument, position=rng.choice([-1, 0, 1]))
+        for actor in actors
+        for argument in rng.sample(arguments, min(5, len(arguments)))
+    ], batch_size=1000)
+
+    content_type = ContentType.objects.get_for_model(models.Quote)
+    posts = models.Post.objects.bulk_create([
+        models.Post(body=body, topic=topic, actor=actor, position=0, timestamp=now, content_type=content_type, object_id=i)
+        for i, actor in enumerate(actors * 2)
+    ], batch_size=1000)
+
+    votes_per_user = min(votes, votes_per_user, len(posts))
+    users = User.objects.bulk_create([
+        User(username='benchmark-%d' % i)
+        for i in range(max(1, votes // votes_per_user))
+    ])
+    models.UserPostPosition.objects.bulk_create([
+        models.UserPostPosition(user=user, post=post, position=rng.choice([-1, 1]))
+        for user in users
+        for post in rng.sample(posts, votes_per_user)
+    ], batch_size=1000)
+    models.UserArgumentPosition.objects.bulk_create([
+        models.UserArgumentPosition(user=user, argument=argument, position=position, total=position, count=1)
+        for user in users
+        for argument in rng.sample(arguments, min(20, len(arguments)))
+        for position in [rng.choice([-1, -0.5, 0.5, 1])]
+    ], batch_size=1000)
+    models.UserActorDistance.objects.bulk_create([
+        models.UserActorDistance(user_id=user, actor_id=actor, total=total, weight=weight, distance=total / weight)
+        for (user, actor), (total, weight) in services.get_user_actor_distances().items()
+    ], batch_size=1000)
+
+    analyze()
+    return group, users
+
+
+# Quotes
+# ------
+
+def benchmark_quotes(args):
+    rng = random.Random(args.seed)
+    words = list({
+        ''.join(rng.choice(LETTERS) for j in range(rng.randint(2, 10)))
+        for i in range(10000)
+    })
+    with rollback():
+        print('Generating %d quotes in %d sources...' % (args.quotes, args.sources))
+        topic, texts = generate_quotes(rng, words, args.quotes, args.sources)
+
+        # Half of the checks are near duplicates with one word changed, other half are new quotes.
+        checks = []
+        for source, text in rng.sample(texts, args.queries):
+            tokens = text.split()
+            if len(checks) % 2:
+                tokens[rng.randrange(len(tokens))] = rng.choice(words)
+            else:
+                tokens = rng.sample(words, len(tokens))
+            checks.append((source, ' '.join(tokens)))
+
+        funcs = [
+            ('two queries', is_duplicate_quote),
+            ('one query', services.is_duplicate_quote),
+        ]
+        # Checks are interleaved, so that both functions run with the same cache state.
+        times = {name: [] for name, func in funcs}
+        results = {name: [] for name, func in funcs}
+        for source, text in checks:
+            for name, func in funcs:
+                ms, result = timeit(func, topic, source.actor, source.source_link, text)
+                times[name].append(ms)
+                results[name].append(result)
+        for name, func in funcs:
+            report(name, times[name], ', duplicates: %d' % sum(results[name]))
+        if len(set(map(tuple, results.values()))) > 1:
+            print('  results do not match')
+
+
+def is_duplicate_quote(topic, actor, source_link, text):
+    """Previous QuoteForm.clean_text check."""
+    quote = None
+    source = models.Source.objects.filter(actor=actor, source_link=source_link).first()
+    if source:
+        quote = (
+            models.Quote.objects.
+            annotate(similarity=Similarity('text', Value(text))).
+            filter(source=source, similarity__gt=0.9).
+            first()
+        )
+    return bool(quote and models.Post.objects.filter(topic=topic, quote=quote).exists())
+
+
+def generate_quotes(rng, words, quotes, sources):
+    now = timezone.now()
+    user = User.objects.create(username='benchmark')
+    body = models.Body.objects.create(name='Benchmark')
+    topic = models.Topic.objects.create(title='Benchmark', default_body=body)
+    actors = models.Actor.objects.bulk_create([
+        models.Actor(first_name='Actor', last_name=str(i), title='benchmark')
+        for i in range(max(1, sources // 10))
+    ])
+    sources = models.Source.objects.bulk_create([
+        models.Source(actor=actors[i % len(actors)], source_link='http://example.com/%d' % i, timestamp=now)
+        for i in range(sources)
+    ])
+    texts = [
+        (rng.choice(sources), ' '.join(rng.choice(words) for j in range(rng.randint(8, 24))))
+        for i in range(quotes)
+    ]
+    objs = models.Quote.objects.bulk_create([
+        models.Quote(user=user, source=source, text=text)
+        for source, text in texts
+    ], batch_size=1000)
+    content_type = ContentType.objects.get_for_model(models.Quote)
+    models.Post.objects.bulk_create([
+        models.Post(
+            body=body, topic=topic, actor_id=source.actor_id, position=0, timestamp=now,
+            content_type=content_type, object_id=quote.pk,
+        )
+        for quote, (source, text) in zip(objs, texts)
+    ], batch_size=1000)
+    analyze()
+    return topic, texts
+
+
+# Autocomplete
+# ------------
+
+def benchmark_autocomplete(args):
+    rng = random.Random(args.seed)
+    with rollback():
+        print('Generating %d actors...' % args.actors)
+        names = generate_actors(rng, args.actors)
+
+        ms, index = timeit(actorindex.build_index, 'benchmark')
+        print('Index built in %.1f ms' % ms)
+
+        # Prefixes users type, from one letter to a whole name.
+        prefixes = [name[:rng.randint(1, len(name))].lower() for name in (rng.choice(names) for i in range(args.queries))]
+        for name, func in [
+            ('query', lambda q: list(autocomplete.search(q)[:10])),
+            ('index', lambda q: index.search(q)[:10]),
+        ]:
+            report(name, [timeit(func, q)[0] for q in prefixes])
+
+
+def generate_actors(rng, actors):
+    last_names = [
+        ''.join(rng.choice(SYLLABLES) for i in range(rng.randint(2, 4))).capitalize()
+        for i in range(actors)
+    ]
+    models.Actor.objects.bulk_create([
+        models.Actor(
+            first_name=rng.choice(FIRST_NAMES),
+            last_name=last_name,
+            title='benchmark',
+            photo=rng.choice(['', 'actors/benchmark.jpg']),
+        )
+        for last_name in last_names
+    ], batch_size=1000)
+    analyze()
+    return last_names
+
+
+# Thumbnails
+# ----------
+
+class PasteEngine(PILEngine):
+    """Previous thumbnails.Engine, pasting each created thumbnail on background."""
+
+    def create(self, image, geometry, options):
+        thumb = super().create(image, geometry, options)
+        background = options.get('background')
+        if background:
+            try:
+                bgthumb = Image.new('RGB', thumb.size, ImageColor.getcolor(background, 'RGB'))
+                bgthumb.paste(thumb, mask=thumb.split()[3])
+                return bgthumb
+            except Exception:
+                return thumb
+        return thumb
+
+
+def benchmark_thumbnails(args):
+    path = pathlib.Path(args.path)
+    storage = FileSystemStorage(location=str(path))
+    names = sorted(str(x.relative_to(path)) for x in path.glob('**/*') if x.is_file())
+    geometries = [thumbnails.PHOTO, thumbnails.SMALL_PHOTO, thumbnails.LOGO]
+    print('%d images, %d thumbnails per image' % (len(names), len(geometries)))
+    for name, engine in [
+        ('paste', PasteEngine),
+        ('flatten', thumbnails.Engine),
+    ]:
+        # New engine instance on each run, so that cached sources are not reused.
+        report(name, [timeit(render_thumbnails, engine(), storage, names, geometries)[0] for i in range(args.repeat)])
+
+
+def render_thumbnails(engine, storage, names, geometries):
+    for name in names:
+        for geometry, options in geometries:
+            # Same steps as sorl ThumbnailBackend.get_thumbnail, except storage.
+            options = dict(default.backend.default_options, **options)
+            source = ImageFile(name, storage)
+            image = engine.get_image(source)
+            options['image_info'] = engine.get_image_info(image)
+            thumb = engine.create(image, parse_geometry(geometry, engine.get_image_ratio(image, options)), options)
+            engine._get_raw_data(thumb, options['format'], options['quality'], options['image_info'])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    sub = subparsers.add_parser('positions', help='position comparison')
+    sub.add_argument('--votes', type=int, nargs='+', default=[1000, 10000, 100000], help="Number of user votes")
+    sub.add_argument('--votes-per-user', type=int, default=1000)
+    sub.add_argument('--actors', type=int, default=1500, help="Number of group members")
+    sub.add_argument('--arguments', type=int, default=50)
+    sub.add_argument('--repeat', type=int, default=20)
+    sub.add_argument('--seed', type=int, default=0)
+    sub.set_defaults(func=benchmark_positions)
+
+    sub = subparsers.add_parser('quotes', help='duplicate quote detection')
+    sub.add_argument('--quotes', type=int, default=100000)
+    sub.add_argument('--sources', type=int, default=100)
+    sub.add_argument('--queries', type=int, default=200)
+    sub.add_argument('--seed', type=int, default=0)
+    sub.set_defaults(func=benchmark_quotes)
+
+    sub = subparsers.add_parser('autocomplete', help='actor autocomplete search')
+    sub.add_argument('--actors', type=int, default=20000)
+    sub.add_argument('--queries', type=int, default=1000)
+    sub.add_argument('--seed', type=int, default=0)
+    sub.set_defaults(func=benchmark_autocomplete)
+
+    sub = subparsers.add_parser('thumbnails', help='thumbnail creation of template thumbnails')
+    sub.add_argument('path', nargs='?', default='fixtures/images', help="Path to directory with images")
+    sub.add_argument('--repeat', type=int, default=10)
+    sub.set_defaults(func=benchmark_thumbnails)
+
+    args = parser.parse_args(args)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()